@@ -0,0 +1,118 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        alloc.py
+#
+# Abstract:
+#
+#        Per-packet object allocation count for encode/decode
+#
+
+"""
+Counts how many cursor-layer objects (cursors, holes, bounds
+context managers, byte views) and Python function calls it takes
+to encode or decode one packet.  Python 2 has no allocation tracer,
+so objects are counted by watching their constructors run.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/alloc.py
+"""
+
+import array
+import struct
+import sys
+
+import pike.core
+import pike.netbios
+import pike.smb2
+
+def create_request():
+    nb = pike.netbios.Netbios()
+    smb_req = pike.smb2.Smb2(nb)
+    create_req = pike.smb2.CreateRequest(smb_req)
+    create_req.name = 'foo\\bar.txt'
+    pike.smb2.MaximalAccessRequest(create_req)
+    lease_req = pike.smb2.LeaseRequest(create_req)
+    lease_req.lease_state = pike.smb2.SMB2_LEASE_READ_CACHING
+    smb_req.credit_charge = 1
+    smb_req.message_id = 1
+    return nb
+
+def write_request():
+    nb = pike.netbios.Netbios()
+    smb_req = pike.smb2.Smb2(nb)
+    write_req = pike.smb2.WriteRequest(smb_req)
+    write_req.file_id = (1, 2)
+    write_req.buffer = 'x' * 4096
+    smb_req.credit_charge = 1
+    smb_req.message_id = 2
+    return nb
+
+def read_response():
+    data = 'x' * 4096
+    header = struct.pack('<4sHHLHHLLQQQ16s',
+                         '\xfeSMB', 64, 1, 0, pike.smb2.SMB2_READ, 1,
+                         pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR,
+                         0, 3, 0, 1, '\0' * 16)
+    body = struct.pack('<HBBLLL', 17, 80, 0, len(data), 0, 0)
+    packet = header + body + data
+    return bytearray(struct.pack('>L', len(packet)) + packet)
+
+_tracked = set(['Cursor', 'Hole', 'Bounds', 'ByteView'])
+
+def count(func):
+    counts = {'objects': 0, 'calls': 0}
+
+    def profile(frame, event, arg):
+        if event != 'call':
+            return
+        counts['calls'] += 1
+        code = frame.f_code
+        if code.co_name == '__init__' and \
+           code.co_filename.endswith('core.py') and \
+           frame.f_locals['self'].__class__.__name__ in _tracked:
+            counts['objects'] += 1
+
+    sys.setprofile(profile)
+    try:
+        func()
+    finally:
+        sys.setprofile(None)
+    return counts
+
+def run(name, func):
+    counts = count(func)
+    print '%-16s %5d cursor objects %6d calls' % (name, counts['objects'], counts['calls'])
+
+if __name__ == '__main__':
+    create = create_request()
+    write = write_request()
+    read = read_response()
+    run('encode create', create.serialize)
+    run('encode write', write.serialize)
+    run('decode read', lambda: pike.netbios.Netbios().parse(read))
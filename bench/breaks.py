@@ -0,0 +1,147 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        breaks.py
+#
+# Abstract:
+#
+#        Break storm and cancel lookup benchmark
+#
+
+"""
+Measures the cost of claiming oplock and lease break notifications
+and of cancelling requests by async id as the number outstanding
+grows.  A stand-in server on the loopback interface sends a storm
+of break notifications and interim responses, which the client
+queues.  The notifications are then claimed in random order with
+L{pike.model.Client.oplock_break_future} and
+L{pike.model.Client.lease_break_future}, and each pending request is
+cancelled by async id.  The cost per operation should not depend on
+how many are outstanding.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/breaks.py
+"""
+
+import array
+import random
+import socket
+import struct
+import threading
+import time
+
+import pike.model
+import pike.ntstatus
+import pike.smb2
+
+import commands
+
+_unsolicited = 0xffffffffffffffff
+
+class StandInServer(threading.Thread):
+    """ Writes one canned stream to each client, then discards input """
+    def __init__(self, stream):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = stream
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            (sock, _) = self.listener.accept()
+            sock.sendall(self.stream)
+            while sock.recv(65536):
+                pass
+            sock.close()
+
+def lease_key(i):
+    return array.array('B', struct.pack('<QQ', i, 0))
+
+def oplock_break(i):
+    body = struct.pack('<HBBLQQ', 24, 1, 0, 0, i, i)
+    return commands._response(pike.smb2.SMB2_OPLOCK_BREAK, body,
+                              message_id=_unsolicited)
+
+def lease_break(i):
+    body = struct.pack('<HHL16sLLLLL', 44, 0, 0, lease_key(i).tostring(),
+                       0, 0, 0, 0, 0)
+    return commands._response(pike.smb2.SMB2_OPLOCK_BREAK, body,
+                              message_id=_unsolicited)
+
+def interim(i):
+    body = struct.pack('<HHLB', 9, 0, 0, 0)
+    return commands._response(pike.smb2.SMB2_READ, body, message_id=i,
+                              status=int(pike.ntstatus.STATUS_PENDING),
+                              async_id=i)
+
+def timed(func, items):
+    start = time.time()
+    for item in items:
+        func(item)
+    return (time.time() - start) / len(items) * 1e6
+
+def run(count):
+    stream = ''.join(str(make(i))
+                     for make in (oplock_break, lease_break, interim)
+                     for i in xrange(count))
+    server = StandInServer(stream)
+    server.start()
+
+    client = pike.model.Client()
+    conn = client.connect('127.0.0.1', server.port)
+    futures = []
+    for mid in xrange(count):
+        future = pike.model.Future(None)
+        conn._future_map[mid] = future
+        futures.append(future)
+    while futures[-1].interim_response is None:
+        pike.model.event_loop.poll(1)
+
+    order = range(count)
+    random.shuffle(order)
+
+    def cancel(i):
+        req = conn.request()
+        pike.smb2.Cancel(req)
+        req.async_id = i
+        req.flags |= pike.smb2.SMB2_FLAGS_ASYNC_COMMAND
+        conn.submit(req.parent)
+
+    print '%6d outstanding %6.1f us/oplock %6.1f us/lease %6.1f us/cancel' % (
+        count,
+        timed(lambda i: client.oplock_break_future((i, i)), order),
+        timed(lambda i: client.lease_break_future(lease_key(i)), order),
+        timed(cancel, order))
+    conn.close()
+
+if __name__ == '__main__':
+    for count in (1000, 10000, 50000):
+        run(count)
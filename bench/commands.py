@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        commands.py
+#
+# Abstract:
+#
+#        Encode/decode microbenchmark for hot SMB2 commands
+#
+
+"""
+Times encoding of create/read/write/close requests and decoding of
+create/read/write/close responses and a directory listing, each as
+a single-command netbios frame.  A 64 KiB listing is also decoded
+with lazy decoding enabled, with and without iterating its entries.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/commands.py
+"""
+
+import array
+import struct
+import timeit
+
+import pike.netbios
+import pike.nttime
+import pike.smb2
+
+def _request(cls, **attrs):
+    nb = pike.netbios.Netbios()
+    smb_req = pike.smb2.Smb2(nb)
+    req = cls(smb_req)
+    for (name, value) in attrs.iteritems():
+        setattr(req, name, value)
+    smb_req.credit_charge = 1
+    smb_req.message_id = 1
+    return nb
+
+def _response(command, body, message_id=1, credit=1, status=0,
+              async_id=None):
+    flags = pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR
+    if async_id is None:
+        async_id = 1 << 32
+    else:
+        flags |= pike.smb2.SMB2_FLAGS_ASYNC_COMMAND
+    header = struct.pack('<4sHHLHHLLQQQ16s',
+                         '\xfeSMB', 64, 1, status, command, credit,
+                         flags, 0, message_id, async_id, 1, '\0' * 16)
+    packet = header + body
+    return bytearray(struct.pack('>L', len(packet)) + packet)
+
+_now = long(pike.nttime.NtTime('2013-01-01 00:00:00'))
+_times = (_now,) * 4
+
+def create_response():
+    body = struct.pack('<HBBLQQQQQQLLQQLL', 89, 0, 0, 1,
+                       *(_times + (4096, 100,
+                                   pike.smb2.FILE_ATTRIBUTE_NORMAL, 0,
+                                   1, 2, 0, 0)))
+    return _response(pike.smb2.SMB2_CREATE, body + '\0' * 8)
+
+def close_response():
+    body = struct.pack('<HHLQQQQQQL', 60, 0, 0,
+                       *(_times + (4096, 100, pike.smb2.FILE_ATTRIBUTE_NORMAL)))
+    return _response(pike.smb2.SMB2_CLOSE, body)
+
+def read_response():
+    data = 'x' * 4096
+    body = struct.pack('<HBBLLL', 17, 80, 0, len(data), 0, 0)
+    return _response(pike.smb2.SMB2_READ, body + data)
+
+def write_response():
+    body = struct.pack('<HHLLHH', 17, 0, 4096, 0, 0, 0)
+    return _response(pike.smb2.SMB2_WRITE, body)
+
+def directory_response(count=100):
+    entries = []
+    for i in xrange(count):
+        name = (u'file%04d.txt' % i).encode('utf-16le')
+        size = 64 + len(name)
+        padded = (size + 7) & ~7
+        next_offset = padded if i != count - 1 else 0
+        entry = struct.pack('<LLQQQQQQLL', next_offset, i,
+                            *(_times + (100, 4096,
+                                        pike.smb2.FILE_ATTRIBUTE_NORMAL,
+                                        len(name))))
+        entries.append((entry + name).ljust(padded if next_offset else size, '\0'))
+    data = ''.join(entries)
+    body = struct.pack('<HHL', 9, 72, len(data))
+    return _response(pike.smb2.SMB2_QUERY_DIRECTORY, body + data, message_id=7)
+
+class DirectoryContext(object):
+    """ Stands in for the connection's request lookup upcall """
+    def __init__(self, lazy_decode=False):
+        self.lazy_decode = lazy_decode
+        nb = _request(pike.smb2.QueryDirectoryRequest,
+                      file_information_class=pike.smb2.FILE_DIRECTORY_INFORMATION)
+        self.request = nb[0]
+
+    def get_request(self, message_id):
+        return self.request
+
+def encode(nb):
+    nb.serialize()
+
+def decode(buf, context=None):
+    pike.netbios.Netbios(context).parse(buf)
+
+def run(name, func, number=5000):
+    best = min(timeit.repeat(func, repeat=5, number=number))
+    print '%-20s %8.2f us' % (name, best / number * 1e6)
+
+if __name__ == '__main__':
+    file_id = (1, 2)
+    create = _request(pike.smb2.CreateRequest, name='foo\\bar.txt')
+    read = _request(pike.smb2.ReadRequest, file_id=file_id, length=4096)
+    write = _request(pike.smb2.WriteRequest, file_id=file_id, buffer='x' * 4096)
+    close = _request(pike.smb2.CloseRequest, file_id=file_id)
+
+    run('encode create', lambda: encode(create))
+    run('encode read', lambda: encode(read))
+    run('encode write', lambda: encode(write))
+    run('encode close', lambda: encode(close))
+
+    responses = [('decode create', create_response()),
+                 ('decode read', read_response()),
+                 ('decode write', write_response()),
+                 ('decode close', close_response())]
+    for (name, buf) in responses:
+        run(name, lambda: decode(buf))
+
+    listing = directory_response()
+    context = DirectoryContext()
+    run('decode dir x100', lambda: decode(listing, context), number=200)
+
+    # A listing filling a 64 KiB output buffer, decoded eagerly,
+    # lazily, and lazily followed by iterating the entries
+    listing = directory_response(count=740)
+    lazy = DirectoryContext(lazy_decode=True)
+    def lazy_iterate():
+        nb = pike.netbios.Netbios(lazy)
+        nb.parse(listing)
+        for entry in nb[0][0]:
+            pass
+    run('decode dir 64k', lambda: decode(listing, context), number=20)
+    run('lazy dir 64k', lambda: decode(listing, lazy), number=2000)
+    run('lazy dir 64k iter', lazy_iterate, number=20)
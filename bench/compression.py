@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        compression.py
+#
+# Abstract:
+#
+#        Compression transform benchmark
+#
+
+"""
+Measures the bytes on the wire and the CPU time per MiB of encoding
+write requests of 64 KiB and 1 MiB with each compression transform
+(LZNT1, LZ77, and chained LZ77 with Pattern_V1), and of decoding read
+responses compressed the same way, for data that is all zeros, text
+(pike's own source) and random.
+
+The codecs are pure Python, so compression pays off on links which
+are slower than its throughput on compressible data.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/compression.py
+"""
+
+import array
+import os
+import struct
+import timeit
+
+import pike.compression
+import pike.netbios
+import pike.smb2
+
+import commands
+
+MiB = 1 << 20
+
+class CompressionContext(object):
+    # Stands in for a connection which negotiated compression
+    def __init__(self):
+        self.codecs = {
+            pike.smb2.SMB2_COMPRESSION_LZNT1: pike.compression.LZNT1(),
+            pike.smb2.SMB2_COMPRESSION_LZ77: pike.compression.LZ77()}
+
+    def compression_codec(self, algorithm):
+        return self.codecs.get(algorithm)
+
+configs = [
+    ('none', None, False),
+    ('lznt1', pike.smb2.SMB2_COMPRESSION_LZNT1, False),
+    ('lz77', pike.smb2.SMB2_COMPRESSION_LZ77, False),
+    ('chained', pike.smb2.SMB2_COMPRESSION_LZ77, True)]
+
+def transform(nb, context, algorithm, chained):
+    transform = pike.smb2.CompressionTransformHeader(nb, context)
+    transform.algorithm = algorithm
+    transform.chained = chained
+    transform.pattern = chained
+    return transform
+
+def write_request(context, data, algorithm, chained):
+    nb = pike.netbios.Netbios(context=context)
+    smb_req = pike.smb2.Smb2(nb)
+    write = pike.smb2.WriteRequest(smb_req)
+    write.file_id = (0, 0)
+    write.buffer = data
+    smb_req.credit_charge = 1
+    smb_req.message_id = 1
+    smb_req.session_id = 1
+    if algorithm is not None:
+        transform(nb, context, algorithm, chained)
+    return nb
+
+def read_response(context, data, algorithm, chained):
+    body = struct.pack('<HBBLLL', 17, 80, 0, len(data), 0, 0)
+    frame = commands._response(pike.smb2.SMB2_READ, body + data)
+    if algorithm is None:
+        return frame
+    message = str(frame[4:])
+    compressor = transform(None, context, algorithm, chained)
+    if chained:
+        parts = compressor._compress_chained(message)
+    else:
+        parts = compressor._compress(message)
+    if parts is None:
+        return frame
+    packet = ''.join(part if isinstance(part, str) else part.tostring()
+                     for part in parts)
+    return bytearray(struct.pack('>L', len(packet)) + packet)
+
+def parse(context, frame):
+    nb = pike.netbios.Netbios(context=context)
+    nb.parse(frame)
+    return nb
+
+def run(kind, data, name, algorithm, chained):
+    context = CompressionContext()
+    size = len(data)
+    number = max(1, 2 * MiB / size)
+    buf = array.array('B', data)
+    wire = len(write_request(context, buf, algorithm, chained).serialize())
+    encode = min(timeit.repeat(
+        lambda: write_request(context, buf, algorithm, chained).serialize(),
+        repeat=3, number=number)) / number
+    frame = read_response(context, data, algorithm, chained)
+    decode = min(timeit.repeat(lambda: parse(context, frame),
+                               repeat=3, number=number)) / number
+    print '%-6s %7d bytes %-7s wire %7d bytes %5.1f%% ' \
+        'encode %7.1f ms/MiB decode %7.1f ms/MiB' % (
+            kind, size, name, wire, 100.0 * wire / size,
+            encode * MiB / size * 1e3, decode * MiB / size * 1e3)
+
+def text(size):
+    source = open(os.path.join(os.path.dirname(pike.compression.__file__),
+                               'smb2.py')).read()
+    return (source * (size / len(source) + 1))[:size]
+
+if __name__ == '__main__':
+    for size in (65536, MiB):
+        for (kind, data) in (('zeros', '\0' * size),
+                             ('text', text(size)),
+                             ('random', os.urandom(size))):
+            for (name, algorithm, chained) in configs:
+                run(kind, data, name, algorithm, chained)
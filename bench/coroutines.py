@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        coroutines.py
+#
+# Abstract:
+#
+#        Concurrent coroutine benchmark
+#
+
+"""
+Compares echo requests issued one at a time from a blocking loop
+against the same requests issued by one coroutine per connection,
+all driven concurrently by the shared event loop.  The stand-in
+server from wait.py answers on the loopback interface after a 1 ms
+delay standing in for server latency.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/coroutines.py
+"""
+
+import time
+
+import pike.model
+import pike.smb2
+
+from wait import StandInServer, echo
+
+def echo_async(conn):
+    req = conn.request()
+    pike.smb2.EchoRequest(req)
+    return conn.submit(req.parent)
+
+@pike.model.coroutine
+def echoes(conn, count):
+    for i in xrange(count):
+        yield echo_async(conn)
+    raise pike.model.Return(count)
+
+def blocking(conns, count):
+    for conn in conns:
+        for i in xrange(count):
+            echo(conn)
+
+def concurrent(conns, count):
+    tasks = [echoes(conn, count) for conn in conns]
+    for task in tasks:
+        task.result()
+
+def run(server, connections, count=100):
+    client = pike.model.Client()
+    conns = [client.connect('127.0.0.1', server.port)
+             for i in xrange(connections)]
+    for (name, func) in (('blocking', blocking), ('coroutines', concurrent)):
+        start = time.time()
+        func(conns, count)
+        elapsed = time.time() - start
+        print '%4d connections %-10s %8.0f echo/s %5d credit window' % (
+            connections, name, connections * count / elapsed,
+            conns[0].credit_window)
+    for conn in conns:
+        conn.close()
+
+if __name__ == '__main__':
+    server = StandInServer(delay=0.001)
+    server.start()
+    for connections in (1, 8, 32):
+        run(server, connections)
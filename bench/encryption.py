@@ -0,0 +1,120 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        encryption.py
+#
+# Abstract:
+#
+#        Encryption throughput benchmark
+#
+
+"""
+Measures encryption and decryption throughput of the SMB3 transform
+ciphers (AES-128-CCM and AES-128-GCM) for messages of several sizes,
+using the same key for every message as a session does, and the cost
+of encoding a 64 KiB write request with and without encryption.
+
+GCM runs GHASH in Python unless the installed Crypto package provides
+GCM natively (e.g. PyCryptodome), so its numbers depend heavily on
+which is installed.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/encryption.py
+"""
+
+import array
+import os
+import time
+import timeit
+
+import pike.cipher
+import pike.netbios
+import pike.smb2
+
+from signing import SigningContext
+
+key = array.array('B', range(16))
+
+def run(name, cipher, size, total=8 << 20):
+    message = 'x' * size
+    aad = '\0' * 32
+    nonce = os.urandom(cipher.nonce_size)
+    count = max(total / size, 20)
+    (ciphertext, tag) = cipher.encrypt(nonce, aad, message)
+    results = []
+    for func in (lambda: cipher.encrypt(nonce, aad, message),
+                 lambda: cipher.decrypt(nonce, aad, ciphertext, tag)):
+        best = None
+        for i in xrange(3):
+            start = time.time()
+            for j in xrange(count):
+                func()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append(size * count / best / 1e6)
+    print '%-4s %8d bytes encrypt %8.1f MB/s decrypt %8.1f MB/s' % (
+        (name, size) + tuple(results))
+
+class TransformContext(SigningContext):
+    # Stands in for a connection with an encrypted session
+    def __init__(self, cipher):
+        SigningContext.__init__(self, None, None)
+        self.cipher = cipher
+
+    def encryption_cipher(self, session_id):
+        return self.cipher
+
+def write_request(context, size=65536):
+    nb = pike.netbios.Netbios(context=context)
+    smb_req = pike.smb2.Smb2(nb)
+    write = pike.smb2.WriteRequest(smb_req)
+    write.file_id = (0, 0)
+    write.buffer = array.array('B', 'x' * size)
+    smb_req.credit_charge = 1
+    smb_req.message_id = 1
+    smb_req.session_id = 1
+    if context is not None:
+        transform = pike.smb2.TransformHeader(nb)
+        transform.session_id = 1
+    return nb
+
+def run_encode(name, cipher, number=100):
+    context = None if cipher is None else TransformContext(cipher)
+    best = min(timeit.repeat(lambda: write_request(context).serialize(),
+                             repeat=3, number=number))
+    print '%-4s 64 KiB write request %8.1f us' % (name, best / number * 1e6)
+
+if __name__ == '__main__':
+    ccm = pike.cipher.AES128CCM(key)
+    gcm = pike.cipher.AES128GCM(key)
+    for size in (4096, 65536, 1 << 20):
+        run('ccm', ccm, size)
+        run('gcm', gcm, size)
+    run_encode('none', None)
+    run_encode('ccm', ccm)
+    run_encode('gcm', gcm)
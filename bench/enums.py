@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        enums.py
+#
+# Abstract:
+#
+#        Enum construction and decode mix microbenchmark
+#
+
+"""
+Times construction of the Enum values built for every decoded
+packet (header flags, command, status, file attributes, etc.),
+access to named values through the Enum class, and decoding of a
+realistic mix of responses.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/enums.py
+"""
+
+import timeit
+
+import pike.ntstatus
+import pike.smb2
+
+import commands
+
+# (Enum class, value) pairs constructed while decoding responses
+_values = [
+    (pike.smb2.Flags, pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR |
+                      pike.smb2.SMB2_FLAGS_SIGNED),
+    (pike.smb2.CommandId, pike.smb2.SMB2_READ),
+    (pike.ntstatus.Status, pike.ntstatus.STATUS_SUCCESS),
+    (pike.smb2.OplockLevel, pike.smb2.SMB2_OPLOCK_LEVEL_II),
+    (pike.smb2.FileAttributes, pike.smb2.FILE_ATTRIBUTE_ARCHIVE |
+                               pike.smb2.FILE_ATTRIBUTE_NORMAL),
+    (pike.smb2.CloseFlags, 0)]
+
+def construct():
+    for (cls, value) in _values:
+        cls(value)
+
+def named():
+    pike.smb2.Flags.SMB2_FLAGS_SIGNED
+    pike.smb2.CommandId.SMB2_READ
+    pike.ntstatus.Status.STATUS_PENDING
+    pike.smb2.FileAttributes.FILE_ATTRIBUTE_DIRECTORY
+
+def run(name, func, number):
+    best = min(timeit.repeat(func, repeat=5, number=number))
+    print '%-16s %8.2f us' % (name, best / number * 1e6)
+
+if __name__ == '__main__':
+    run('construct x%d' % len(_values), construct, 20000)
+    run('named x4', named, 20000)
+
+    # Mostly reads and writes, with some opens, closes and listings
+    context = commands.DirectoryContext()
+    mix = ([commands.read_response()] * 4 +
+           [commands.write_response()] * 3 +
+           [commands.create_response(), commands.close_response()])
+    listing = commands.directory_response(count=20)
+
+    def decode_mix():
+        for buf in mix:
+            commands.decode(buf)
+        commands.decode(listing, context)
+
+    run('decode mix x10', decode_mix, 500)
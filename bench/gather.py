@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        gather.py
+#
+# Abstract:
+#
+#        Chained future benchmark
+#
+
+"""
+Runs a chain of three dependent requests for each of many files,
+standing in for create, write and close.  The chains run one after
+another with blocking calls, and then all at once, chained with
+L{pike.model.Future.then} and waited for with L{pike.model.gather}.
+The stand-in server from wait.py answers echo requests on the
+loopback interface after a 1 ms delay standing in for server latency.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/gather.py
+"""
+
+import time
+
+import pike.model
+import pike.smb2
+
+from wait import StandInServer
+
+def echo_async(conn):
+    req = conn.request()
+    pike.smb2.EchoRequest(req)
+    return conn.submit(req.parent)[0]
+
+def blocking(conn, files):
+    for i in xrange(files):
+        for step in xrange(3):
+            echo_async(conn).result()
+
+def chained(conn, files):
+    futures = []
+    for i in xrange(files):
+        future = echo_async(conn)
+        future = future.then(lambda f: echo_async(conn))
+        future = future.then(lambda f: echo_async(conn))
+        futures.append(future)
+    pike.model.gather(futures)
+
+def run(server, files):
+    conn = pike.model.Client().connect('127.0.0.1', server.port)
+    for (name, func) in (('blocking', blocking), ('chained', chained)):
+        start = time.time()
+        func(conn, files)
+        elapsed = time.time() - start
+        print '%5d files %-10s %8.0f files/s' % (files, name, files / elapsed)
+    conn.close()
+
+if __name__ == '__main__':
+    server = StandInServer(delay=0.001)
+    server.start()
+    for files in (100, 1000):
+        run(server, files)
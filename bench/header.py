@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        header.py
+#
+# Abstract:
+#
+#        SMB2 header encode/decode microbenchmark
+#
+
+"""
+Times encoding and decoding of a netbios frame holding a single
+SMB2 echo, which is dominated by the 64-byte SMB2 header, and
+compares decoding the header fields one primitive at a time
+against a single precompiled struct.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/header.py
+"""
+
+import array
+import struct
+import timeit
+
+import pike.core
+import pike.netbios
+import pike.smb2
+
+def echo_request():
+    nb = pike.netbios.Netbios()
+    smb_req = pike.smb2.Smb2(nb)
+    pike.smb2.EchoRequest(smb_req)
+    smb_req.credit_charge = 1
+    smb_req.credit_request = 10
+    smb_req.message_id = 42
+    smb_req.session_id = 0x1234
+    smb_req.tree_id = 7
+    return nb
+
+def echo_response():
+    header = struct.pack('<4sHHLHHLLQLLQ16s',
+                         '\xfeSMB', 64, 1, 0,
+                         pike.smb2.SMB2_ECHO, 10,
+                         pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR,
+                         0, 42, 0, 7, 0x1234, '\0' * 16)
+    body = struct.pack('<HH', 4, 0)
+    return array.array('B', struct.pack('>L', len(header + body)) + header + body)
+
+def encode(nb):
+    nb.serialize()
+
+def decode(buf):
+    pike.netbios.Netbios().parse(buf)
+
+def fields_each(buf):
+    cur = pike.core.Cursor(buf, 4)
+    cur.decode_bytes(4)
+    cur.decode_uint16le()
+    cur.decode_uint16le()
+    cur.decode_uint32le()
+    cur.decode_uint16le()
+    cur.decode_uint16le()
+    cur.decode_uint32le()
+    cur.decode_uint32le()
+    cur.decode_uint64le()
+    cur.decode_uint64le()
+    cur.decode_uint64le()
+
+def fields_struct(buf):
+    cur = pike.core.Cursor(buf, 4)
+    cur.decode_struct(pike.smb2._smb2_header_prefix)
+
+def run(name, stmt, number):
+    best = min(timeit.repeat(stmt, repeat=5, number=number))
+    print '%-8s %8.2f us/frame' % (name, best / number * 1e6)
+
+if __name__ == '__main__':
+    nb = echo_request()
+    buf = echo_response()
+    run('encode', lambda: encode(nb), 20000)
+    run('decode', lambda: decode(buf), 20000)
+    run('fields', lambda: fields_each(buf), 20000)
+    run('struct', lambda: fields_struct(buf), 20000)
@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        imports.py
+#
+# Abstract:
+#
+#        Module import time benchmark
+#
+
+"""
+Times importing pike modules in fresh interpreter processes, as a
+short-lived worker process would.  Modules are byte-compiled first
+so that compilation is not measured.  Each module is imported after
+its pike dependencies, so the time shown is its own cost.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/imports.py
+"""
+
+import compileall
+import os
+import subprocess
+import sys
+
+import pike
+
+_script = """
+import time
+for name in %r:
+    __import__(name)
+start = time.time()
+__import__(%r)
+print time.time() - start
+"""
+
+# (label, modules imported beforehand, module timed)
+_modules = [
+    ('pike.core', [], 'pike.core'),
+    ('pike.ntstatus', ['pike.core'], 'pike.ntstatus'),
+    ('pike.smb2', ['pike.ntstatus', 'pike.nttime'], 'pike.smb2'),
+    ('pike.smb2 (total)', [], 'pike.smb2'),
+    ('pike.model (total)', [], 'pike.model')]
+
+def import_time(deps, name):
+    output = subprocess.check_output(
+        [sys.executable, '-c', _script % (deps, name)],
+        stderr=subprocess.STDOUT)
+    return float(output)
+
+def run(label, deps, name, repeat=20):
+    try:
+        best = min(import_time(deps, name) for i in xrange(repeat))
+    except subprocess.CalledProcessError as e:
+        print '%-20s unavailable (%s)' % (label, e.output.strip().splitlines()[-1])
+        return
+    print '%-20s %8.2f ms' % (label, best * 1e3)
+
+if __name__ == '__main__':
+    compileall.compile_dir(os.path.dirname(pike.__file__), quiet=True)
+    for (label, deps, name) in _modules:
+        run(label, deps, name)
@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        pipeline.py
+#
+# Abstract:
+#
+#        Pipelined request benchmark
+#
+
+"""
+Measures echo requests issued through a L{pike.model.Pipeline} of
+increasing depth on a single connection.  The stand-in server from
+wait.py answers on the loopback interface after a 1 ms delay
+standing in for server latency, so depth 1 is latency bound.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/pipeline.py
+"""
+
+import time
+
+import pike.model
+import pike.smb2
+
+from wait import StandInServer
+
+def echo_async(conn):
+    req = conn.request()
+    pike.smb2.EchoRequest(req)
+    return conn.submit(req.parent)[0]
+
+def run(server, depth, count=500):
+    conn = pike.model.Client().connect('127.0.0.1', server.port)
+    pipeline = pike.model.Pipeline(depth)
+    start = time.time()
+    for i in xrange(count):
+        pipeline.submit(echo_async, conn)
+    pipeline.wait()
+    elapsed = time.time() - start
+    print 'depth %3d %8.0f echo/s' % (depth, count / elapsed)
+    conn.close()
+
+if __name__ == '__main__':
+    server = StandInServer(delay=0.001)
+    server.start()
+    for depth in (1, 4, 16, 64):
+        run(server, depth)
@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        receive.py
+#
+# Abstract:
+#
+#        Connection receive throughput benchmark
+#
+
+"""
+Measures how quickly a L{pike.model.Connection} receives, parses
+and dispatches pipelined responses.  A stand-in server on the
+loopback interface accepts the connection, waits for a single byte
+from the client, and then writes a canned stream of responses as
+fast as the socket allows.  Each response completes a future
+registered for its message id.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/receive.py
+"""
+
+import select
+import socket
+import struct
+import threading
+import time
+
+import pike.model
+import pike.smb2
+
+import commands
+
+class StandInServer(threading.Thread):
+    """ Writes one canned response stream to each connecting client """
+    def __init__(self, stream):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = stream
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            (sock, _) = self.listener.accept()
+            sock.recv(1)
+            sock.sendall(self.stream)
+            sock.close()
+
+def echo_response(message_id):
+    return commands._response(pike.smb2.SMB2_ECHO, '\x04\0\0\0',
+                              message_id=message_id)
+
+def read_response(message_id, size):
+    data = 'x' * size
+    body = struct.pack('<HBBLLL', 17, 80, 0, size, 0, 0)
+    return commands._response(pike.smb2.SMB2_READ, body + data,
+                              message_id=message_id)
+
+def receive(client, port, count):
+    conn = client.connect('127.0.0.1', port)
+    futures = []
+    for mid in xrange(count):
+        future = pike.model.Future(None)
+        conn._future_map[mid] = future
+        futures.append(future)
+
+    # Wait for the connection to be established, then start the server
+    select.select([], [conn.socket], [])
+    start = time.time()
+    conn.socket.send('g')
+    futures[-1].wait()
+    elapsed = time.time() - start
+
+    conn.close()
+    return elapsed
+
+def run(name, make_response, count, repeat=5):
+    stream = ''.join(str(make_response(mid)) for mid in xrange(count))
+    server = StandInServer(stream)
+    server.start()
+    client = pike.model.Client()
+    best = min(receive(client, server.port, count) for i in xrange(repeat))
+    print '%-16s %10.0f frames/s %8.1f MB/s' % (
+        name, count / best, len(stream) / best / 1e6)
+
+if __name__ == '__main__':
+    run('echo', echo_response, 20000)
+    run('read 4k', lambda mid: read_response(mid, 4096), 5000)
+    run('read 64k', lambda mid: read_response(mid, 65536), 1000)
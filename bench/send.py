@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        send.py
+#
+# Abstract:
+#
+#        Connection send throughput benchmark
+#
+
+"""
+Measures how quickly a L{pike.model.Connection} serializes and sends
+queued requests.  The requests are submitted up front and the clock
+runs until a stand-in server on the loopback interface has received
+every byte of them.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/send.py
+"""
+
+import socket
+import threading
+import time
+
+import pike.model
+import pike.smb2
+
+class StandInServer(threading.Thread):
+    """ Reads and discards the expected number of bytes """
+    def __init__(self, expected):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.expected = expected
+        self.done = threading.Event()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            (sock, _) = self.listener.accept()
+            received = 0
+            while received < self.expected:
+                data = sock.recv(1 << 20)
+                if not data:
+                    break
+                received += len(data)
+            self.done.set()
+            sock.close()
+
+def echo(conn):
+    req = conn.request()
+    pike.smb2.EchoRequest(req)
+    return req.parent
+
+def write(conn, size):
+    req = conn.request()
+    write_req = pike.smb2.WriteRequest(req)
+    write_req.file_id = (1, 2)
+    write_req.buffer = 'x' * size
+    return req.parent
+
+def send(client, server, make_request, count):
+    conn = client.connect('127.0.0.1', server.port)
+    # Stand in for a credit window granted by the server
+    conn.credits = count
+    requests = [make_request(conn) for i in xrange(count)]
+
+    start = time.time()
+    for nb in requests:
+        conn.submit(nb)
+    while not server.done.is_set():
+        pike.model.event_loop.poll(0.01)
+    elapsed = time.time() - start
+
+    conn.close()
+    server.done.clear()
+    return elapsed
+
+def run(name, make_request, size, count, repeat=3):
+    server = StandInServer(size * count)
+    server.start()
+    client = pike.model.Client()
+    best = min(send(client, server, make_request, count)
+               for i in xrange(repeat))
+    print '%-16s %10.0f frames/s %8.1f MB/s' % (
+        name, count / best, size * count / best / 1e6)
+
+# Netbios length, SMB2 header and fixed part of each request
+_echo_size = 4 + 64 + 4
+_write_size = 4 + 64 + 48
+
+if __name__ == '__main__':
+    run('echo', echo, _echo_size, 20000)
+    run('write 64k', lambda conn: write(conn, 65536),
+        _write_size + 65536, 500)
+    run('write 4m', lambda conn: write(conn, 4 << 20),
+        _write_size + (4 << 20), 20)
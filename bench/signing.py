@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        signing.py
+#
+# Abstract:
+#
+#        Signing throughput benchmark
+#
+
+"""
+Measures signing throughput of the SMB 2.x (HMAC-SHA256), SMB3
+(AES-128-CMAC) and SMB 3.1.1 (AES-128-GMAC) digests for messages of
+several sizes up to 8 MiB, using the same key for every message as a
+session does, and of verifying the signature of a received 1 MiB
+read response.  Finally measures the per-packet cost of signing small
+echo requests, over encoding them unsigned, and of verifying small
+responses.
+
+GMAC is only fast when the installed Crypto package provides GCM
+natively; otherwise GHASH runs in Python.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/signing.py
+"""
+
+import array
+import struct
+import time
+import timeit
+
+import pike.cipher
+import pike.digest
+import pike.netbios
+import pike.smb2
+
+import commands
+
+def run(name, digest, size, total=16 << 20, minimum=100):
+    key = array.array('B', range(16))
+    message = array.array('B', 'x' * size)
+    count = max(total / size, minimum)
+    best = None
+    for i in xrange(3):
+        start = time.time()
+        for j in xrange(count):
+            digest(key, message)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print '%-6s %8d bytes %8.1f MB/s %8.1f us/message' % (
+        name, size, size * count / best / 1e6, best / count * 1e6)
+
+def signed_read_response(digest, key, size):
+    data = 'x' * size
+    body = struct.pack('<HBBLLL', 17, 80, 0, size, 0, 0)
+    frame = commands._response(pike.smb2.SMB2_READ, body + data)
+    struct.pack_into('<L', frame, 4 + 16, pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR |
+                     pike.smb2.SMB2_FLAGS_SIGNED)
+    frame[4+48:4+64] = digest(key, frame[4:])[:16].tostring()
+    nb = pike.netbios.Netbios()
+    nb.parse(frame)
+    return nb[0]
+
+def run_verify(name, digest, size=1 << 20, count=20):
+    key = array.array('B', range(16))
+    smb_res = signed_read_response(digest, key, size)
+    start = time.time()
+    for i in xrange(count):
+        smb_res.verify(digest, key)
+    elapsed = time.time() - start
+    print '%-6s verify %8d bytes %8.1f MB/s' % (
+        name, size, size * count / elapsed / 1e6)
+
+class SigningContext(object):
+    # Stands in for a connection with a signed session
+    def __init__(self, digest, key):
+        self.digest = digest
+        self.key = key
+
+    def signing_digest(self):
+        return self.digest
+
+    def signing_key(self, session_id):
+        return self.key
+
+def signed_echo(context):
+    nb = pike.netbios.Netbios(context=context)
+    smb_req = pike.smb2.Smb2(nb, context=context)
+    pike.smb2.EchoRequest(smb_req)
+    smb_req.credit_charge = 1
+    smb_req.credit_request = 1
+    smb_req.message_id = 1
+    smb_req.session_id = 1
+    if context is not None:
+        smb_req.flags |= pike.smb2.SMB2_FLAGS_SIGNED
+    return nb
+
+def run_small(name, digest, number=20000):
+    # Per-packet cost of signing small requests, over encoding alone
+    key = array.array('B', range(16))
+    context = SigningContext(digest, key)
+    smb_res = signed_read_response(digest, key, 0)
+    plain = min(timeit.repeat(lambda: signed_echo(None).serialize(),
+                              repeat=3, number=number))
+    signed = min(timeit.repeat(lambda: signed_echo(context).serialize(),
+                               repeat=3, number=number))
+    verify = min(timeit.repeat(lambda: smb_res.verify(digest, key),
+                               repeat=3, number=number))
+    print '%-6s sign %6.1f us/packet verify %6.1f us/packet' % (
+        name, (signed - plain) / number * 1e6, verify / number * 1e6)
+
+digests = [
+    ('hmac', pike.digest.sha256_hmac),
+    ('cmac', pike.digest.aes128_cmac),
+    ('gmac', pike.cipher.aes128_gmac)]
+
+if __name__ == '__main__':
+    print 'native gcm: %s' % pike.cipher.native_gcm
+    for size in (128, 4096):
+        for (name, digest) in digests:
+            run(name, digest, size)
+    for size in (65536, 1 << 20, 8 << 20):
+        for (name, digest) in digests:
+            run(name, digest, size, minimum=2)
+    for (name, digest) in digests:
+        run_verify(name, digest)
+    for (name, digest) in digests:
+        run_small(name, digest)
@@ -0,0 +1,138 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        signpool.py
+#
+# Abstract:
+#
+#        Signing pool benchmark
+#
+
+"""
+Measures signed read throughput on a single connection with
+signatures computed inline and in L{pike.model.SigningPool}s of
+increasing size.  A stand-in server on the loopback interface
+answers each signed read request with a signed response precomputed
+before the run starts, so that only the client's signing and
+verification are measured.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/signpool.py
+"""
+
+import array
+import socket
+import struct
+import threading
+import time
+
+import pike.digest
+import pike.model
+import pike.smb2
+
+import commands
+from signing import signed_read_response
+from wait import _recv_exactly
+
+key = array.array('B', range(16))
+
+class SignedReadServer(threading.Thread):
+    """
+    Answers read requests with signed responses.  Each response
+    grants two credits until the client has a window of depth, and
+    one credit after that.
+    """
+    def __init__(self, digest, size, count, depth):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        template = signed_read_response(digest, key, size).parent
+        self.responses = []
+        for message_id in xrange(count):
+            frame = bytearray(str(template.start.array))
+            struct.pack_into('<Q', frame, 4 + 24, message_id)
+            struct.pack_into('<H', frame, 4 + 14,
+                             2 if message_id < depth - 1 else 1)
+            frame[4+48:4+64] = '\0' * 16
+            frame[4+48:4+64] = digest(key, frame[4:])[:16].tostring()
+            self.responses.append(frame)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        (sock, _) = self.listener.accept()
+        while True:
+            length = _recv_exactly(sock, 4)
+            if length is None:
+                break
+            frame = _recv_exactly(sock, struct.unpack('>L', length)[0])
+            if frame is None:
+                break
+            message_id = struct.unpack_from('<Q', frame, 24)[0]
+            sock.sendall(self.responses[message_id])
+        sock.close()
+
+def read_async(conn, size):
+    req = conn.request()
+    req.session_id = 1
+    req.flags |= pike.smb2.SMB2_FLAGS_SIGNED
+    read = pike.smb2.ReadRequest(req)
+    read.length = size
+    read.file_id = (0, 0)
+    return conn.submit(req.parent)[0]
+
+def run(name, digest, size, pool, count=200, depth=16):
+    server = SignedReadServer(digest, size, count, depth)
+    server.start()
+    conn = pike.model.Client(signing_pool=pool).connect('127.0.0.1',
+                                                         server.port)
+    # Stand in for a negotiated, signed session
+    conn.signing_key = lambda session_id: key
+    conn.signing_digest = lambda: digest
+
+    pipeline = pike.model.Pipeline(depth)
+    start = time.time()
+    for i in xrange(count):
+        pipeline.submit(read_async, conn, size)
+    pipeline.wait()
+    elapsed = time.time() - start
+    print '%-6s %8d bytes %-10s %8.1f MB/s' % (
+        name, size, 'inline' if pool is None else
+        '%d workers' % pool.workers, size * count / elapsed / 1e6)
+    conn.close()
+    if pool is not None:
+        pool.close()
+
+if __name__ == '__main__':
+    for (name, digest) in (('hmac', pike.digest.sha256_hmac),
+                           ('cmac', pike.digest.aes128_cmac)):
+        for size in (4096, 65536, 1 << 20):
+            run(name, digest, size, None)
+            for workers in (1, 2, 4):
+                run(name, digest, size, pike.model.SigningPool(workers))
@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        wait.py
+#
+# Abstract:
+#
+#        Request round trip benchmark with many connections
+#
+
+"""
+Measures the round trip time of an echo request on one connection
+while a number of other connections to the same process sit idle.
+A stand-in server on the loopback interface answers echo requests.
+
+Run from the top of the source tree::
+
+    $ PYTHONPATH=. python bench/wait.py
+"""
+
+import socket
+import struct
+import threading
+import timeit
+
+import pike.model
+import pike.smb2
+
+import commands
+
+def _recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+class StandInServer(threading.Thread):
+    """ Answers echo requests, granting the credits asked for """
+    def __init__(self, delay=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.delay = delay
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1024)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            (sock, _) = self.listener.accept()
+            thread = threading.Thread(target=self.serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, sock):
+        lock = threading.Lock()
+        while True:
+            length = _recv_exactly(sock, 4)
+            if length is None:
+                break
+            frame = _recv_exactly(sock, struct.unpack('>L', length)[0])
+            if frame is None:
+                break
+            credit = struct.unpack_from('<H', frame, 14)[0]
+            message_id = struct.unpack_from('<Q', frame, 24)[0]
+            response = commands._response(pike.smb2.SMB2_ECHO, '\x04\0\0\0',
+                                          message_id=message_id,
+                                          credit=credit)
+            if self.delay:
+                # Requests in flight are delayed concurrently
+                timer = threading.Timer(self.delay, self.reply,
+                                        (sock, lock, response))
+                timer.daemon = True
+                timer.start()
+            else:
+                self.reply(sock, lock, response)
+        sock.close()
+
+    def reply(self, sock, lock, response):
+        with lock:
+            try:
+                sock.sendall(str(response))
+            except socket.error:
+                pass
+
+def echo(conn):
+    req = conn.request()
+    pike.smb2.EchoRequest(req)
+    conn.transceive(req.parent)
+
+def run(server, idle, number=1000):
+    client = pike.model.Client()
+    others = [client.connect('127.0.0.1', server.port) for i in xrange(idle)]
+    conn = client.connect('127.0.0.1', server.port)
+    echo(conn)
+
+    best = min(timeit.repeat(lambda: echo(conn), repeat=3, number=number))
+    print '%5d idle connections %8.1f us/echo' % (idle, best / number * 1e6)
+
+    for c in others + [conn]:
+        c.close()
+
+if __name__ == '__main__':
+    server = StandInServer()
+    server.start()
+    for idle in (0, 100, 500, 2000):
+        run(server, idle)
@@ -1 +1 @@
-__all__ = ['core', 'netbios', 'smb2', 'digest', 'model', 'nttime', 'ntstatus', 'test', 'kerberos']
+__all__ = ['core', 'netbios', 'smb2', 'digest', 'cipher', 'compression', 'model', 'nttime', 'ntstatus', 'test', 'kerberos']
@@ -0,0 +1,349 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        cipher.py
+#
+# Abstract:
+#
+#        Authenticated encryption (for SMB3)
+#
+
+"""
+AES-128-CCM and AES-128-GCM authenticated encryption, as used by the
+SMB3 transform header, and AES-128-GMAC signing.
+
+All are built on the ECB, CBC and CTR modes of PyCrypto, so that
+everything but GHASH runs in C.  Where the installed Crypto package
+provides the modes natively (as PyCryptodome does), those are used
+instead.
+
+@var native_gcm: Whether GCM and GMAC run natively rather than with
+GHASH in Python
+"""
+
+import Crypto.Cipher.AES
+import Crypto.Util.Counter
+import array
+import struct
+
+from digest import _buffer, _string, _cached
+
+native_ccm = hasattr(Crypto.Cipher.AES, 'MODE_CCM')
+native_gcm = hasattr(Crypto.Cipher.AES, 'MODE_GCM')
+
+_zero_block = '\0' * 16
+
+def _pad(length):
+    return '\0' * (-length % 16)
+
+class AES128CCM(object):
+    """
+    AES-128-CCM (RFC 3610) for a single key.
+
+    @ivar nonce_size: Size of the nonce used by SMB3 (11 bytes)
+    @ivar tag_size: Size of the authentication tag (16 bytes)
+    """
+    nonce_size = 11
+
+    def __init__(self, key, tag_size=16):
+        self.key = _string(key)
+        self.tag_size = tag_size
+        self._aes = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_ECB)
+
+    def _counter(self, nonce, initial):
+        # CTR mode over counter blocks flags || nonce || i
+        size = 15 - len(nonce)
+        return Crypto.Cipher.AES.new(
+            self.key, Crypto.Cipher.AES.MODE_CTR,
+            counter=Crypto.Util.Counter.new(8 * size,
+                                            prefix=chr(size - 1) + nonce,
+                                            initial_value=initial))
+
+    def _mac(self, nonce, aad, data):
+        # CBC-MAC of B0, the length-prefixed additional data and the
+        # message, each padded to whole blocks
+        size = 15 - len(nonce)
+        flags = (0x40 if len(aad) else 0) | \
+                ((self.tag_size - 2) / 2) << 3 | (size - 1)
+        length = struct.pack('>Q', len(data))[8-size:]
+        cbc = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_CBC,
+                                    _zero_block)
+        header = chr(flags) + nonce + length
+        if len(aad):
+            header += struct.pack('>H', len(aad)) + str(aad)
+            header += _pad(len(header))
+        state = cbc.encrypt(header)[-16:]
+        aligned = len(data) & ~15
+        if aligned:
+            state = cbc.encrypt(buffer(data, 0, aligned))[-16:]
+        if aligned < len(data):
+            state = cbc.encrypt(str(buffer(data, aligned)) +
+                                _pad(len(data)))
+        return state
+
+    def _xor_tag(self, nonce, mac):
+        size = 15 - len(nonce)
+        s0 = self._aes.encrypt(chr(size - 1) + nonce + '\0' * size)
+        return ''.join(chr(ord(a) ^ ord(b)) for (a, b) in
+                       zip(mac[:self.tag_size], s0))
+
+    def encrypt(self, nonce, aad, data):
+        """
+        Encrypt and authenticate a message.
+
+        @param nonce: The nonce, unique per message for the key
+        @param aad: Additional data, authenticated but not encrypted
+        @param data: The plaintext.  Each parameter may be a string,
+        array, bytearray, memoryview or L{core.ByteView}.
+        @return: A tuple of the ciphertext and the tag, as strings
+        """
+        nonce = _string(nonce)
+        aad = _buffer(aad)
+        data = _buffer(data)
+        if native_ccm:
+            ccm = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_CCM,
+                                        nonce=nonce, mac_len=self.tag_size,
+                                        msg_len=len(data),
+                                        assoc_len=len(aad))
+            ccm.update(_string(aad))
+            return ccm.encrypt_and_digest(_string(data))
+        tag = self._xor_tag(nonce, self._mac(nonce, aad, data))
+        return (self._counter(nonce, 1).encrypt(data), tag)
+
+    def decrypt(self, nonce, aad, data, tag):
+        """
+        Decrypt and verify a message.
+
+        @param tag: The tag received with the message
+        @return: The plaintext as a string, or None if the message
+        fails authentication
+        """
+        nonce = _string(nonce)
+        aad = _buffer(aad)
+        data = _buffer(data)
+        tag = _string(tag)
+        if native_ccm:
+            ccm = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_CCM,
+                                        nonce=nonce, mac_len=self.tag_size,
+                                        msg_len=len(data),
+                                        assoc_len=len(aad))
+            ccm.update(_string(aad))
+            try:
+                return ccm.decrypt_and_verify(_string(data), tag)
+            except ValueError:
+                return None
+        plaintext = self._counter(nonce, 1).decrypt(data)
+        if self._xor_tag(nonce, self._mac(nonce, aad, plaintext)) != tag:
+            return None
+        return plaintext
+
+def _ghash_tables(h):
+    # Multiplication by h in GF(2^128), in the bit order of GCM, is
+    # linear, so h * x is the xor over the bytes of x of a per-byte
+    # table lookup.  basis[j] is h times the block with only bit j set.
+    basis = []
+    for j in xrange(128):
+        basis.append(h)
+        h = (h >> 1) ^ (0xe1 << 120) if h & 1 else h >> 1
+    tables = []
+    for i in xrange(16):
+        table = [0] * 256
+        for k in xrange(8):
+            bit = 1 << k
+            value = basis[8 * i + 7 - k]
+            for b in xrange(bit):
+                table[bit | b] = table[b] ^ value
+        tables.append(table)
+    return tables
+
+class AES128GCM(object):
+    """
+    AES-128-GCM (NIST SP 800-38D) for a single key.
+
+    The hash subkey and its multiplication tables are computed once.
+    GHASH itself runs in Python unless the Crypto package provides GCM
+    natively.
+
+    @ivar nonce_size: Size of the nonce used by SMB3 (12 bytes)
+    """
+    nonce_size = 12
+    tag_size = 16
+
+    def __init__(self, key):
+        self.key = _string(key)
+        self._aes = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_ECB)
+        if not native_gcm:
+            (high, low) = struct.unpack('>QQ', self._aes.encrypt(_zero_block))
+            self._tables = _ghash_tables((high << 64) | low)
+
+    def _ghash(self, state, data):
+        # Absorb data, a whole number of blocks, into the GHASH state
+        (t0, t1, t2, t3, t4, t5, t6, t7,
+         t8, t9, t10, t11, t12, t13, t14, t15) = self._tables
+        words = struct.unpack('>%dQ' % (len(data) / 8), data)
+        high = state >> 64
+        low = state & 0xffffffffffffffff
+        for i in xrange(0, len(words), 2):
+            high ^= words[i]
+            low ^= words[i + 1]
+            state = (t0[high >> 56] ^ t1[(high >> 48) & 0xff] ^
+                     t2[(high >> 40) & 0xff] ^ t3[(high >> 32) & 0xff] ^
+                     t4[(high >> 24) & 0xff] ^ t5[(high >> 16) & 0xff] ^
+                     t6[(high >> 8) & 0xff] ^ t7[high & 0xff] ^
+                     t8[low >> 56] ^ t9[(low >> 48) & 0xff] ^
+                     t10[(low >> 40) & 0xff] ^ t11[(low >> 32) & 0xff] ^
+                     t12[(low >> 24) & 0xff] ^ t13[(low >> 16) & 0xff] ^
+                     t14[(low >> 8) & 0xff] ^ t15[low & 0xff])
+            high = state >> 64
+            low = state & 0xffffffffffffffff
+        return state
+
+    def _ghash_parts(self, state, parts):
+        # Absorb the concatenation of parts, zero padded to a whole
+        # number of blocks, without joining them
+        pending = ''
+        for part in parts:
+            start = 0
+            if pending:
+                start = min(16 - len(pending), len(part))
+                pending += str(buffer(part, 0, start))
+                if len(pending) < 16:
+                    continue
+                state = self._ghash(state, pending)
+            aligned = (len(part) - start) & ~15
+            if aligned:
+                state = self._ghash(state, buffer(part, start, aligned))
+            pending = str(buffer(part, start + aligned))
+        if pending:
+            state = self._ghash(state, pending + _pad(len(pending)))
+        return state
+
+    def _tag(self, nonce, aad, ciphertext, aad_parts=None):
+        if aad_parts is None:
+            aad_parts = (aad,)
+        state = self._ghash_parts(0, aad_parts)
+        state = self._ghash_parts(state, (ciphertext,))
+        aad_length = sum(len(part) for part in aad_parts)
+        state = self._ghash(state, struct.pack('>QQ', aad_length * 8,
+                                               len(ciphertext) * 8))
+        (high, low) = struct.unpack(
+            '>QQ', self._aes.encrypt(nonce + '\0\0\0\1'))
+        return struct.pack('>QQ', (state >> 64) ^ high,
+                           (state & 0xffffffffffffffff) ^ low)
+
+    def _counter(self, nonce):
+        return Crypto.Cipher.AES.new(
+            self.key, Crypto.Cipher.AES.MODE_CTR,
+            counter=Crypto.Util.Counter.new(32, prefix=nonce,
+                                            initial_value=2))
+
+    def encrypt(self, nonce, aad, data):
+        """
+        Encrypt and authenticate a message.
+
+        @param nonce: The nonce, unique per message for the key
+        @param aad: Additional data, authenticated but not encrypted
+        @param data: The plaintext.  Each parameter may be a string,
+        array, bytearray, memoryview or L{core.ByteView}.
+        @return: A tuple of the ciphertext and the tag, as strings
+        """
+        nonce = _string(nonce)
+        aad = _buffer(aad)
+        data = _buffer(data)
+        if native_gcm:
+            gcm = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_GCM,
+                                        nonce=nonce, mac_len=self.tag_size)
+            gcm.update(_string(aad))
+            return gcm.encrypt_and_digest(_string(data))
+        ciphertext = self._counter(nonce).encrypt(data) if len(data) else ''
+        return (ciphertext, self._tag(nonce, aad, ciphertext))
+
+    def decrypt(self, nonce, aad, data, tag):
+        """
+        Decrypt and verify a message.
+
+        @param tag: The tag received with the message
+        @return: The plaintext as a string, or None if the message
+        fails authentication
+        """
+        nonce = _string(nonce)
+        aad = _buffer(aad)
+        data = _buffer(data)
+        tag = _string(tag)
+        if native_gcm:
+            gcm = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_GCM,
+                                        nonce=nonce, mac_len=self.tag_size)
+            gcm.update(_string(aad))
+            try:
+                return gcm.decrypt_and_verify(_string(data), tag)
+            except ValueError:
+                return None
+        if self._tag(nonce, aad, data) != tag:
+            return None
+        return self._counter(nonce).decrypt(data) if len(data) else ''
+
+    def mac(self, nonce, *parts):
+        """
+        Compute the GMAC of a message: the GCM tag with the message as
+        additional data and nothing encrypted.
+
+        @param parts: The message, as for L{digest.AES128CMAC.digest}
+        @return: The tag as a string
+        """
+        nonce = _string(nonce)
+        parts = [_buffer(part) for part in parts]
+        if native_gcm:
+            gcm = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_GCM,
+                                        nonce=nonce, mac_len=self.tag_size)
+            for part in parts:
+                gcm.update(_string(part))
+            return gcm.digest()
+        return self._tag(nonce, None, '', aad_parts=parts)
+
+# Per-key GMAC state, bounded as in digest
+_gmac_cache = {}
+
+_gmac_header = struct.Struct('<12xHxxLxxxxQ')
+
+def aes128_gmac(key, *parts):
+    """
+    Sign an SMB2 message with AES-128-GMAC (SMB 3.1.1).
+
+    The nonce is derived from the message header, which must be
+    within the first part: the message id, then whether the message
+    is a response and whether it is a cancel request.
+
+    @param parts: The message, as for L{digest.sha256_hmac}
+    @return: The signature as an array.array('B')
+    """
+    key = _string(key)
+    gmac = _cached(_gmac_cache, key, AES128GCM)
+    (command, flags, message_id) = _gmac_header.unpack_from(_buffer(parts[0]))
+    # SMB2_FLAGS_SERVER_TO_REDIR, and SMB2_CANCEL
+    nonce = struct.pack('<QL', message_id,
+                        (flags & 0x1) | (command == 0x000c) << 1)
+    return array.array('B', gmac.mac(nonce, *parts))
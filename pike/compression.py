@@ -0,0 +1,504 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        compression.py
+#
+# Abstract:
+#
+#        Compression codecs (for SMB 3.1.1)
+#
+
+"""
+Plain LZ77 and LZNT1 compression (MS-XCA), as used by the SMB 3.1.1
+compression transform (see L{smb2.CompressionTransformHeader}).
+
+The codecs are pure Python, so they make up in technique what they
+lack in speed: matches are found through a table of the last position
+of each 3-byte string and extended by comparing slices of doubling
+length, runs of incompressible input are skipped over progressively
+faster, and literals are copied in runs rather than byte by byte.
+
+Each codec object holds an output buffer which is reused by every
+call to L{compress}, so a connection keeps one codec per algorithm.
+Input is consumed in a single pass, a chunk or flag group at a time,
+and decompression writes straight into the caller's buffer.
+"""
+
+import struct
+
+import core
+from digest import _string
+
+_uint16le = struct.Struct('<H')
+_uint32le = struct.Struct('<L')
+_token_uint16le = struct.Struct('<HH')
+_token_uint32le = struct.Struct('<HL')
+
+# Misses after which the match search skips ahead faster
+_skip_shift = 5
+
+def _match_length(data, earlier, later, limit):
+    # Length of the match at later of the earlier bytes, at least 3
+    # (the table key) and at most limit.  Slices of doubling size
+    # are compared rather than single bytes.
+    length = 3
+    step = 4
+    while length < limit:
+        step = min(step, limit - length)
+        if data[earlier + length:earlier + length + step] == \
+           data[later + length:later + length + step]:
+            length += step
+            step <<= 1
+        elif step == 1:
+            break
+        else:
+            step >>= 1
+    return length
+
+def _copy_match(out, position, distance, length):
+    # Copy an earlier match, which repeats if it overlaps itself
+    source = position - distance
+    if distance >= length:
+        out[position:position + length] = out[source:source + length]
+    else:
+        out[position:position + length] = \
+            (out[source:position] * (length // distance + 1))[:length]
+
+class _Codec(object):
+    def __init__(self):
+        self._out = bytearray()
+        self._table = {}
+
+    def _reserve(self, size):
+        # Grow the output buffer to at least size, keeping it for
+        # later calls
+        if len(self._out) < size:
+            self._out.extend(bytearray(size - len(self._out)))
+        return self._out
+
+class LZ77(_Codec):
+    """
+    Plain LZ77 codec (MS-XCA 2.3 and 2.4).
+
+    Items are flagged 32 at a time, most significant bit first, with
+    a set bit for a match.  Matches reach back up to 8 KiB and are of
+    any length, the longer ones sharing a nibble of a length byte
+    with the next.
+    """
+    max_distance = 8192
+
+    def compress(self, data, start=0, end=None):
+        """
+        Compress data[start:end].
+
+        @param data: The data, as a string
+        @return: A L{core.ByteView} of the compressed data, valid
+        until the next call
+        """
+        if end is None:
+            end = len(data)
+        size = end - start
+        # Worst case is all literals, with a flag word per 32
+        out = self._reserve(size + (size >> 3) + 8)
+        table = self._table
+        table.clear()
+
+        flags = 0
+        count = 0
+        flag_pos = 0
+        o = 4
+        half = 0
+        pos = start
+        literal = start
+        misses = 0
+        last = end - 3
+        while pos <= last:
+            key = data[pos:pos + 3]
+            candidate = table.get(key)
+            table[key] = pos
+            if candidate is None or pos - candidate > self.max_distance:
+                misses += 1
+                pos += 1 + (misses >> _skip_shift)
+                continue
+            misses = 0
+            length = _match_length(data, candidate, pos, end - pos)
+
+            (flags, count, flag_pos, o) = self._literals(
+                data, literal, pos, flags, count, flag_pos, o)
+
+            match = length - 3
+            token = (pos - candidate - 1) << 3
+            if match < 7:
+                _uint16le.pack_into(out, o, token | match)
+                o += 2
+            else:
+                _uint16le.pack_into(out, o, token | 7)
+                o += 2
+                match -= 7
+                if half:
+                    out[half] |= min(match, 15) << 4
+                    half = 0
+                else:
+                    half = o
+                    out[o] = min(match, 15)
+                    o += 1
+                if match >= 15:
+                    match -= 15
+                    if match < 255:
+                        out[o] = match
+                        o += 1
+                    else:
+                        out[o] = 255
+                        match += 15 + 7
+                        if match < 0x10000:
+                            _uint16le.pack_into(out, o + 1, match)
+                            o += 3
+                        else:
+                            _token_uint32le.pack_into(out, o + 1, 0, match)
+                            o += 7
+
+            flags = (flags << 1) | 1
+            count += 1
+            if count == 32:
+                _uint32le.pack_into(out, flag_pos, flags)
+                flags = 0
+                count = 0
+                flag_pos = o
+                o += 4
+
+            # Index short matches, whose positions are likely to be
+            # matched again
+            if length < 32:
+                for j in xrange(pos + 1, min(pos + length, last + 1)):
+                    table[data[j:j + 3]] = j
+            pos += length
+            literal = pos
+
+        (flags, count, flag_pos, o) = self._literals(
+            data, literal, end, flags, count, flag_pos, o)
+        # Unused flags are set, which ends decompression
+        unused = 32 - count
+        _uint32le.pack_into(out, flag_pos,
+                            ((flags << unused) | ((1 << unused) - 1)) &
+                            0xffffffff)
+        return core.ByteView(out, 0, o)
+
+    def _literals(self, data, start, end, flags, count, flag_pos, o):
+        # Copy literals in runs up to the next flag word
+        out = self._out
+        while start < end:
+            run = min(end - start, 32 - count)
+            out[o:o + run] = data[start:start + run]
+            o += run
+            start += run
+            flags <<= run
+            count += run
+            if count == 32:
+                _uint32le.pack_into(out, flag_pos, flags)
+                flags = 0
+                count = 0
+                flag_pos = o
+                o += 4
+        return (flags, count, flag_pos, o)
+
+    def decompress(self, data, out, offset, size):
+        """
+        Decompress data into out[offset:offset + size].
+
+        @param data: The compressed data
+        @param out: The output, a bytearray already at least
+        offset + size long
+        @raise core.BadPacket: If data is malformed, or does not
+        decompress to size bytes
+        """
+        data = _string(data)
+        length_in = len(data)
+        p = offset
+        end = offset + size
+        i = 0
+        half = 0
+        try:
+            while p < end:
+                (flags,) = _uint32le.unpack_from(data, i)
+                i += 4
+                bit = 31
+                while bit >= 0 and p < end:
+                    if not flags >> bit & 1:
+                        # Literals up to the next set flag
+                        run = bit - (flags & ((1 << bit) - 1)).bit_length() + 1
+                        run = min(run, end - p)
+                        if i + run > length_in:
+                            raise core.BadPacket()
+                        out[p:p + run] = data[i:i + run]
+                        p += run
+                        i += run
+                        bit -= run
+                        continue
+
+                    if i == length_in:
+                        # End of compressed data
+                        raise core.BadPacket()
+                    (token,) = _uint16le.unpack_from(data, i)
+                    i += 2
+                    length = token & 7
+                    distance = (token >> 3) + 1
+                    if length == 7:
+                        if half:
+                            length = ord(data[half]) >> 4
+                            half = 0
+                        else:
+                            length = ord(data[i]) & 15
+                            half = i
+                            i += 1
+                        if length == 15:
+                            length = ord(data[i])
+                            i += 1
+                            if length == 255:
+                                (length,) = _uint16le.unpack_from(data, i)
+                                i += 2
+                                if length == 0:
+                                    (length,) = _uint32le.unpack_from(data, i)
+                                    i += 4
+                                if length < 15 + 7:
+                                    raise core.BadPacket()
+                                length -= 15 + 7
+                            length += 15
+                        length += 7
+                    length += 3
+                    if distance > p - offset or p + length > end:
+                        raise core.BadPacket()
+                    _copy_match(out, p, distance, length)
+                    p += length
+                    bit -= 1
+        except (struct.error, IndexError):
+            raise core.BadPacket()
+
+# Uncompressed bytes in an LZNT1 chunk
+_lznt1_chunk_size = 4096
+
+def _lznt1_length_bits(position):
+    # Bits of a copy token holding the length, which shrink as the
+    # position in the chunk (and so the possible distance) grows
+    bits = 12
+    position -= 1
+    while position >= 0x10:
+        bits -= 1
+        position >>= 1
+    return bits
+
+_lznt1_bits = [12] + [_lznt1_length_bits(position)
+                      for position in xrange(1, _lznt1_chunk_size + 1)]
+
+class LZNT1(_Codec):
+    """
+    LZNT1 codec (MS-XCA 2.5).
+
+    Input is compressed in independent 4 KiB chunks, each stored
+    as is if it does not compress.  Items are flagged 8 at a time,
+    least significant bit first, and matches never leave their chunk.
+    """
+    def compress(self, data, start=0, end=None):
+        """
+        Compress data[start:end].
+
+        @param data: The data, as a string
+        @return: A L{core.ByteView} of the compressed data, valid
+        until the next call
+        """
+        if end is None:
+            end = len(data)
+        size = end - start
+        # Worst case is all literals, with a flag byte per 8, plus a
+        # header per chunk
+        out = self._reserve(size + (size >> 3) + (size >> 11) + 16)
+        o = 0
+        # Misses carry over, so that incompressible input is skipped
+        # over as quickly as by LZ77
+        misses = 0
+        for chunk in xrange(start, end, _lznt1_chunk_size):
+            chunk_end = min(chunk + _lznt1_chunk_size, end)
+            header = o
+            (o, misses) = self._chunk(data, chunk, chunk_end, o + 2, misses)
+            length = o - header - 2 if o is not None else None
+            if length is None or length >= chunk_end - chunk:
+                # Store the chunk uncompressed
+                length = chunk_end - chunk
+                out[header + 2:header + 2 + length] = data[chunk:chunk_end]
+                o = header + 2 + length
+                _uint16le.pack_into(out, header, 0x3000 | (length - 1))
+            else:
+                _uint16le.pack_into(out, header, 0xb000 | (length - 1))
+        return core.ByteView(out, 0, o)
+
+    def _chunk(self, data, start, end, o, misses):
+        # Compress a chunk at o, returning where it ends, or None if
+        # it should be stored as is
+        out = self._out
+        table = self._table
+        table.clear()
+
+        flags = 0
+        count = 0
+        flag_pos = o
+        o += 1
+        pos = start
+        literal = start
+        last = end - 3
+        while pos <= last:
+            key = data[pos:pos + 3]
+            candidate = table.get(key)
+            table[key] = pos
+            if candidate is None:
+                misses += 1
+                pos += 1 + (misses >> _skip_shift)
+                continue
+            misses = 0
+            bits = _lznt1_bits[pos - start]
+            length = _match_length(data, candidate, pos,
+                                   min(end - pos, (1 << bits) + 2))
+
+            (flags, count, flag_pos, o) = self._literals(
+                data, literal, pos, flags, count, flag_pos, o)
+
+            _uint16le.pack_into(out, o,
+                                ((pos - candidate - 1) << bits) | (length - 3))
+            o += 2
+            flags |= 1 << count
+            count += 1
+            if count == 8:
+                out[flag_pos] = flags
+                flags = 0
+                count = 0
+                flag_pos = o
+                o += 1
+
+            if length < 32:
+                for j in xrange(pos + 1, min(pos + length, last + 1)):
+                    table[data[j:j + 3]] = j
+            pos += length
+            literal = pos
+
+        if literal == start:
+            # No matches, so the chunk is stored as is
+            return (None, misses)
+        (flags, count, flag_pos, o) = self._literals(
+            data, literal, end, flags, count, flag_pos, o)
+        if count:
+            out[flag_pos] = flags
+        else:
+            # Drop the unused flag byte
+            o = flag_pos
+        return (o, misses)
+
+    def _literals(self, data, start, end, flags, count, flag_pos, o):
+        # Copy literals in runs up to the next flag byte
+        out = self._out
+        while start < end:
+            run = min(end - start, 8 - count)
+            out[o:o + run] = data[start:start + run]
+            o += run
+            start += run
+            count += run
+            if count == 8:
+                out[flag_pos] = flags
+                flags = 0
+                count = 0
+                flag_pos = o
+                o += 1
+        return (flags, count, flag_pos, o)
+
+    def decompress(self, data, out, offset, size):
+        """
+        Decompress data into out[offset:offset + size].
+
+        @param data: The compressed data
+        @param out: The output, a bytearray already at least
+        offset + size long
+        @raise core.BadPacket: If data is malformed, or does not
+        decompress to size bytes
+        """
+        data = _string(data)
+        length_in = len(data)
+        p = offset
+        end = offset + size
+        i = 0
+        try:
+            while i < length_in:
+                (header,) = _uint16le.unpack_from(data, i)
+                i += 2
+                if header == 0:
+                    break
+                chunk_end = i + (header & 0xfff) + 1
+                if chunk_end > length_in:
+                    raise core.BadPacket()
+
+                if not header & 0x8000:
+                    run = chunk_end - i
+                    if p + run > end:
+                        raise core.BadPacket()
+                    out[p:p + run] = data[i:chunk_end]
+                    p += run
+                    i = chunk_end
+                    continue
+
+                chunk = p
+                while i < chunk_end:
+                    flags = ord(data[i])
+                    i += 1
+                    if not flags:
+                        # Eight literals
+                        run = min(8, chunk_end - i)
+                        if p + run > end:
+                            raise core.BadPacket()
+                        out[p:p + run] = data[i:i + run]
+                        p += run
+                        i += run
+                        continue
+                    for bit in xrange(8):
+                        if i >= chunk_end:
+                            break
+                        if flags >> bit & 1:
+                            (token,) = _uint16le.unpack_from(data, i)
+                            i += 2
+                            position = p - chunk
+                            bits = _lznt1_bits[position]
+                            length = (token & ((1 << bits) - 1)) + 3
+                            distance = (token >> bits) + 1
+                            if distance > position or p + length > end:
+                                raise core.BadPacket()
+                            _copy_match(out, p, distance, length)
+                            p += length
+                        else:
+                            if p == end:
+                                raise core.BadPacket()
+                            out[p] = ord(data[i])
+                            i += 1
+                            p += 1
+        except (struct.error, IndexError):
+            raise core.BadPacket()
+        if p != end:
+            raise core.BadPacket()
@@ -39,13 +39,137 @@ Core Pike infrastructure
 """
 
 import array
+import operator
 import struct
-import inspect
+
+_struct_cache = {}
+
+def compile_struct(fmt):
+    """
+    Return a precompiled struct.Struct for a format string.
+
+    Compiled formats are cached, so the format string is only parsed
+    the first time it is seen.  Passing a struct.Struct returns it
+    unchanged.
+    """
+    if isinstance(fmt, struct.Struct):
+        return fmt
+    try:
+        return _struct_cache[fmt]
+    except KeyError:
+        result = _struct_cache[fmt] = struct.Struct(fmt)
+        return result
+
+_zeros_cache = {}
+
+def _zeros(size):
+    try:
+        return _zeros_cache[size]
+    except KeyError:
+        result = _zeros_cache[size] = compile_struct('%dx' % size)
+        return result
+
+# Precompiled codecs for the primitive encode_*/decode_* methods
+_uint8be = compile_struct('>B')
+_uint16be = compile_struct('>H')
+_uint32be = compile_struct('>L')
+_uint64be = compile_struct('>Q')
+_uint8le = compile_struct('<B')
+_uint16le = compile_struct('<H')
+_uint32le = compile_struct('<L')
+_int32le = compile_struct('<l')
+_uint64le = compile_struct('<Q')
+_int64le = compile_struct('<q')
 
 class BufferOverrun(Exception):
     """Buffer overrun exception"""
     pass
 
+class ByteView(object):
+    """
+    Read-only view of a range of bytes within a buffer.
+
+    Returned by L{Cursor.decode_bytes} in place of a copied array
+    when the cursor references a bytearray, memoryview or mmap.
+    A view supports len(), indexing, iteration, comparison and
+    tostring() like an array.array('B'), but shares storage with
+    the buffer it came from, so it only remains meaningful while
+    that buffer is left unmodified.  Use L{copy} to obtain an
+    array the caller owns.
+
+    @ivar buffer: Underlying buffer
+    @ivar start: Offset of first byte within buffer
+    @ivar end: Offset one past the last byte within buffer
+    """
+
+    __slots__ = ('buffer', 'start', 'end')
+
+    def __init__(self, buf, start, end):
+        self.buffer = buf
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step != 1:
+                return self.copy()[index]
+            return ByteView(self.buffer,
+                            self.start + start,
+                            self.start + max(start, stop))
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        value = self.buffer[self.start + index]
+        return value if isinstance(value, int) else ord(value)
+
+    def __iter__(self):
+        return iter(self.copy())
+
+    def _other_string(self, o):
+        if isinstance(o, (ByteView, array.array)):
+            return o.tostring()
+        elif isinstance(o, str):
+            return o
+        elif isinstance(o, (list, tuple, bytearray)):
+            return array.array('B', o).tostring()
+        else:
+            return None
+
+    def __eq__(self, o):
+        other = self._other_string(o)
+        if other is None:
+            return NotImplemented
+        return self.tostring() == other
+
+    def __ne__(self, o):
+        other = self._other_string(o)
+        if other is None:
+            return NotImplemented
+        return self.tostring() != other
+
+    def __hash__(self):
+        return hash(self.tostring())
+
+    def __repr__(self):
+        return 'ByteView(' + repr(self.tostring()) + ')'
+
+    def tostring(self):
+        """ Return the bytes in the view as a string. """
+        if isinstance(self.buffer, memoryview):
+            return self.buffer[self.start:self.end].tobytes()
+        else:
+            return str(buffer(self.buffer, self.start, self.end - self.start))
+
+    def copy(self):
+        """ Return a copy of the bytes in the view as an array.array('B'). """
+        return array.array('B', self.tostring())
+
 class Cursor(object):
     """
     Byte array cursor
@@ -85,12 +209,36 @@ class Cursor(object):
         # Overwrite value with calculated checksum
         hole(sum)
 
+    Where the field width is known up front, reserve_*/patch_* do the
+    same without allocating a hole object: reserve_* encodes zeros and
+    returns the offset of the field, which patch_* later overwrites::
+
+        length = cursor.reserve_uint32le()
+        # Encode rest of packet
+        ...
+        cursor.patch_uint32le(length, size)
+
+    Several adjacent fixed-width fields can be encoded or decoded
+    in one call with encode_struct/decode_struct, which accept either
+    a struct format string or a precompiled struct.Struct (see
+    L{compile_struct}).  For example::
+
+        HEADER = compile_struct('<HHL')
+        cursor.encode_struct(HEADER, a, b, c)
+        (a, b, c) = cursor.decode_struct(HEADER)
+
     Cursors support slicing to extract sections
     of the underlying array.  For example::
 
         # Extract array slice between cur1 and cur2
         subarray = cur1[:cur2]
 
+    Cursors may reference an array.array('B'), a bytearray, a
+    memoryview or an mmap.  decode_bytes on an array.array returns
+    a copied array, while the other buffer types yield a L{ByteView}
+    into the buffer, avoiding a copy of large payloads.  Note that
+    python 2 cannot take a memoryview of an array.array.
+
     Cursors also support establishing boundaries outside of which
     decoding will raise exceptions::
 
@@ -108,12 +256,14 @@ class Cursor(object):
     @ivar bounds: Pair of lower and upper bound on offset
     """
 
+    __slots__ = ('array', 'offset', 'bounds')
+
     def __init__(self, arr, offset, bounds=(None,None)):
         """
         Create a L{Cursor} for the given array
         at the given offset.
 
-        @type arr: array.array('B', ...)
+        @type arr: array.array('B', ...), bytearray, memoryview or mmap
         @param arr: The array
         @type offset: number
         @param offset: The offset from the start of the array
@@ -123,8 +273,11 @@ class Cursor(object):
         self.array = arr
         self.offset = offset
         self.bounds = bounds
-        self.hole = Cursor.Hole(self)
-  
+
+    @property
+    def hole(self):
+        return Cursor.Hole(self)
+
     def __eq__(self, o):
         return self.array is o.array and self.offset == o.offset
 
@@ -174,6 +327,19 @@ class Cursor(object):
         else:
             return self.offset + ind
 
+    def view(self, stop):
+        """
+        Return a L{ByteView} of the bytes from this cursor up to
+        stop without copying them.  Equivalent to cursor[:stop]
+        except for the type of the result.
+
+        @param stop: A cursor, or an offset relative to this cursor
+        """
+        start = self.offset
+        stop = self._getindex(stop)
+        self._check_bounds(start, stop)
+        return ByteView(self.array, start, stop)
+
     def __getitem__(self, index):
         if isinstance(index, slice):
             start = self._getindex(index.start if index.start else 0)
@@ -196,47 +362,116 @@ class Cursor(object):
     def _expand_to(self, size):
         cur_size = len(self.array)
         if (size > cur_size):
-            self.array.extend([0]*(size - cur_size))
+            zeros = '\0' * (size - cur_size)
+            if isinstance(self.array, array.array):
+                self.array.fromstring(zeros)
+            else:
+                self.array.extend(zeros)
 
     def encode_bytes(self, val):
-        """ Encode bytes.  Accepts byte arrays, strings, and integer lists."""
+        """ Encode bytes.  Accepts byte arrays, views, strings, and integer lists."""
+        if isinstance(val, ByteView):
+            val = val.tostring()
+        elif isinstance(val, memoryview):
+            val = val.tobytes()
+        elif isinstance(val, bytearray):
+            val = str(val)
+
+        # array.array only accepts arrays of the same type for slice
+        # assignment, and builds one from a string with a single copy
+        arr = self.array
+        if isinstance(arr, array.array) and not isinstance(val, array.array):
+            val = array.array('B', val)
+
+        offset = self.offset
         size = len(val)
-        self._expand_to(self.offset + size)
-        self.array[self.offset:self.offset + size] = array.array('B',val)
-        self.offset += size
+        if offset == len(arr):
+            arr.extend(val)
+        else:
+            self._expand_to(offset + size)
+            arr[offset:offset + size] = val
+        self.offset = offset + size
 
     def encode_struct(self, fmt, *args):
-        size = struct.calcsize(fmt)
-        self._expand_to(self.offset + size)
-        struct.pack_into(fmt, self.array, self.offset, *args)
-        self.offset += size
+        """
+        Encode args according to fmt, which may be a format
+        string or a precompiled struct.Struct.
+        """
+        self._pack(compile_struct(fmt), *args)
+
+    def _pack(self, codec, *args):
+        offset = self.offset
+        end = offset + codec.size
+        self._expand_to(end)
+        codec.pack_into(self.array, offset, *args)
+        self.offset = end
 
     def encode_uint8be(self, val):
-        self.encode_struct('>B', val)
+        self._pack(_uint8be, val)
 
     def encode_uint16be(self, val):
-        self.encode_struct('>H', val)
+        self._pack(_uint16be, val)
 
     def encode_uint32be(self, val):
-        self.encode_struct('>L', val)
+        self._pack(_uint32be, val)
 
     def encode_uint64be(self, val):
-        self.encode_struct('>Q', val)
+        self._pack(_uint64be, val)
 
     def encode_uint8le(self, val):
-        self.encode_struct('<B', val)
+        self._pack(_uint8le, val)
 
     def encode_uint16le(self, val):
-        self.encode_struct('<H', val)
+        self._pack(_uint16le, val)
 
     def encode_uint32le(self, val):
-        self.encode_struct('<L', val)
+        self._pack(_uint32le, val)
 
     def encode_uint64le(self, val):
-        self.encode_struct('<Q', val)
+        self._pack(_uint64le, val)
 
     def encode_int64le(self, val):
-        self.encode_struct('<q', val)
+        self._pack(_int64le, val)
+
+    def reserve(self, fmt):
+        """
+        Reserve space for a fixed-width value to be filled in later.
+
+        Encodes zeros in place of the value and returns its offset,
+        to be passed to L{patch} along with the same format.
+        """
+        codec = compile_struct(fmt)
+        offset = self.offset
+        end = offset + codec.size
+        self._expand_to(end)
+        _zeros(codec.size).pack_into(self.array, offset)
+        self.offset = end
+        return offset
+
+    def patch(self, fmt, offset, *args):
+        """
+        Overwrite a value at an offset returned by L{reserve},
+        leaving the cursor position unchanged.
+        """
+        compile_struct(fmt).pack_into(self.array, offset, *args)
+
+    def reserve_uint16le(self):
+        return self.reserve(_uint16le)
+
+    def reserve_uint32le(self):
+        return self.reserve(_uint32le)
+
+    def reserve_uint32be(self):
+        return self.reserve(_uint32be)
+
+    def patch_uint16le(self, offset, val):
+        _uint16le.pack_into(self.array, offset, val)
+
+    def patch_uint32le(self, offset, val):
+        _uint32le.pack_into(self.array, offset, val)
+
+    def patch_uint32be(self, offset, val):
+        _uint32be.pack_into(self.array, offset, val)
 
     def encode_utf16le(self, val):
         self.encode_bytes(unicode(val).encode('utf-16le'))
@@ -253,47 +488,66 @@ class Cursor(object):
             raise BufferOverrun()
     
     def decode_bytes(self, size):
-        self._check_bounds(self.offset, self.offset + size)
-        result = self.array[self.offset:self.offset+size]
-        self.offset += size
+        """
+        Decode size bytes.
+
+        Returns a copied array.array('B') when the cursor references
+        an array, otherwise a L{ByteView} into the underlying buffer.
+        """
+        offset = self.offset
+        end = offset + size
+        self._check_bounds(offset, end)
+        if isinstance(self.array, array.array):
+            result = self.array[offset:end]
+        else:
+            result = ByteView(self.array, offset, end)
+        self.offset = end
         return result
 
     def decode_struct(self, fmt):
-        size = struct.calcsize(fmt)
-        self._check_bounds(self.offset, self.offset + size)
-        result = struct.unpack_from(fmt, self.array, self.offset)
-        self.offset += size
+        """
+        Decode a tuple of values according to fmt, which may be a
+        format string or a precompiled struct.Struct.
+        """
+        return self._unpack(compile_struct(fmt))
+
+    def _unpack(self, codec):
+        offset = self.offset
+        end = offset + codec.size
+        self._check_bounds(offset, end)
+        result = codec.unpack_from(self.array, offset)
+        self.offset = end
         return result
 
     def decode_uint8be(self):
-        return self.decode_struct('>B')[0]
+        return self._unpack(_uint8be)[0]
 
     def decode_uint16be(self):
-        return self.decode_struct('>H')[0]
+        return self._unpack(_uint16be)[0]
 
     def decode_uint32be(self):
-        return self.decode_struct('>L')[0]
+        return self._unpack(_uint32be)[0]
 
     def decode_uint64be(self):
-        return self.decode_struct('>Q')[0]
+        return self._unpack(_uint64be)[0]
 
     def decode_uint8le(self):
-        return self.decode_struct('<B')[0]
+        return self._unpack(_uint8le)[0]
 
     def decode_uint16le(self):
-        return self.decode_struct('<H')[0]
+        return self._unpack(_uint16le)[0]
 
     def decode_uint32le(self):
-        return self.decode_struct('<L')[0]
+        return self._unpack(_uint32le)[0]
 
     def decode_int32le(self):
-        return self.decode_struct('<l')[0]
+        return self._unpack(_int32le)[0]
 
     def decode_uint64le(self):
-        return self.decode_struct('<Q')[0]
+        return self._unpack(_uint64le)[0]
 
     def decode_int64le(self):
-        return self.decode_struct('<q')[0]
+        return self._unpack(_int64le)[0]
 
     def decode_utf16le(self, size):
         return self.decode_bytes(size).tostring().decode('utf-16le')
@@ -333,12 +587,12 @@ class Cursor(object):
             assert self.array is lower.array
             lower = lower.offset
         else:
-            lower = cur.offset + lower
+            lower = self.offset + lower
         if isinstance(upper, Cursor):
             assert self.array is upper.array
             upper = upper.offset
         else:
-            upper = cur.offset + upper
+            upper = self.offset + upper
 
         # Don't let new bounds escape current bounds
         self._check_bounds(lower, upper)
@@ -346,29 +600,39 @@ class Cursor(object):
         return Cursor.Bounds(self, lower, upper)
 
     class Hole(object):
+        __slots__ = ('cur',)
+
         def __init__(self, cur):
             self.cur = cur
+
         def __getattr__(self, attr):
-            if hasattr(self.cur.__class__, attr):
-                f = getattr(self.cur.__class__, attr)
-                if inspect.ismethod(f):
-                    copy = self.cur.copy()
-                    def f2(*args, **kwargs):
-                        offset = copy.offset
-                        f(copy,*args,**kwargs)
-                        copy.offset = offset
-
-                    def f1(*args, **kwargs):
-                        f(self.cur,*args,**kwargs)
-                        return f2
-
-                    return f1
-                else:
-                    raise AttributeError
-            else:
-                raise AttributeError
+            cur = self.cur
+            method = getattr(cur.__class__, attr, None)
+            if method is None or not attr.startswith('encode_'):
+                raise AttributeError(attr)
+
+            def encode(*args, **kwargs):
+                offset = cur.offset
+                method(cur, *args, **kwargs)
+                return Cursor.Backpatch(cur, offset, method)
+
+            return encode
+
+    class Backpatch(object):
+        __slots__ = ('cur', 'method')
+
+        def __init__(self, cur, offset, method):
+            self.cur = Cursor(cur.array, offset, cur.bounds)
+            self.method = method
+
+        def __call__(self, *args, **kwargs):
+            offset = self.cur.offset
+            self.method(self.cur, *args, **kwargs)
+            self.cur.offset = offset
 
     class Bounds(object):
+        __slots__ = ('cur', 'bounds', 'oldbounds')
+
         def __init__(self, cur, lower, upper):
             self.cur = cur
             self.bounds = (lower,upper)
@@ -387,6 +651,16 @@ class BadPacket(Exception):
 class Frame(object):
     field_blacklist = ['fields','parent','start','end']
 
+    # Subclasses with a fixed-layout run of fields may describe it
+    # declaratively in field_spec, a list of (name, format[, converter])
+    # tuples.  The metaclass compiles the run into a single struct codec
+    # which _encode_fields and _decode_fields pack or unpack in one call.
+    # A name of None marks a reserved field, encoded as zero and ignored
+    # on decode.  A format yielding several values (e.g. 'QQ') maps to a
+    # tuple.  The optional converter is applied to decoded values.
+    field_spec = None
+    field_byteorder = '<'
+
     def __init__(self, parent, context=None):
         object.__setattr__(self, 'fields', [])
         self.parent = parent
@@ -401,6 +675,14 @@ class Frame(object):
     def __iter__(self):
         return self.children.__iter__()
 
+    def __getattr__(self, name):
+        # Only reached for missing attributes; a deferred frame
+        # decodes itself and tries again
+        if '_deferred' not in self.__dict__:
+            raise AttributeError(name)
+        self._undefer()
+        return getattr(self, name)
+
     def __setattr__(self, name, value):
         if not name.startswith('_') and \
            name not in self.fields and \
@@ -412,12 +694,15 @@ class Frame(object):
         return self._str(1)
 
     def _value_str(self, value):
-        if isinstance(value, array.array) and value.typecode == 'B':
+        if isinstance(value, ByteView) or \
+           (isinstance(value, array.array) and value.typecode == 'B'):
             return '0x' + ''.join(map(lambda b:'%.2x'%b,value))
         else:
             return str(value)
 
     def _str(self, indent):
+        if '_deferred' in self.__dict__:
+            self._undefer()
         res = self.__class__.__name__
         for field in self.fields:
             value = getattr(self, field)
@@ -432,17 +717,18 @@ class Frame(object):
             res += "\n" + "  " * indent + valstr
         return res
 
+    # start and end are blacklisted from fields, so skip __setattr__
     def _encode_pre(self, cur):
-        self.start = cur.copy()
+        object.__setattr__(self, 'start', cur.copy())
 
     def _encode_post(self, cur):
-        self.end = cur.copy()
+        object.__setattr__(self, 'end', cur.copy())
 
     def _decode_pre(self, cur):
-        self.start = cur.copy()
+        object.__setattr__(self, 'start', cur.copy())
 
     def _decode_post(self, cur):
-        self.end = cur.copy()
+        object.__setattr__(self, 'end', cur.copy())
 
     @property
     def context(self):
@@ -455,8 +741,55 @@ class Frame(object):
 
     @property
     def children(self):
+        if '_deferred' in self.__dict__:
+            self._undefer()
         return self._children() if hasattr(self, '_children') else []
 
+    def _encode_fields(self, cur, **overrides):
+        """
+        Encode the fields described by field_spec at cur.
+
+        Keyword arguments supply values in place of the attributes
+        of the same name, e.g. for computed lengths and offsets.
+        """
+        values = []
+        for (name, count, converter, default, tracked) in self._field_plan:
+            if name is None:
+                values.extend(default)
+                continue
+            if name in overrides:
+                value = overrides[name]
+            else:
+                value = getattr(self, name)
+            if count == 1:
+                values.append(value)
+            else:
+                values.extend(value)
+        cur.encode_struct(self._field_codec, *values)
+
+    def _decode_fields(self, cur):
+        """
+        Decode the fields described by field_spec at cur and assign
+        them as attributes.
+        """
+        values = cur.decode_struct(self._field_codec)
+        # Equivalent to setattr, minus the per-field __setattr__ call
+        attrs = self.__dict__
+        fields = self.fields
+        index = 0
+        for (name, count, converter, default, tracked) in self._field_plan:
+            if name is not None:
+                if count == 1:
+                    value = values[index]
+                else:
+                    value = values[index:index+count]
+                if converter is not None:
+                    value = converter(value)
+                if tracked and name not in fields:
+                    fields.append(name)
+                attrs[name] = value
+            index += count
+
     def encode(self, cur):
         self._encode_pre(cur)
         self._encode(cur)
@@ -467,6 +800,31 @@ class Frame(object):
         self._decode(cur)
         self._decode_post(cur)
 
+    def defer(self, cur):
+        """
+        Lazily decode frame.
+
+        Like L{decode}, but only the start and end of the frame are
+        recorded.  Fields and children are decoded from the retained
+        buffer on first access.  cur must be bounded to the extent of
+        the frame, and is advanced to its upper bound.
+        """
+        self._decode_pre(cur)
+        # Set aside defaults from the constructor so that accessing
+        # them reaches __getattr__
+        attrs = self.__dict__
+        defaults = [(name, attrs.pop(name)) for name in self.fields]
+        object.__setattr__(self, 'fields', [])
+        object.__setattr__(self, '_deferred', (cur.copy(), defaults))
+        cur.advanceto(cur.upperbound)
+        self._decode_post(cur)
+
+    def _undefer(self):
+        (cur, defaults) = self.__dict__.pop('_deferred')
+        object.__setattr__(self, 'fields', [name for (name,_) in defaults])
+        self.__dict__.update(defaults)
+        self._decode(cur)
+
     def serialize(self):
         arr = array.array('B')
         cursor = Cursor(arr, 0)
@@ -506,6 +864,10 @@ class Frame(object):
                         dict['field_blacklist'] += base.field_blacklist
                         
             result = type.__new__(mcs, name, bases, dict)
+
+            # Compile declarative fields into a single codec
+            if dict.get('field_spec') is not None:
+                mcs._compile_field_spec(result)
                                 
             # Register class in appropriate tables
             for (table,keyattrs) in result._register:
@@ -519,6 +881,22 @@ class Frame(object):
 
             return result
 
+        def _compile_field_spec(cls):
+            fmt = cls.field_byteorder
+            plan = []
+            for entry in cls.field_spec:
+                (name, codes) = entry[:2]
+                converter = entry[2] if len(entry) > 2 else None
+                codec = struct.Struct(cls.field_byteorder + codes)
+                count = len(codec.unpack('\0' * codec.size))
+                tracked = name is not None and \
+                          not name.startswith('_') and \
+                          name not in cls.field_blacklist
+                plan.append((name, count, converter, (0,) * count, tracked))
+                fmt += codes
+            cls._field_codec = compile_struct(fmt)
+            cls._field_plan = tuple(plan)
+
 class Register(object):
     def __init__(self, table, *keyattrs):
         self.table = table
@@ -529,6 +907,10 @@ class Register(object):
         cls._register.append((self.table,self.keyattrs))
         return cls
 
+# Maximum number of interned unnamed instances per Enum class; bounds
+# the cache for permissive enums and arbitrary flag combinations
+_enum_intern_limit = 1024
+
 class Enum(long):
     """
     Enumeration abstract base
@@ -573,7 +955,19 @@ class Enum(long):
         
             SomeEnumClass.import_items(globals())
         """
-        dictionary.update((name,cls(value)) for (name,value) in cls.items())
+        interned = cls._intern_named()
+        dictionary.update((name,interned[value]) for (name,value) in cls.items())
+
+    @classmethod
+    def _intern_named(cls):
+        # Create instances for all named values in bulk.  They are
+        # valid by definition, so validate() is skipped.
+        interned = cls._interned
+        new = super(Enum, cls).__new__
+        for value in cls._valtoname:
+            if value not in interned:
+                interned[value] = new(cls, value)
+        return interned
 
     @classmethod
     def validate(cls, value):
@@ -592,10 +986,19 @@ class Enum(long):
 
         Creates a new Enum instance from an ordinary number,
         validating that is is valid for the particular
-        enumeration.
+        enumeration.  Instances are interned, so constructing
+        a previously seen value costs a single dict lookup.
         """
+        interned = cls._interned
+        try:
+            return interned[value]
+        except KeyError:
+            pass
         cls.validate(value)
-        return super(Enum, cls).__new__(cls, value)
+        result = super(Enum, cls).__new__(cls, value)
+        if value in cls._valtoname or len(interned) < _enum_intern_limit:
+            interned[value] = result
+        return result
 
     def __repr__(self):
         # Just return string form
@@ -617,15 +1020,23 @@ class Enum(long):
             cls = type.__new__(mcs, cname, bases, misc)
             cls._nametoval = nametoval
             cls._valtoname = valtoname
+            cls._interned = {}
+            # Computed on first use by FlagEnum.validate
+            cls._mask = None
 
             return cls
 
-        def __getattribute__(cls, name):
+        def __getattr__(cls, name):
+            # Only reached for names not yet in the class dictionary.
+            # Named values are instantiated on first access and then
+            # cached as ordinary class attributes, which keeps
+            # defining large enumerations cheap at import time.
             nametoval = type.__getattribute__(cls, '_nametoval')
-            if name in nametoval:
-                return cls(nametoval[name])
-            else:
-                return type.__getattribute__(cls, name)
+            if name not in nametoval:
+                raise AttributeError(name)
+            result = cls(nametoval[name])
+            type.__setattr__(cls, name, result)
+            return result
 
 class ValueEnum(Enum):
     """
@@ -676,6 +1087,17 @@ class FlagEnum(Enum):
 
     @classmethod
     def validate(cls, value):
+        mask = cls._mask
+        if mask is None:
+            # Union of the single-bit flags, any combination of
+            # which is valid
+            mask = cls._mask = reduce(operator.or_,
+                                      (flag for flag in cls.values()
+                                       if flag & (flag - 1) == 0),
+                                      0)
+        if value & ~mask == 0:
+            return
+
         remaining = value
         for flag in cls.values():
             if flag & remaining == flag:
@@ -34,83 +34,191 @@
 # Authors: Brian Koropoff (brian.koropoff@emc.com)
 #
 
-import Crypto.Hash.HMAC
-import Crypto.Hash.SHA256
 import Crypto.Cipher.AES
 import array
+import hashlib
+import struct
 import core
 
-def sha256_hmac(key,message):
-    return array.array('B',
-        Crypto.Hash.HMAC.new(
-            key,
-            message,
-            Crypto.Hash.SHA256).digest())
-
-def aes128_cmac(key,message):
-    aes = Crypto.Cipher.AES.new(key)
-
-    def shiftleft(data):
-        cin = 0
-        cout = 0
-        for i in reversed(xrange(0,len(data))):
-            cout = (data[i] & 0x80) >> 7
-            data[i] = ((data[i] << 1) | cin) & 0xFF
-            cin = cout
-        
-        return cout
-
-    def xor(data1, data2):
-        for i in xrange(0, len(data1)):
-            data1[i] ^= data2[i]
-
-    def subkeys(key):
-        zero = array.array('B', [0]*16)
-        rb = array.array('B', [0]*15 + [0x87])
-
-        key1 = array.array('B', aes.encrypt(zero))
-
-        if shiftleft(key1):
-            xor(key1, rb)
-
-        key2 = array.array('B', key1)
-
-        if shiftleft(key2):
-            xor(key2, rb)
-
-        return (key1, key2)
-
-    message = array.array('B', message)
-    mac = array.array('B', [0]*16)
-    scratch = array.array('B', [0]*16)
-    n = (len(message) + 16 - 1) / 16
-    rem = len(message) % 16
-    last_complete = n != 0 and rem == 0
-    i = 0
-
-    if (n == 0):
-        n = 1
-    
-    subkey1, subkey2 = subkeys(array.array('B',key))
-
-    for i in xrange(0, n - 1):
-        xor(mac, message[i*16:i*16+16])
-        mac = array.array('B',aes.encrypt(mac))
-
-    if last_complete:
-        scratch[0:16] = message[-16:]
-        xor(scratch, subkey1)
+def _buffer(data):
+    # Return data in a form the cipher and hash functions accept,
+    # without copying where possible
+    if isinstance(data, core.ByteView):
+        if isinstance(data.buffer, memoryview):
+            return data.tostring()
+        return buffer(data.buffer, data.start, len(data))
+    elif isinstance(data, memoryview):
+        return data.tobytes()
     else:
-        scratch[0:rem] = message[-rem:]
-        scratch[rem] = 0x80
-        xor(scratch, subkey2)
+        return data
 
-    xor(mac, scratch)
-    mac = array.array('B',aes.encrypt(mac))
+def _string(data):
+    if isinstance(data, (array.array, core.ByteView)):
+        return data.tostring()
+    elif isinstance(data, memoryview):
+        return data.tobytes()
+    else:
+        return str(data)
+
+_ipad = ''.join(chr(x ^ 0x36) for x in xrange(256))
+_opad = ''.join(chr(x ^ 0x5c) for x in xrange(256))
+
+class SHA256HMAC(object):
+    """
+    HMAC-SHA256 (RFC 2104) for a single key.
+
+    The hash states after absorbing the inner and outer key pads are
+    computed once, and copied for each message.
+    """
+    def __init__(self, key):
+        self.key = _string(key)
+        key = self.key
+        if len(key) > 64:
+            key = hashlib.sha256(key).digest()
+        key += '\0' * (64 - len(key))
+        self._inner = hashlib.sha256(key.translate(_ipad))
+        self._outer = hashlib.sha256(key.translate(_opad))
+
+    def digest(self, *parts):
+        """
+        Compute the MAC of a message.
+
+        @param parts: The message, given as one or more consecutive
+        parts as for L{AES128CMAC.digest}.
+        @return: The MAC as an array.array('B')
+        """
+        inner = self._inner.copy()
+        for part in parts:
+            inner.update(_buffer(part))
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return array.array('B', outer.digest())
+
+_block = struct.Struct('>QQ')
+_zero_block = '\0' * 16
+
+def _from_block(block):
+    (high, low) = _block.unpack(block)
+    return (high << 64) | low
+
+def _to_block(value):
+    return _block.pack(value >> 64, value & 0xffffffffffffffff)
+
+def _double(value):
+    # Multiply by x in GF(2^128)
+    value <<= 1
+    if value >> 128:
+        value = (value & ((1 << 128) - 1)) ^ 0x87
+    return value
+
+class AES128CMAC(object):
+    """
+    AES-128-CMAC (RFC 4493) for a single key.
+
+    The cipher and subkeys are computed once, and all but the last
+    block of each message is processed by CBC encryption of whole
+    buffers rather than block by block.
+    """
+    def __init__(self, key):
+        self.key = _string(key)
+        self._aes = Crypto.Cipher.AES.new(self.key)
+        self._subkey1 = _double(_from_block(self._aes.encrypt(_zero_block)))
+        self._subkey2 = _double(self._subkey1)
+
+    def digest(self, *parts):
+        """
+        Compute the MAC of a message.
+
+        @param parts: The message, given as one or more consecutive
+        parts so that it need not be copied into a single buffer.  Each
+        may be a string, array, bytearray, memoryview or L{core.ByteView}.
+        @return: The MAC as an array.array('B')
+        """
+        parts = [_buffer(part) for part in parts]
+        size = sum(len(part) for part in parts)
+        rem = size % 16
+        # Bytes before the last block, which may be partial
+        prefix = size - 16 if size and not rem else size - rem
+
+        cbc = None
+        state = None
+        pending = ''
+        last = ''
+        offset = 0
+        for part in parts:
+            length = len(part)
+            take = max(0, min(length, prefix - offset))
+            start = 0
+            if pending and take:
+                # Complete a block left over from a previous part
+                start = min(16 - len(pending), take)
+                pending += str(buffer(part, 0, start))
+            aligned = (take - start) & ~15
+            for block in (pending if len(pending) == 16 else None,
+                          buffer(part, start, aligned) if aligned else None):
+                if block is not None:
+                    if cbc is None:
+                        cbc = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_CBC, _zero_block)
+                    state = cbc.encrypt(block)[-16:]
+            if len(pending) == 16:
+                pending = ''
+            pending += str(buffer(part, start + aligned, take - start - aligned))
+            if take < length:
+                last += str(buffer(part, take))
+            offset += length
 
-    return mac
+        if size and not rem:
+            last = _from_block(last) ^ self._subkey1
+        else:
+            last = _from_block(last + '\x80' + '\0' * (15 - rem)) ^ self._subkey2
+        if state is not None:
+            last ^= _from_block(state)
 
-def derive_key(key, label, context):
+        return array.array('B', self._aes.encrypt(_to_block(last)))
+
+# Per-key MAC state and derived keys, bounded so those of old
+# sessions do not accumulate
+_cache_limit = 256
+_hmac_cache = {}
+_cmac_cache = {}
+_derive_cache = {}
+
+def _cached(cache, key, factory):
+    value = cache.get(key)
+    if value is None:
+        if len(cache) >= _cache_limit:
+            cache.clear()
+        value = cache[key] = factory(key)
+    return value
+
+def sha256_hmac(key,*parts):
+    key = _string(key)
+    return _cached(_hmac_cache, key, SHA256HMAC).digest(*parts)
+
+def aes128_cmac(key,*parts):
+    key = _string(key)
+    return _cached(_cmac_cache, key, AES128CMAC).digest(*parts)
+
+def derive_key(key, label, context, terminate_context=True):
+    """
+    Derive a key with the SP800-108 counter mode KDF of SMB 3.
+
+    Results are cached, since the same keys are derived each time a
+    session is bound to another channel.
+
+    @param label: The label, without its terminating NUL
+    @param context: The context.  For SMB 3.0 this is a string, given
+    without its terminating NUL; for SMB 3.1.1 it is a preauth
+    integrity hash, which is used as is.
+    @param terminate_context: Whether to NUL-terminate the context
+    @return: The derived key as an array.array('B')
+    """
+    args = (_string(key), _string(label), _string(context),
+            terminate_context)
+    derived = _cached(_derive_cache, args, lambda args: _derive_key(*args))
+    return array.array('B', derived)
+
+def _derive_key(key, label, context, terminate_context):
     message = array.array('B')
     cur = core.Cursor(message, 0)
 
@@ -119,7 +227,39 @@ def derive_key(key, label, context):
     cur.encode_uint8be(0)
     cur.encode_uint8be(0)
     cur.encode_bytes(context)
-    cur.encode_uint8be(0)
+    if terminate_context:
+        cur.encode_uint8be(0)
     cur.encode_uint32be(len(key)*8)
 
-    return sha256_hmac(key, message)
+    return sha256_hmac(key, message).tostring()
+
+class PreauthIntegrityHash(object):
+    """
+    SMB 3.1.1 preauthentication integrity hash (SHA-512).
+
+    Each message of the negotiate and session setup exchanges is folded
+    into the hash as it is sent or received, from the frame's own
+    buffer, so the exchange is never re-serialized or kept.
+
+    @ivar value: The current hash value, as a string
+    """
+    def __init__(self, value='\0' * 64):
+        self.value = value
+
+    def update(self, *parts):
+        """
+        Fold a message into the hash.
+
+        @param parts: The message, as for L{AES128CMAC.digest}
+        """
+        sha = hashlib.sha512(self.value)
+        for part in parts:
+            sha.update(_buffer(part))
+        self.value = sha.digest()
+
+    def copy(self):
+        """
+        Return a copy of the hash, e.g. to start the hash of a session
+        from that of its connection.
+        """
+        return PreauthIntegrityHash(self.value)
@@ -45,15 +45,21 @@ constructing packets.
 """
 
 import sys
+import collections
+import errno
 import socket
 import asyncore
+import select
 import array
 import struct
 import random
 import logging
 import time
+import heapq
 import operator
 import contextlib
+import multiprocessing
+import multiprocessing.pool
 
 import core
 import netbios
@@ -61,10 +67,17 @@ import smb2
 import ntstatus
 import kerberos
 import digest
+import cipher
+import compression
 
 default_timeout = 30
 trace = False
 
+# Socket errors which indicate the peer has gone away
+_disconnected = frozenset((errno.ECONNRESET, errno.ENOTCONN,
+                           errno.ESHUTDOWN, errno.ECONNABORTED,
+                           errno.EPIPE, errno.EBADF))
+
 class TimeoutError(Exception):
     pass
 
@@ -76,6 +89,109 @@ class ResponseError(Exception):
         Exception.__init__(self, response.command, response.status)
         self.response = response
 
+class EventLoop(object):
+    """
+    Socket event loop.
+
+    Drives L{Connection} I/O in place of C{asyncore.loop}.  Connections
+    pass L{EventLoop.map} as their asyncore socket map, so they are
+    registered with the poller once when their socket is created and
+    unregistered when it is closed.  Interest in write events is only
+    updated when it changes (see L{EventLoop.update}), so each call to
+    L{EventLoop.poll} costs time proportional to the number of ready
+    sockets rather than the number of connections.
+
+    Uses epoll where available, falling back to poll and finally to
+    asyncore's select loop.
+
+    @ivar map: asyncore socket map of registered dispatchers
+    """
+    def __init__(self):
+        self.map = self._Map(self)
+        self._events = {}
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._poll = self._poller.poll
+        elif hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._poll = lambda timeout: self._poller.poll(timeout * 1000)
+        else:
+            self._poller = None
+
+    class _Map(dict):
+        # asyncore adds and deletes channels through the map
+        def __init__(self, loop):
+            dict.__init__(self)
+            self.loop = loop
+
+        def __setitem__(self, fd, obj):
+            dict.__setitem__(self, fd, obj)
+            self.loop._register(fd, obj)
+
+        def __delitem__(self, fd):
+            dict.__delitem__(self, fd)
+            self.loop._unregister(fd)
+
+    def _interest(self, obj):
+        events = 0
+        if obj.readable():
+            events |= select.POLLIN | select.POLLPRI
+        # Connection completion is signalled by writability
+        if obj.writable() or not obj.connected:
+            events |= select.POLLOUT
+        return events
+
+    def _register(self, fd, obj):
+        if self._poller is not None:
+            events = self._events[fd] = self._interest(obj)
+            self._poller.register(fd, events)
+
+    def _unregister(self, fd):
+        if self._poller is not None and fd in self._events:
+            del self._events[fd]
+            self._poller.unregister(fd)
+
+    def update(self, obj):
+        """
+        Update registered interest for a dispatcher after its
+        readable() or writable() result may have changed.
+        """
+        if self._poller is None:
+            return
+        fd = obj._fileno
+        events = self._interest(obj)
+        if fd in self._events and self._events[fd] != events:
+            self._events[fd] = events
+            self._poller.modify(fd, events)
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds for socket events and dispatch them.
+
+        @param timeout: Time in seconds, or None to wait indefinitely
+        """
+        if self._poller is None:
+            asyncore.loop(timeout=timeout, map=self.map, count=1)
+            return
+
+        if timeout is None:
+            timeout = -1
+        try:
+            ready = self._poll(timeout)
+        except (select.error, IOError), e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for (fd, events) in ready:
+            obj = self.map.get(fd)
+            if obj is not None:
+                asyncore.readwrite(obj, events)
+                if fd in self._events:
+                    self.update(obj)
+
+# Event loop shared by all connections
+event_loop = EventLoop()
+
 class Future(object):
     """
     Result of an asynchronous operation.
@@ -85,7 +201,8 @@ class Future(object):
     but they can be used for any asynchronous operation.
 
     The result of a future can be waited for synchronously by simply calling
-    L{Future.result}, or a notification callback can be set with L{Future.then}.
+    L{Future.result}, or notification callbacks can be added with L{Future.then}.
+    Many futures can be waited for at once with L{gather} or L{wait_any}.
 
     Futures implement the context manager interface so that they can be used
     as the context for a with block.  If an exception is raised from the block,
@@ -95,6 +212,8 @@ class Future(object):
     @ivar response: The result of the future, usually an SMB2 response frame.
     @ivar interim_response: The interim response, usually an SMB2 response frame.
     @ivar traceback: The traceback of an exception result, if applicable.
+    @ivar done: Whether the future has completed.  The result itself
+    may be None, so it cannot stand in for this.
     """
 
     def __init__(self, request=None):
@@ -106,8 +225,9 @@ class Future(object):
         self.request = request
         self.interim_response = None
         self.response = None
-        self.notify = None
+        self.notify = []
         self.traceback = None
+        self.done = False
 
     def complete(self, response, traceback=None):
         """
@@ -120,8 +240,11 @@ class Future(object):
         """
         self.response = response
         self.traceback = traceback
-        if self.notify is not None:
-            self.notify(self)
+        self.done = True
+        notify = self.notify
+        self.notify = []
+        for func in notify:
+            func(self)
 
     def interim(self, response):
         """
@@ -138,11 +261,11 @@ class Future(object):
         @param timeout: The time in seconds before giving up and raising TimeoutError
         """
         deadline = time.time() + timeout
-        while self.response is None:
+        while not self.done:
             now = time.time()
             if now > deadline:
                 raise TimeoutError('Timed out after %s seconds' % timeout)
-            asyncore.loop(timeout=deadline-now, count=1)
+            event_loop.poll(deadline-now)
 
         return self
 
@@ -153,11 +276,11 @@ class Future(object):
         @param timeout: The time in seconds before giving up and raising TimeoutError
         """
         deadline = time.time() + timeout
-        while self.response is None and self.interim_response is None:
+        while not self.done and self.interim_response is None:
             now = time.time()
             if now > deadline:
                 raise TimeoutError('Timed out after %s seconds' % timeout)
-            asyncore.loop(timeout=deadline-now, count=1)
+            event_loop.poll(deadline-now)
 
         return self
 
@@ -182,16 +305,33 @@ class Future(object):
 
     def then(self, notify):
         """
-        Set notification function.
+        Add notification function.
+
+        Functions are invoked in the order they were added.
 
         @param notify: A function which will be invoked with this future as a parameter
                        when its result becomes available.  If it is already available,
                        it will be called immediately.
+        @return: A L{Future} for the value returned by notify, or for the exception
+                 it raises.  If notify returns a future, the derived future completes
+                 with its result instead, so that operations can be chained.
         """
-        if self.response is not None:
-            notify(self)
+        derived = Future(None)
+
+        def chain(future):
+            with derived:
+                result = notify(future)
+                if isinstance(result, Future):
+                    result.then(lambda f: derived.complete(f.response, f.traceback))
+                else:
+                    derived.complete(result)
+
+        if self.done:
+            chain(self)
         else:
-            self.notify = notify
+            self.notify.append(chain)
+
+        return derived
 
     def __enter__(self):
         pass
@@ -204,6 +344,474 @@ class Future(object):
     def __call__(self, *params, **kwparams):
         self.complete(*params, **kwparams)
 
+def gather(futures, timeout=default_timeout):
+    """
+    Wait for several futures and return their results.
+
+    All futures are waited for in a single event loop with one
+    deadline, rather than one loop per future.
+
+    @param futures: An iterable of L{Future} objects
+    @param timeout: The time in seconds before giving up and raising TimeoutError
+    @return: A list of results in the same order as futures.  If any
+             result is an exception, the first one is raised instead.
+    """
+    futures = list(futures)
+    deadline = time.time() + timeout
+    # Futures usually complete roughly in order, so skipping
+    # past those complete keeps the total scan linear
+    index = 0
+    while True:
+        while index < len(futures) and futures[index].done:
+            index += 1
+        if index == len(futures):
+            break
+        now = time.time()
+        if now > deadline:
+            raise TimeoutError('Timed out after %s seconds' % timeout)
+        event_loop.poll(deadline-now)
+
+    return [future.result() for future in futures]
+
+def wait_any(futures, timeout=default_timeout):
+    """
+    Wait for the first of several futures to complete.
+
+    @param futures: An iterable of L{Future} objects
+    @param timeout: The time in seconds before giving up and raising TimeoutError
+    @return: A completed future, the earliest in futures if several
+    complete together.  Its result may be an exception.
+    """
+    futures = list(futures)
+    deadline = time.time() + timeout
+    # Nothing is registered on the futures, so that calling this
+    # repeatedly on the same pending futures leaves nothing behind
+    while True:
+        for future in futures:
+            if future.done:
+                return future
+        now = time.time()
+        if now > deadline:
+            raise TimeoutError('Timed out after %s seconds' % timeout)
+        event_loop.poll(deadline-now)
+
+class Return(Exception):
+    """
+    Return a value from a L{coroutine}.
+
+    Python 2 generators cannot return values, so a coroutine
+    finishes with a result by raising this exception::
+
+        raise Return(value)
+    """
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+class Task(Future):
+    """
+    Future for the result of a generator-based coroutine.
+
+    The generator yields a L{Future} (or a list of them) wherever it
+    needs to wait.  It is resumed with the result once the future
+    completes, or has the exception raised into it if the result is
+    an exception.  The task completes with the value passed to
+    L{Return}, None if the generator simply finishes, or the
+    exception raised out of it.
+
+    Waiting on any future drives the event loop, so many tasks
+    across many connections make progress concurrently within a
+    single thread.
+
+    @ivar generator: The coroutine generator.
+    """
+    def __init__(self, generator):
+        Future.__init__(self, None)
+        self.generator = generator
+        self._pending = None
+        self._step(None)
+
+    def _step(self, value, exc_info=None):
+        # Loop rather than recurse while yielded futures are
+        # already complete
+        while True:
+            try:
+                if exc_info is not None:
+                    yielded = self.generator.throw(*exc_info)
+                else:
+                    yielded = self.generator.send(value)
+            except StopIteration:
+                self.complete(None)
+                return
+            except Return as e:
+                self.complete(e.value)
+                return
+            except Exception as e:
+                self.complete(e, sys.exc_info()[2])
+                return
+
+            if isinstance(yielded, Future):
+                futures = [yielded]
+            else:
+                futures = list(yielded)
+
+            pending = [f for f in futures if not f.done]
+            if pending:
+                self._pending = (yielded, len(pending))
+                for future in pending:
+                    future.then(self._resume)
+                return
+
+            (value, exc_info) = self._outcome(yielded)
+
+    def _resume(self, future):
+        (yielded, count) = self._pending
+        count -= 1
+        if count:
+            self._pending = (yielded, count)
+            return
+        self._pending = None
+        self._step(*self._outcome(yielded))
+
+    def _outcome(self, yielded):
+        # Result of what was yielded as (value, exc_info)
+        futures = [yielded] if isinstance(yielded, Future) else yielded
+        values = []
+        for future in futures:
+            if isinstance(future.response, BaseException):
+                return (None, (type(future.response),
+                               future.response,
+                               future.traceback))
+            values.append(future.response)
+        if isinstance(yielded, Future):
+            return (values[0], None)
+        return (values, None)
+
+def coroutine(func):
+    """
+    Decorator for generator-based coroutines.
+
+    Calling the decorated function starts the generator and returns a
+    L{Task} for its result.  For example::
+
+        @coroutine
+        def copy(channel, src, dst, length):
+            data = yield channel.read_async(src, length, 0)
+            count = yield channel.write_async(dst, 0, data)
+            raise Return(count)
+
+        copy(channel, src, dst, 4096).result()
+    """
+    def wrapper(*args, **kwargs):
+        return Task(func(*args, **kwargs))
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+class Pipeline(object):
+    """
+    Bounded window of outstanding operations.
+
+    Issues operations through future-returning functions such as
+    L{Channel.read_async}, waiting before each one until fewer than
+    depth are outstanding.  Keeping one pipeline per handle keeps that
+    many requests on the wire for it without unbounded queueing::
+
+        pipeline = Pipeline(16)
+        for offset in offsets:
+            pipeline.submit(channel.read_async, handle, 4096, offset)
+        pipeline.wait()
+
+    @ivar depth: Maximum number of outstanding operations
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self._outstanding = []
+
+    def __len__(self):
+        self._outstanding = [f for f in self._outstanding if not f.done]
+        return len(self._outstanding)
+
+    def _wait_below(self, count, timeout):
+        deadline = time.time() + timeout
+        while len(self) > count:
+            now = time.time()
+            if now > deadline:
+                raise TimeoutError('Timed out after %s seconds' % timeout)
+            event_loop.poll(deadline-now)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Wait for room in the window, then issue an operation.
+
+        @param func: A function returning a L{Future}, which is called
+        with the remaining arguments.
+        @return: The future returned by func.
+        """
+        self._wait_below(self.depth - 1, default_timeout)
+        future = func(*args, **kwargs)
+        self._outstanding.append(future)
+        return future
+
+    def wait(self, timeout=default_timeout):
+        """
+        Wait for every outstanding operation to complete.
+
+        Results, including exceptions, are left in the futures
+        returned by L{submit}.
+
+        @param timeout: The time in seconds before giving up and raising TimeoutError
+        """
+        self._wait_below(0, timeout)
+
+def _signature(digest, key, parts):
+    # Signature job run by SigningPool workers.  Failures are returned
+    # rather than raised so that the job always completes.
+    try:
+        return digest(key, *parts)[:16]
+    except Exception, e:
+        return e
+
+class SigningPool(object):
+    """
+    Worker pool for signing and signature verification.
+
+    When a L{Client} is given a signing pool, its connections compute
+    signatures of outgoing and incoming frames in the pool rather than
+    inline on the event loop, and keep working on other frames in
+    the meantime.  Frames are still sent and dispatched in order.
+
+    Threads suit the digests in L{digest}, since the hash and cipher
+    libraries they use release the GIL.  Processes suit pure-Python
+    digests, at the cost of copying each message to the worker.
+
+    @ivar workers: The number of workers
+    @ivar processes: Whether workers are processes rather than threads
+    """
+    def __init__(self, workers=None, processes=False):
+        """
+        Constructor.
+
+        @param workers: The number of workers, by default one per CPU
+        @param processes: If True, use worker processes
+        """
+        if processes:
+            self._pool = multiprocessing.Pool(workers)
+        else:
+            self._pool = multiprocessing.pool.ThreadPool(workers)
+        self.workers = self._pool._processes
+        self.processes = processes
+        self._waker = _Waker()
+
+    def submit(self, conn, digest, key, parts):
+        """
+        Compute a signature in the pool.
+
+        The event loop calls conn._signatures_ready() once the result
+        is available.
+
+        @return: A L{_SignatureJob} for the signature
+        """
+        if self.processes:
+            parts = [part.tostring() if isinstance(part, core.ByteView) else part
+                     for part in parts]
+        job = _SignatureJob(self._waker)
+        self._waker.watch(conn)
+        self._pool.apply_async(_signature, (digest, key, parts),
+                               callback=job.complete)
+        return job
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        self._pool.close()
+        self._pool.join()
+        self._waker.close()
+
+class _SignatureJob(object):
+    # Result of a SigningPool job.  It is recorded by the pool's
+    # callback, since AsyncResult.ready() may not yet be true when
+    # the callback runs.
+    __slots__ = ('result', 'waker')
+
+    def __init__(self, waker):
+        self.result = None
+        self.waker = waker
+
+    def complete(self, result):
+        self.result = result
+        self.waker.wake()
+
+    def ready(self):
+        return self.result is not None
+
+    def get(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+class _Waker(asyncore.dispatcher):
+    # Wakes the event loop from pool threads through a socket pair
+    # and hands completed signatures back to their connections
+    def __init__(self):
+        (self._reader, self._writer) = socket.socketpair()
+        self._reader.setblocking(0)
+        asyncore.dispatcher.__init__(self, self._reader, map=event_loop.map)
+        self._watched = set()
+
+    def watch(self, conn):
+        self._watched.add(conn)
+
+    def wake(self):
+        try:
+            self._writer.send('\0')
+        except socket.error:
+            pass
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self._reader.recv(4096)
+        except socket.error:
+            pass
+        watched = self._watched
+        self._watched = set()
+        for conn in watched:
+            if conn._signatures_ready():
+                self._watched.add(conn)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._writer.close()
+
+class CompressionPolicy(object):
+    """
+    Compression policy.
+
+    When a L{Client} is given a compression policy, its connections
+    offer SMB 3.1.1 compression and compress requests which are not
+    encrypted, contain one of the given commands, and are at least
+    min_size bytes once encoded.  Requests are sent as is if
+    compression would not make them smaller.  Encrypted requests are
+    not compressed, but once compression is negotiated the server may
+    compress responses before encrypting them; those are decrypted and
+    then decompressed.
+
+    @ivar algorithms: The L{smb2.CompressionAlgorithm}s to offer, in
+    order of preference
+    @ivar chained: Whether to offer chained compression, which also
+    sends runs of a byte at either end of a request as a pattern
+    @ivar commands: The L{smb2.CommandId}s of requests to compress
+    @ivar min_size: The smallest request to compress, in bytes
+    """
+    def __init__(self,
+                 algorithms=[smb2.SMB2_COMPRESSION_LZ77,
+                             smb2.SMB2_COMPRESSION_LZNT1],
+                 chained=True,
+                 commands=[smb2.SMB2_WRITE],
+                 min_size=4096):
+        self.algorithms = list(algorithms)
+        self.chained = chained
+        self.commands = set(commands)
+        self.min_size = min_size
+
+    def compresses(self, nb):
+        """
+        Whether a netbios frame of requests may be compressed.
+        """
+        return any(smb_req[0].command_id in self.commands for smb_req in nb)
+
+class MessageIdAllocator(object):
+    """
+    Message id allocator.
+
+    Allocates ascending ranges of message ids, one id per credit
+    charged, skipping any ids or ranges that have been reserved.
+    Reservations are kept in a heap ordered by start and discarded
+    once allocation has passed them, so each allocation takes O(1)
+    amortized time however many ids have been allocated.  Ids skipped
+    because a range did not fit before a reservation are not reused.
+    """
+    def __init__(self, start=0):
+        self._next = start
+        # Heap of reserved (start, end) ranges not yet passed
+        self._reserved = []
+
+    def reserve(self, mid, count=1):
+        """
+        Reserve ids so that they are never allocated.
+
+        @param mid: The first id to reserve
+        @param count: The number of consecutive ids to reserve
+        """
+        if mid + count > self._next:
+            heapq.heappush(self._reserved, (mid, mid + count))
+
+    def allocate(self, count=1):
+        """
+        Allocate consecutive ids.
+
+        @param count: The number of ids, which is the credit charge
+        of the request they are for.
+        @return: The first id allocated.
+        """
+        start = self._next
+        reserved = self._reserved
+        while reserved:
+            (reserved_start, reserved_end) = reserved[0]
+            if reserved_start >= start + count:
+                break
+            if reserved_end > start:
+                start = reserved_end
+            heapq.heappop(reserved)
+        self._next = start + count
+        return start
+
+class _BreakQueue(object):
+    # Unclaimed break notifications, in arrival order and indexed by
+    # key.  Notifications are stored by an arrival counter, so that
+    # claiming any one of them removes it at once; each key's deque
+    # holds the counters of its unclaimed notifications.
+    def __init__(self, key):
+        self._key = key
+        self._entries = collections.OrderedDict()
+        self._by_key = {}
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, smb_res):
+        counter = self._counter
+        self._counter += 1
+        self._entries[counter] = smb_res
+        self._by_key.setdefault(self._key(smb_res), collections.deque()).append(counter)
+
+    def pop(self):
+        # Claim the most recent notification
+        (counter, smb_res) = self._entries.popitem()
+        key = self._key(smb_res)
+        self._by_key[key].pop()
+        if not self._by_key[key]:
+            del self._by_key[key]
+        return smb_res
+
+    def pop_key(self, key):
+        # Claim the oldest notification for key, if any
+        if key not in self._by_key:
+            return None
+        counters = self._by_key[key]
+        counter = counters.popleft()
+        if not counters:
+            del self._by_key[key]
+        return self._entries.pop(counter)
+
 class Client(object):
     """
     Client
@@ -216,20 +824,35 @@ class Client(object):
     @ivar security_mode: Security mode flags
     @ivar client_guid: Client GUID
     @ivar channel_sequence: Current channel sequence number
+    @ivar lazy_decode: Whether response bodies are decoded on first access
+    @ivar signing_pool: L{SigningPool} used to compute signatures, or None
+    @ivar compression: L{CompressionPolicy} for requests, or None
     """
     def __init__(self,
                  dialects=[smb2.DIALECT_SMB2_002, smb2.DIALECT_SMB2_1, smb2.DIALECT_SMB3_0],
                  capabilities=smb2.GlobalCaps(reduce(operator.or_, smb2.GlobalCaps.values())),
                  security_mode=smb2.SMB2_NEGOTIATE_SIGNING_ENABLED,
-                 client_guid=None):
+                 client_guid=None,
+                 lazy_decode=False,
+                 signing_pool=None,
+                 compression=None):
         """
         Constructor.
 
         @type dialects: [number]
-        @param dialects: A list of supported dialects.
+        @param dialects: A list of supported dialects.  SMB 3.0.2 and
+        3.1.1 are only negotiated if included here.
         @param capabilities: Client capabilities flags
         @param security_mode: Client security mode flags
         @param client_guid: Client GUID.  If None, a new one will be generated at random.
+        @param lazy_decode: If True, only SMB2 headers are decoded on
+        receipt.  Command bodies (fields, create contexts, directory
+        entries, etc.) are decoded from the retained buffer when first
+        accessed.
+        @param signing_pool: A L{SigningPool} to compute signatures in,
+        or None to compute them inline.
+        @param compression: A L{CompressionPolicy} for requests, or None
+        to not offer compression.
         """
         object.__init__(self)
 
@@ -241,11 +864,14 @@ class Client(object):
         self.security_mode = security_mode
         self.client_guid = client_guid
         self.channel_sequence = 0
+        self.lazy_decode = lazy_decode
+        self.signing_pool = signing_pool
+        self.compression = compression
 
         self._oplock_break_map = {}
         self._lease_break_map = {}
-        self._oplock_break_queue = []
-        self._lease_break_queue = []
+        self._oplock_break_queue = _BreakQueue(lambda smb_res: smb_res[0].file_id)
+        self._lease_break_queue = _BreakQueue(lambda smb_res: smb_res[0].lease_key.tostring())
         self._connections = []
         self._leases = {}
 
@@ -266,13 +892,13 @@ class Client(object):
     # Do not use, may be removed.  Use oplock_break_future.
     def next_oplock_break(self):
         while len(self._oplock_break_queue) == 0:
-            asyncore.loop(count=1)
+            event_loop.poll(default_timeout)
         return self._oplock_break_queue.pop()
     
     # Do not use, may be removed.  Use lease_break_future.
     def next_lease_break(self):
         while len(self._lease_break_queue) == 0:
-            asyncore.loop(count=1)
+            event_loop.poll(default_timeout)
         return self._lease_break_queue.pop()
 
     def oplock_break_future(self, file_id):
@@ -289,13 +915,10 @@ class Client(object):
         
         future = Future(None)
 
-        for smb_res in self._oplock_break_queue[:]:
-            if smb_res[0].file_id == file_id:
-                future.complete(smb_res)
-                self._oplock_break_queue.remove(smb_res)
-                break
-
-        if future.response is None:
+        smb_res = self._oplock_break_queue.pop_key(file_id)
+        if smb_res is not None:
+            future.complete(smb_res)
+        else:
             self._oplock_break_map[file_id] = future
 
         return future
@@ -313,13 +936,10 @@ class Client(object):
 
         future = Future(None)
 
-        for smb_res in self._lease_break_queue[:]:
-            if smb_res[0].lease_key == lease_key:
-                future.complete(smb_res)
-                self._lease_break_queue.remove(smb_res)
-                break
-
-        if future.response is None:
+        smb_res = self._lease_break_queue.pop_key(lease_key.tostring())
+        if smb_res is not None:
+            future.complete(smb_res)
+        else:
             self._lease_break_map[lease_key.tostring()] = future
 
         return future
@@ -369,6 +989,19 @@ class Client(object):
     def dispose_lease(self, lease):
         del self._leases[lease.lease_key.tostring()]
 
+def _payload_size(req):
+    # Larger of the request and expected response payloads, which
+    # determines the credit charge of a multi-credit request
+    if isinstance(req, smb2.ReadRequest):
+        return req.length
+    elif isinstance(req, smb2.WriteRequest):
+        return len(req.buffer) if req.buffer is not None else 0
+    elif isinstance(req, (smb2.QueryDirectoryRequest, smb2.QueryInfoRequest)):
+        return req.output_buffer_length
+    elif isinstance(req, smb2.IoctlRequest):
+        return max(req.max_input_response, req.max_output_response)
+    return 0
+
 class Connection(asyncore.dispatcher):
     """
     Connection to server.
@@ -380,7 +1013,41 @@ class Connection(asyncore.dispatcher):
     @ivar client: The Client object associated with this connection.
     @ivar server: The server name or address
     @ivar port: The server port
+    @ivar lazy_decode: Whether response bodies are decoded on first
+    access (see L{Client})
+    @cvar recv_buffer_size: Initial size of the receive buffer.  Each
+    read fills as much of it as the socket has available.
+    @cvar coalesce_size: Frames smaller than this are copied together
+    into shared send buffers; larger frames are sent from their own
+    buffers without copying.
+    @cvar min_credit_window: Credit window requested from the server
+    while the connection is lightly loaded.
+    @cvar max_credit_window: Largest credit window requested from the
+    server, however many requests are queued.
+    @ivar credits: Credits granted by the server and not yet consumed.
+    Requests are held in the send queue until enough are available.
+    @ivar credits_in_flight: Credits consumed by requests still awaiting
+    a final response.
+    @ivar signing_pool: L{SigningPool} used to compute signatures, or
+    None (see L{Client})
+    @ivar deferred_signing: Whether outgoing frames are signed once
+    encoded rather than while encoding.
+    @ivar cipher: The L{smb2.Cipher} used to encrypt sessions on this
+    connection, or None if the server does not support encryption.
+    @ivar signing_algorithm: The L{smb2.SigningAlgorithm} negotiated
+    with SMB 3.1.1, or None to sign as the dialect implies
+    @ivar compression_algorithms: The L{smb2.CompressionAlgorithm}s
+    negotiated with SMB 3.1.1, if any
+    @ivar compression_chained: Whether chained compression was
+    negotiated
+    @ivar preauth_integrity_hash: The L{digest.PreauthIntegrityHash}
+    of the negotiate exchange, if SMB 3.1.1 was negotiated
     """
+    recv_buffer_size = 65536
+    coalesce_size = 16384
+    min_credit_window = 16
+    max_credit_window = 512
+
     def __init__(self, client, server, port=445):
         """
         Constructor.
@@ -388,13 +1055,34 @@ class Connection(asyncore.dispatcher):
         This should generally not be used directly.  Instead,
         use L{Client.connect}().
         """
-        asyncore.dispatcher.__init__(self)
-        self._in_buffer = array.array('B')
-        self._watermark = 4
-        self._out_buffer = None
-        self._next_mid = 0
-        self._mid_blacklist = set()
+        asyncore.dispatcher.__init__(self, map=event_loop.map)
+        # Received bytes not yet parsed are _in_buffer[_in_start:_in_end]
+        self._in_buffer = bytearray(self.recv_buffer_size)
+        self._in_start = 0
+        self._in_end = 0
+        # Serialized frames awaiting send; the first has been sent
+        # up to _out_offset
+        self._out_buffers = collections.deque()
+        self._out_offset = 0
+        self._mids = MessageIdAllocator()
         self._out_queue = []
+        # Futures in _out_queue by preassigned message id, and
+        # futures with an interim response by async id
+        self._queued_mids = {}
+        self._async_map = {}
+        # Credit charge of requests in _out_queue
+        self._queued_charge = 0
+        # Credits asked for by requests awaiting a final response
+        self._credits_expected = 0
+        self._large_mtu = False
+        self.cipher = None
+        self.signing_algorithm = None
+        self.compression_algorithms = []
+        self.compression_chained = False
+        self._compression_codecs = {}
+        self.preauth_integrity_hash = None
+        self.credits = 1
+        self.credits_in_flight = 0
         self._future_map = {}
         self._sessions = {}
         self._binding = None
@@ -404,6 +1092,13 @@ class Connection(asyncore.dispatcher):
         self.client = client
         self.server = server
         self.port = port
+        self.lazy_decode = client.lazy_decode
+        self.signing_pool = client.signing_pool
+        self.deferred_signing = self.signing_pool is not None
+        # Frames waiting on signatures from the signing pool, in order,
+        # as (frame, [(smb2 frame, AsyncResult)]) pairs
+        self._in_verify = collections.deque()
+        self._out_signing = collections.deque()
         self.remote_addr = None
         self.local_addr = None
 
@@ -414,16 +1109,24 @@ class Connection(asyncore.dispatcher):
         self.connect((server,port))
         self.client._connections.append(self)
 
-    def next_mid(self):
-        while self._next_mid in self._mid_blacklist:
-            self._next_mid += 1
-        result = self._next_mid
-        self._next_mid += 1
+    def next_mid(self, count=1):
+        """
+        Allocate message ids.
 
-        return result
+        @param count: The number of consecutive ids to allocate, which
+        is the credit charge of the request they are for.
+        @return: The first id allocated.
+        """
+        return self._mids.allocate(count)
+
+    def reserve_mid(self, mid, count=1):
+        """
+        Reserve message ids so that they are never allocated.
 
-    def reserve_mid(mid):
-        self._mid_blacklist.add(mid)
+        @param mid: The first id to reserve
+        @param count: The number of consecutive ids to reserve
+        """
+        self._mids.reserve(mid, count)
 
     #
     # async dispatcher callbacks
@@ -434,8 +1137,48 @@ class Connection(asyncore.dispatcher):
 
     def writable(self):
         # Do we have data to send?
-        # FIXME: credit tracking
-        return self._out_buffer != None or len(self._out_queue) != 0
+        return len(self._out_buffers) != 0 or \
+            (len(self._out_queue) != 0 and
+             self._can_send(self._out_queue[0].request))
+
+    @property
+    def credit_window(self):
+        """
+        Current credit window: credits available plus credits consumed
+        by requests still in flight.
+        """
+        return self.credits + self.credits_in_flight
+
+    def _credit_charge(self, smb_req):
+        # Credits consumed by a request other than cancel, setting
+        # its charge if the caller has not chosen one
+        if smb_req.credit_charge is None:
+            size = _payload_size(smb_req[0]) if self._large_mtu else 0
+            smb_req.credit_charge = (size - 1) / 65536 + 1 if size > 0 else 1
+        return max(smb_req.credit_charge, 1)
+
+    def _can_send(self, req):
+        # Hold a compound chain until the server has granted enough
+        # credits for all of it, unless nothing is outstanding which
+        # could grant more
+        if self._queued_charge <= self.credits:
+            return True
+        children = req.parent.children
+        if children[0] is not req:
+            return True
+        charge = sum(self._credit_charge(child) for child in children
+                     if not isinstance(child[0], smb2.Cancel))
+        return charge <= self.credits or not self._future_map
+
+    def _credit_request(self, charge):
+        # Ask for enough credits to cover the requests in flight and
+        # queued, within the window limits, counting credits already
+        # asked for by requests in flight
+        target = self.credits_in_flight + self._queued_charge
+        target = min(max(target, self.min_credit_window),
+                     self.max_credit_window)
+        projected = self.credits + self._credits_expected
+        return min(max(target - projected + charge, 1), 0xffff)
 
     def handle_connect(self):
         self.local_addr = self.socket.getsockname()
@@ -444,32 +1187,182 @@ class Connection(asyncore.dispatcher):
         self.client.logger.debug('connect: %s/%s -> %s/%s',
                                  self.local_addr[0], self.local_addr[1],
                                  self.remote_addr[0], self.remote_addr[1])
-        pass
+
+    def recv_into(self, buf):
+        # Counterpart of asyncore.dispatcher.recv
+        try:
+            count = self.socket.recv_into(buf)
+        except socket.error, why:
+            if why.args[0] in _disconnected:
+                self.handle_close()
+                return 0
+            raise
+        if count == 0:
+            self.handle_close()
+        return count
 
     def handle_read(self):
-        # Try to read the next netbios frame
-        remaining = self._watermark - len(self._in_buffer)
-        data = self.recv(remaining)
-        self._in_buffer.extend(array.array('B', data))
-        avail = len(self._in_buffer)
-        if avail >= 4:
-            self._watermark = 4 + struct.unpack('>L', self._in_buffer[0:4])[0]
-        if avail == self._watermark:
+        # Read as much as is available, then dispatch every
+        # complete netbios frame received so far
+        count = self.recv_into(memoryview(self._in_buffer)[self._in_end:])
+        if count == 0:
+            return
+        self._in_end += count
+
+        # State is re-read on each pass in case dispatch reenters
+        while True:
+            buf = self._in_buffer
+            start = self._in_start
+            avail = self._in_end - start
+            if avail < 4:
+                break
+            size = 4 + struct.unpack_from('>L', buf, start)[0]
+            if avail < size:
+                break
+            self._in_start = start + size
+            # Each frame gets its own buffer so that byte fields decoded
+            # from it can be views rather than copies
             nb = self.frame()
-            nb.parse(self._in_buffer)
-            self._in_buffer = array.array('B')
-            self._watermark = 4
-            self._dispatch_incoming(nb)
+            nb.parse(buf[start:start+size])
+            self._receive(nb)
+
+        self._compact_in_buffer()
+
+    def _receive(self, res):
+        if self.signing_pool is None:
+            self._dispatch_incoming(res)
+            return
+
+        # Verify signatures in the pool, and dispatch once they and
+        # those of all earlier frames are done
+        jobs = []
+        for smb_res in res:
+            if smb_res.flags & smb2.SMB2_FLAGS_SIGNED and \
+               not isinstance(smb_res[0], smb2.SessionSetupResponse):
+                key = self.signing_key(smb_res.session_id)
+                if key:
+                    jobs.append((smb_res,
+                                 self.signing_pool.submit(
+                                     self, self.signing_digest(), key,
+                                     smb_res.signed_parts())))
+        if not jobs and not self._in_verify:
+            self._dispatch_incoming(res)
+        else:
+            self._in_verify.append((res, jobs))
+
+    def _signatures_ready(self):
+        # Called by the signing pool as signatures complete.  Sends
+        # and dispatches frames at the head of each queue whose
+        # signatures are all done.  Returns whether any are still
+        # pending.
+        try:
+            queue = self._out_signing
+            ready = False
+            while queue and all(job.ready() for (_, job) in queue[0][1]):
+                (buf, jobs) = queue.popleft()
+                for (smb_req, job) in jobs:
+                    smb_req.sign(None, None, signature=job.get())
+                self._queue_outgoing(buf)
+                ready = True
+            if ready:
+                event_loop.update(self)
+
+            queue = self._in_verify
+            ready = False
+            while queue and all(job.ready() for (_, job) in queue[0][1]):
+                (res, jobs) = queue.popleft()
+                for (smb_res, job) in jobs:
+                    if job.get() != smb_res.signature:
+                        raise core.BadPacket()
+                self._dispatch_incoming(res, verified=True)
+                ready = True
+            if ready:
+                # Granted credits may let held back requests go out
+                event_loop.update(self)
+        except:
+            self.handle_error()
+            return False
+        return bool(self._out_signing or self._in_verify)
+
+    def _compact_in_buffer(self):
+        buf = self._in_buffer
+        start = self._in_start
+        end = self._in_end
+        if start == end:
+            self._in_start = self._in_end = 0
+            return
+
+        if end - start >= 4:
+            size = 4 + struct.unpack_from('>L', buf, start)[0]
+        else:
+            size = 4
+        if start + size > len(buf):
+            # Move the partial frame to the front, growing the buffer
+            # if the frame would not otherwise fit.  The buffer is not
+            # shrunk again, so it is bounded by the largest frame seen.
+            partial = buf[start:end]
+            if size > len(buf):
+                buf = self._in_buffer = bytearray(size)
+            buf[:len(partial)] = partial
+            self._in_start = 0
+            self._in_end = len(partial)
 
     def handle_write(self):
-        # Try to write out more data
-        # FIXME: credit tracking
-        while self._out_buffer is None and len(self._out_queue):
-            self._out_buffer = self._prepare_outgoing()
-        sent = self.send(self._out_buffer)
-        del self._out_buffer[:sent]
-        if len(self._out_buffer) == 0:
-            self._out_buffer = None
+        # Serialize everything queued that there are credits for,
+        # then send until the socket would block
+        while len(self._out_queue) and \
+              self._can_send(self._out_queue[0].request):
+            result = self._prepare_outgoing()
+            if result is not None:
+                self._sign_outgoing(*result)
+
+        buffers = self._out_buffers
+        while len(buffers):
+            buf = buffers[0]
+            sent = self.send(buffer(buf, self._out_offset))
+            self._out_offset += sent
+            if self._out_offset < len(buf):
+                # Partial write, wait until writable again
+                break
+            buffers.popleft()
+            self._out_offset = 0
+
+    def _sign_outgoing(self, req, buf):
+        if self.signing_pool is None:
+            self._queue_outgoing(buf)
+            return
+
+        # Sign frames in the pool, and send once they and all
+        # earlier frames are signed
+        jobs = []
+        for smb_req in req:
+            # Frames which may be compressed are signed when encoded
+            if smb_req.flags & smb2.SMB2_FLAGS_SIGNED and \
+               not isinstance(req.transform, smb2.CompressionTransformHeader):
+                key = self.signing_key(smb_req.session_id)
+                jobs.append((smb_req,
+                             self.signing_pool.submit(
+                                 self, self.signing_digest(), key,
+                                 smb_req.signed_parts())))
+        if not jobs and not self._out_signing:
+            self._queue_outgoing(buf)
+        else:
+            self._out_signing.append((buf, jobs))
+
+    def _queue_outgoing(self, buf):
+        buffers = self._out_buffers
+        if len(buf) >= self.coalesce_size:
+            buffers.append(buf)
+            return
+
+        # Append small frames to a trailing shared buffer.  This is
+        # safe even if it is partially sent, since the offset into
+        # it remains valid.
+        if len(buffers) and isinstance(buffers[-1], bytearray) and \
+           len(buffers[-1]) < self.coalesce_size:
+            buffers[-1].extend(buf.tostring())
+        else:
+            buffers.append(bytearray(buf.tostring()))
 
     def handle_close(self):
         self.close()
@@ -505,10 +1398,16 @@ class Connection(asyncore.dispatcher):
         for future in self._out_queue:
             future.complete(self.error, self.traceback)
         del self._out_queue[:]
+        self._queued_charge = 0
+
+        self._queued_mids.clear()
 
         for future in self._future_map.itervalues():
             future.complete(self.error, self.traceback)
         self._future_map.clear()
+        self._async_map.clear()
+        self._in_verify.clear()
+        self._out_signing.clear()
 
         for session in self._sessions.values():
             session.delchannel(self)
@@ -524,18 +1423,30 @@ class Connection(asyncore.dispatcher):
 
         with future:
             req = future.request
+            if req.message_id is not None:
+                self._queued_mids.pop(req.message_id, None)
             
-            # Assign message id
-            # FIXME: credit tracking
-            if req.message_id is None:
-                req.message_id = self.next_mid()
-            req.credit_request = 10
-
-            if req.credit_charge == None:
-                req.credit_charge = 1
+            # Assign message ids and consume credits.  Cancel
+            # consumes neither.
+            cancel = isinstance(req[0], smb2.Cancel)
+            if cancel:
+                if req.credit_charge is None:
+                    req.credit_charge = 1
+                if req.message_id is None:
+                    req.message_id = self.next_mid()
+            else:
+                charge = self._credit_charge(req)
+                if req.message_id is None:
+                    req.message_id = self.next_mid(charge)
+                self._queued_charge -= charge
+                req.credit_request = self._credit_request(charge)
+                self.credits -= charge
+                self.credits_in_flight += charge
+                self._credits_expected += req.credit_request
 
             if req.is_last_child():
                 # Last command in chain, ready to send packet
+                self._compress_outgoing(req.parent)
                 buf = req.parent.serialize()
                 if trace: 
                     self.client.logger.debug('send (%s/%s -> %s/%s): %s',
@@ -547,13 +1458,13 @@ class Connection(asyncore.dispatcher):
                                              self.local_addr[0], self.local_addr[1],
                                              self.remote_addr[0], self.remote_addr[1],
                                              ', '.join(f[0].__class__.__name__ for f in req.parent))
-                result = buf
+                result = (req.parent, buf)
             else:
                 # Not ready to send chain
                 result = None
 
             # Move it to map for response waiters (but not cancel)
-            if not isinstance(req[0], smb2.Cancel):
+            if not cancel:
                 self._future_map[req.message_id] = future
 
         return result
@@ -569,7 +1480,7 @@ class Connection(asyncore.dispatcher):
             return self.client._lease_break_map.pop(lease_key)
         return None
 
-    def _dispatch_incoming(self, res):
+    def _dispatch_incoming(self, res, verified=False):
         if trace:
             self.client.logger.debug('recv (%s/%s -> %s/%s): %s',
                                      self.remote_addr[0], self.remote_addr[1],
@@ -581,12 +1492,17 @@ class Connection(asyncore.dispatcher):
                                      self.local_addr[0], self.local_addr[1],
                                      ', '.join(f[0].__class__.__name__ for f in res))
         for smb_res in res:
-            # Verify non-session-setup-response signatures
-            if not isinstance(smb_res[0], smb2.SessionSetupResponse):
+            # Verify non-session-setup-response signatures, unless
+            # the signing pool already has
+            if not verified and \
+               not isinstance(smb_res[0], smb2.SessionSetupResponse):
                 key = self.signing_key(smb_res.session_id)
                 if key:
                     smb_res.verify(self.signing_digest(), key)
 
+            # Interim responses may grant credits too
+            self.credits += smb_res.credit_response
+
             if smb_res.message_id == smb2.UNSOLICITED_MESSAGE_ID:
                 if isinstance(smb_res[0], smb2.OplockBreakNotification):
                     future = self._find_oplock_future(smb_res[0].file_id)
@@ -606,12 +1522,25 @@ class Connection(asyncore.dispatcher):
                 future = self._future_map[smb_res.message_id]
                 if smb_res.status == ntstatus.STATUS_PENDING:
                     future.interim(smb_res)
+                    self._async_map[smb_res.async_id] = future
                 elif isinstance(smb_res[0], smb2.ErrorResponse):
-                    future.complete(ResponseError(smb_res))
                     del self._future_map[smb_res.message_id]
+                    self._retire(future)
+                    future.complete(ResponseError(smb_res))
                 else:
-                    future.complete(smb_res)
                     del self._future_map[smb_res.message_id]
+                    self._retire(future)
+                    future.complete(smb_res)
+
+    def _retire(self, future):
+        # Release the credits and async id of a request which has
+        # its final response
+        if future.interim_response is not None:
+            self._async_map.pop(future.interim_response.async_id, None)
+        req = future.request
+        if req is not None:
+            self.credits_in_flight -= max(req.credit_charge, 1)
+            self._credits_expected -= req.credit_request
 
     def submit(self, req):
         """
@@ -629,13 +1558,13 @@ class Connection(asyncore.dispatcher):
                 # Find original future being canceled to return
                 if smb_req.async_id is not None:
                     # Cancel by async ID
-                    future = filter(lambda f: f.interim_response.async_id == smb_req.async_id, self._future_map.itervalues())[0]
+                    future = self._async_map[smb_req.async_id]
                 elif smb_req.message_id in self._future_map:
                     # Cancel by message id, already in future map
                     future = self._future_map[smb_req.message_id]
                 else:
                     # Cancel by message id, still in send queue
-                    future = filter(lambda f: f.request.message_id == smb_req.message_id, self._out_queue)[0]
+                    future = self._queued_mids[smb_req.message_id]
                 # Add fake future for cancel since cancel has no response
                 self._out_queue.append(Future(smb_req))
                 futures.append(future)
@@ -643,6 +1572,10 @@ class Connection(asyncore.dispatcher):
                 future = Future(smb_req)
                 self._out_queue.append(future)
                 futures.append(future)
+                if smb_req.message_id is not None:
+                    self._queued_mids[smb_req.message_id] = future
+                self._queued_charge += self._credit_charge(smb_req)
+        event_loop.update(self)
         return futures
 
     def transceive(self, req):
@@ -670,7 +1603,57 @@ class Connection(asyncore.dispatcher):
         neg_req.capabilities = self.client.capabilities
         neg_req.client_guid = self.client.client_guid
 
-        self.negotiate_response = self.transceive(smb_req.parent)[0][0]
+        if smb2.DIALECT_SMB3_1_1 in neg_req.dialects:
+            smb2.PreauthIntegrityCapabilitiesRequest(neg_req)
+            smb2.EncryptionCapabilitiesRequest(neg_req)
+            signing = smb2.SigningCapabilitiesRequest(neg_req)
+            if not cipher.native_gcm:
+                # GHASH in Python is far slower than CMAC, so only
+                # sign with GMAC if the server insists
+                signing.signing_algorithms.reverse()
+            policy = self.client.compression
+            if policy is not None:
+                compress = smb2.CompressionCapabilitiesRequest(neg_req)
+                compress.compression_algorithms = list(policy.algorithms)
+                if policy.chained:
+                    compress.compression_algorithms.append(
+                        smb2.SMB2_COMPRESSION_PATTERN_V1)
+                else:
+                    compress.flags = smb2.SMB2_COMPRESSION_CAPABILITIES_FLAG_NONE
+
+        smb_res = self.transceive(smb_req.parent)[0]
+        self.negotiate_response = smb_res[0]
+        self._large_mtu = bool(self.negotiate_response.capabilities &
+                               smb2.SMB2_GLOBAL_CAP_LARGE_MTU)
+        if self.negotiate_response.dialect_revision >= 0x300 and \
+           self.negotiate_response.capabilities & smb2.SMB2_GLOBAL_CAP_ENCRYPTION:
+            self.cipher = smb2.SMB2_ENCRYPTION_AES128_CCM
+
+        if self.negotiate_response.dialect_revision == smb2.DIALECT_SMB3_1_1:
+            for con in self.negotiate_response:
+                if isinstance(con, smb2.PreauthIntegrityCapabilitiesResponse):
+                    if con.hash_algorithms != [smb2.SMB2_PREAUTH_INTEGRITY_SHA512]:
+                        raise core.BadPacket()
+                elif isinstance(con, smb2.EncryptionCapabilitiesResponse):
+                    # A cipher of 0 means none in common
+                    if con.ciphers and con.ciphers[0]:
+                        self.cipher = con.ciphers[0]
+                    else:
+                        self.cipher = None
+                elif isinstance(con, smb2.SigningCapabilitiesResponse):
+                    if len(con.signing_algorithms) != 1:
+                        raise core.BadPacket()
+                    self.signing_algorithm = con.signing_algorithms[0]
+                elif isinstance(con, smb2.CompressionCapabilitiesResponse):
+                    # NONE alone means none in common
+                    self.compression_algorithms = [
+                        algorithm for algorithm in con.compression_algorithms
+                        if algorithm != smb2.SMB2_COMPRESSION_NONE]
+                    self.compression_chained = bool(
+                        con.flags & smb2.SMB2_COMPRESSION_CAPABILITIES_FLAG_CHAINED)
+            self.preauth_integrity_hash = digest.PreauthIntegrityHash()
+            self.preauth_integrity_hash.update(smb_req.start.view(smb_req.end))
+            self.preauth_integrity_hash.update(smb_res.start.view(smb_res.end))
 
         return self
 
@@ -708,11 +1691,20 @@ class Connection(asyncore.dispatcher):
         session_id = 0
         smb_res = None
 
+        if self.preauth_integrity_hash is not None:
+            # Each session setup continues from the negotiate hash
+            preauth_integrity_hash = self.preauth_integrity_hash.copy()
+        else:
+            preauth_integrity_hash = None
+
         if bind:
             assert self.negotiate_response.dialect_revision >= 0x300
             session_id = bind.session_id
             self._binding = bind
-            self._binding_key = digest.derive_key(bind.session_key, 'SMB2AESCMAC', 'SmbSign')[:16]
+            if preauth_integrity_hash is not None:
+                self._binding_key = bind.first_channel().signing_key
+            else:
+                self._binding_key = digest.derive_key(bind.session_key, 'SMB2AESCMAC', 'SmbSign')[:16]
         
         while result == 0:
             smb_req = self.request()
@@ -726,8 +1718,14 @@ class Connection(asyncore.dispatcher):
             
             smb_res = self.transceive(smb_req.parent)[0]
             session_res = smb_res[0]
+
+            if preauth_integrity_hash is not None:
+                # All but the final response are hashed
+                preauth_integrity_hash.update(smb_req.start.view(smb_req.end))
+                if smb_res.status != ntstatus.STATUS_SUCCESS:
+                    preauth_integrity_hash.update(smb_res.start.view(smb_res.end))
             
-            result = kerberos.authGSSClientStep(context, session_res.security_buffer)
+            result = kerberos.authGSSClientStep(context, session_res.security_buffer.tostring())
 
             if bind and result == 0:
                 # Need to verify intermediate signatures
@@ -736,7 +1734,11 @@ class Connection(asyncore.dispatcher):
         result = kerberos.authGSSClientSessionKey(context)
         session_key = kerberos.authGSSClientResponse(context)[:16]
 
-        if self.negotiate_response.dialect_revision >= 0x300:
+        if preauth_integrity_hash is not None:
+            signing_key = digest.derive_key(session_key, 'SMBSigningKey',
+                                            preauth_integrity_hash.value,
+                                            terminate_context=False)[:16]
+        elif self.negotiate_response.dialect_revision >= 0x300:
             signing_key = digest.derive_key(session_key, 'SMB2AESCMAC', 'SmbSign')[:16]
         else:
             signing_key = session_key
@@ -750,6 +1752,22 @@ class Connection(asyncore.dispatcher):
             session = bind
         else:
             session = Session(self.client, smb_res.session_id, session_key)
+            if self.cipher is not None and preauth_integrity_hash is not None:
+                session.start_encryption(
+                    self.cipher,
+                    digest.derive_key(session_key, 'SMBC2SCipherKey',
+                                      preauth_integrity_hash.value,
+                                      terminate_context=False)[:16],
+                    digest.derive_key(session_key, 'SMBS2CCipherKey',
+                                      preauth_integrity_hash.value,
+                                      terminate_context=False)[:16],
+                    smb_res[0].session_flags & smb2.SMB2_SESSION_FLAG_ENCRYPT_DATA)
+            elif self.cipher is not None:
+                session.start_encryption(
+                    self.cipher,
+                    digest.derive_key(session_key, 'SMB2AESCCM', 'ServerIn ')[:16],
+                    digest.derive_key(session_key, 'SMB2AESCCM', 'ServerOut')[:16],
+                    smb_res[0].session_flags & smb2.SMB2_SESSION_FLAG_ENCRYPT_DATA)
 
         return session.addchannel(self, signing_key)
 
@@ -797,9 +1815,43 @@ class Connection(asyncore.dispatcher):
         elif self._binding and self._binding.session_id == session_id:
             return self._binding_key
 
+    def encryption_cipher(self, session_id):
+        return self._sessions[session_id].encryptor
+
+    def decryption_cipher(self, session_id):
+        if session_id in self._sessions:
+            return self._sessions[session_id].decryptor
+
+    def compression_codec(self, algorithm):
+        if algorithm not in self._compression_codecs:
+            if algorithm not in _compression_codecs:
+                return None
+            self._compression_codecs[algorithm] = \
+                _compression_codecs[algorithm]()
+        return self._compression_codecs[algorithm]
+
+    def _compress_outgoing(self, nb):
+        policy = self.client.compression
+        if policy is None or not self.compression_algorithms or \
+           nb.transform is not None or not policy.compresses(nb):
+            return
+        # Pattern_V1 is only sent within chained messages
+        codecs = [algorithm for algorithm in self.compression_algorithms
+                  if algorithm in _compression_codecs]
+        if not codecs and not self.compression_chained:
+            return
+        transform = smb2.CompressionTransformHeader(nb)
+        transform.algorithm = codecs[0] if codecs else smb2.SMB2_COMPRESSION_NONE
+        transform.chained = self.compression_chained
+        transform.pattern = smb2.SMB2_COMPRESSION_PATTERN_V1 in \
+                            self.compression_algorithms
+        transform.min_size = policy.min_size
+
     def signing_digest(self):
         assert self.negotiate_response is not None
-        if self.negotiate_response.dialect_revision >= 0x300:
+        if self.signing_algorithm is not None:
+            return _signing_digests[self.signing_algorithm]
+        elif self.negotiate_response.dialect_revision >= 0x300:
             return digest.aes128_cmac
         else:
             return digest.sha256_hmac
@@ -810,14 +1862,61 @@ class Connection(asyncore.dispatcher):
         else:
             return None
 
+# Signing digests by negotiated algorithm
+_signing_digests = {
+    smb2.SMB2_SIGNING_HMAC_SHA256: digest.sha256_hmac,
+    smb2.SMB2_SIGNING_AES_CMAC: digest.aes128_cmac,
+    smb2.SMB2_SIGNING_AES_GMAC: cipher.aes128_gmac
+}
+
+# Compression codecs by negotiated algorithm
+_compression_codecs = {
+    smb2.SMB2_COMPRESSION_LZNT1: compression.LZNT1,
+    smb2.SMB2_COMPRESSION_LZ77: compression.LZ77
+}
+
+# Transform ciphers by negotiated algorithm
+_ciphers = {
+    smb2.SMB2_ENCRYPTION_AES128_CCM: cipher.AES128CCM,
+    smb2.SMB2_ENCRYPTION_AES128_GCM: cipher.AES128GCM
+}
+
 class Session(object):
+    """
+    Session.
+
+    @ivar encrypt_data: Whether all requests in the session are
+    encrypted.  Set by the server at session setup, but may also be
+    set to encrypt a session the server does not require it for.
+    @ivar encryptor: Cipher for requests, or None if the session
+    cannot be encrypted
+    @ivar decryptor: Cipher for responses
+    """
     def __init__(self, client, session_id, session_key):
         object.__init__(self)
         self.client = client
         self.session_id = session_id
         self.session_key = session_key
+        self.encrypt_data = False
+        self.encryptor = None
+        self.decryptor = None
         self._channels = {}
 
+    def start_encryption(self, algorithm, encryption_key, decryption_key,
+                         encrypt_data=False):
+        """
+        Set up the ciphers of the session, which are shared by all
+        of its channels.
+
+        @param algorithm: The negotiated L{smb2.Cipher}
+        @param encryption_key: The key for requests
+        @param decryption_key: The key for responses
+        @param encrypt_data: Whether to encrypt all requests
+        """
+        self.encryptor = _ciphers[algorithm](encryption_key)
+        self.decryptor = _ciphers[algorithm](decryption_key)
+        self.encrypt_data = bool(encrypt_data)
+
     def addchannel(self, conn, signing_key):
         channel = Channel(conn, self, signing_key)
         self._channels[id(conn)] = channel
@@ -839,7 +1938,7 @@ class Channel(object):
         self.signing_key = signing_key
 
     def cancel(self, future):
-        if (future.response is not None):
+        if future.done:
             raise StateError("Cannot cancel completed request")
 
         smb_req = self.request()
@@ -859,30 +1958,49 @@ class Channel(object):
 
         return self.connection.submit(smb_req.parent)[0]
 
-    def tree_connect(self, path):
+    def tree_connect_async(self, path):
+        """
+        Like L{tree_connect}, but returns a L{Future} for the L{Tree}.
+        """
         smb_req = self.request()
         tree_req = smb2.TreeConnectRequest(smb_req)
 
         tree_req.path = "\\\\" + self.connection.server + "\\" + path
         
-        smb_res = self.connection.transceive(smb_req.parent)[0]
+        return self._submit(smb_req, lambda smb_res: Tree(self.session, path, smb_res))
 
-        return Tree(self.session, path, smb_res)
+    def tree_connect(self, path):
+        return self.tree_connect_async(path).result()
 
-    def tree_disconnect(self, tree):
+    def tree_disconnect_async(self, tree):
+        """
+        Like L{tree_disconnect}, but returns a L{Future} for the
+        tree disconnect response.
+        """
         smb_req = self.request(obj=tree)
         tree_req = smb2.TreeDisconnectRequest(smb_req)
 
-        self.connection.transceive(smb_req.parent)[0]
+        return self._submit(smb_req, lambda smb_res: smb_res)
 
-    def logoff(self):
+    def tree_disconnect(self, tree):
+        self.tree_disconnect_async(tree).result()
+
+    def logoff_async(self):
+        """
+        Like L{logoff}, but returns a L{Future} for the logoff response.
+        """
         smb_req = self.request()
         logoff_req = smb2.LogoffRequest(smb_req)
 
-        self.connection.transceive(smb_req.parent)[0]
+        def finish(smb_res):
+            for channel in self.session._channels.itervalues():
+                del channel.connection._sessions[self.session.session_id]
+            return smb_res
 
-        for channel in self.session._channels.itervalues():
-            del channel.connection._sessions[self.session.session_id]
+        return self._submit(smb_req, finish)
+
+    def logoff(self):
+        self.logoff_async().result()
 
     def create(self,
                tree,
@@ -949,24 +2067,37 @@ class Channel(object):
             app_instance_id_req = smb2.AppInstanceIdRequest(create_req)
             app_instance_id_req.app_instance_id = app_instance_id
 
-        open_future = Future(None)
+        return self._submit(smb_req, lambda smb_res: Open(tree, smb_res, create_guid=create_guid, prev=prev_open))
 
-        def finish(f):
-            with open_future: open_future(Open(tree, f.result(), create_guid=create_guid, prev=prev_open))
-            
-        open_future.request_future = self.connection.submit(smb_req.parent)[0]
-        open_future.request_future.then(finish)
+    def _submit(self, smb_req, finish):
+        # Submit request, returning a future for finish(response)
+        future = Future(None)
 
-        return open_future
+        def complete(f):
+            with future: future(finish(f.result()))
 
-    def close(self, handle):
+        future.request_future = self.connection.submit(smb_req.parent)[0]
+        future.request_future.then(complete)
+
+        return future
+
+    def close_async(self, handle):
+        """
+        Like L{close}, but returns a L{Future} for the close response.
+        """
         smb_req = self.request(obj=handle)
         close_req = smb2.CloseRequest(smb_req)
 
         close_req.file_id = handle.file_id
 
-        self.connection.transceive(smb_req.parent)
-        handle.dispose()
+        def finish(smb_res):
+            handle.dispose()
+            return smb_res[0]
+
+        return self._submit(smb_req, finish)
+
+    def close(self, handle):
+        self.close_async(handle).result()
 
     def query_directory(self,
                         handle,
@@ -975,6 +2106,24 @@ class Channel(object):
                         file_index = 0,
                         file_name='*',
                         output_buffer_length=8192):
+        return self.query_directory_async(handle,
+                                          file_information_class,
+                                          flags,
+                                          file_index,
+                                          file_name,
+                                          output_buffer_length).result()
+
+    def query_directory_async(self,
+                              handle,
+                              file_information_class=smb2.FILE_DIRECTORY_INFORMATION,
+                              flags = 0,
+                              file_index = 0,
+                              file_name='*',
+                              output_buffer_length=8192):
+        """
+        Like L{query_directory}, but returns a L{Future} for the
+        query directory response.
+        """
         smb_req = self.request(obj=handle)
         enum_req = smb2.QueryDirectoryRequest(smb_req)
         enum_req.file_id = handle.file_id
@@ -984,7 +2133,7 @@ class Channel(object):
         enum_req.flags = flags
         enum_req.file_index = file_index
 
-        return self.connection.transceive(smb_req.parent)[0][0]
+        return self._submit(smb_req, lambda smb_res: smb_res[0])
 
     def enum_directory(self,
                        handle,
@@ -1009,6 +2158,20 @@ class Channel(object):
                         file_information_class = smb2.FILE_BASIC_INFORMATION,
                         info_type = smb2.SMB2_0_INFO_FILE,
                         output_buffer_length = 4096):
+        return self.query_file_info_async(create_res,
+                                          file_information_class,
+                                          info_type,
+                                          output_buffer_length).result()
+
+    def query_file_info_async(self,
+                              create_res,
+                              file_information_class = smb2.FILE_BASIC_INFORMATION,
+                              info_type = smb2.SMB2_0_INFO_FILE,
+                              output_buffer_length = 4096):
+        """
+        Like L{query_file_info}, but returns a L{Future} for the
+        information queried.
+        """
         smb_req = self.request(obj=create_res)
         query_req = smb2.QueryInfoRequest(smb_req)
         
@@ -1017,9 +2180,7 @@ class Channel(object):
         query_req.file_id = create_res.file_id
         query_req.output_buffer_length = output_buffer_length
         
-        query_res = self.connection.transceive(smb_req.parent)[0][0][0]
-
-        return query_res
+        return self._submit(smb_req, lambda smb_res: smb_res[0][0])
     
     @contextlib.contextmanager
     def set_file_info(self, handle, cls):
@@ -1029,23 +2190,47 @@ class Channel(object):
         yield cls(set_req)
         self.connection.transceive(smb_req.parent)[0]
 
+    @contextlib.contextmanager
+    def set_file_info_async(self, handle, cls, futures):
+        """
+        Like L{set_file_info}, but rather than waiting for the set
+        info response, appends a L{Future} for it to futures on exit.
+        """
+        smb_req = self.request(obj=handle)
+        set_req = smb2.SetInfoRequest(smb_req)
+        set_req.file_id = handle.file_id
+        yield cls(set_req)
+        futures.append(self._submit(smb_req, lambda smb_res: smb_res))
+
     # Send an echo request and get a response
-    def echo(self):
+    def echo_async(self):
+        """
+        Like L{echo}, but returns a L{Future} for the echo response.
+        """
         # Create request structure
         smb_req = self.request()
         # Make the request struct have an ECHO_REQUEST
         enum_req = smb2.EchoRequest(smb_req)
-        # Get response  first [0] = first response, 2nd [0] = echo response
-        # frame
-        self.connection.transceive(smb_req.parent)[0][0]
+        # Complete with the echo response frame
+        return self._submit(smb_req, lambda smb_res: smb_res[0])
 
-    def flush(self,
-              file):
+    def echo(self):
+        self.echo_async().result()
+
+    def flush_async(self,
+                    file):
+        """
+        Like L{flush}, but returns a L{Future} for the flush response.
+        """
         smb_req = self.request(obj=file)
         flush_req = pike.smb2.FlushRequest(smb_req)
         flush_req.file_id = file.file_id
 
-        self.connection.transceive(smb_req.parent)
+        return self._submit(smb_req, lambda smb_res: smb_res[0])
+
+    def flush(self,
+              file):
+        self.flush_async(file).result()
 
     def read(self,
              file,
@@ -1053,6 +2238,21 @@ class Channel(object):
              offset,
              minimum_count=0,
              remaining_bytes=0):
+        return self.read_async(file,
+                               length,
+                               offset,
+                               minimum_count,
+                               remaining_bytes).result()
+
+    def read_async(self,
+                   file,
+                   length,
+                   offset,
+                   minimum_count=0,
+                   remaining_bytes=0):
+        """
+        Like L{read}, but returns a L{Future} for the data read.
+        """
         smb_req = self.request(obj=file)
         read_req = smb2.ReadRequest(smb_req)
 
@@ -1062,9 +2262,7 @@ class Channel(object):
         read_req.remaining_bytes = remaining_bytes
         read_req.file_id = file.file_id
 
-        smb_res = self.connection.transceive(smb_req.parent)
-
-        return smb_res[0][0].data
+        return self._submit(smb_req, lambda smb_res: smb_res[0].data)
 
     def write(self,
               file,
@@ -1072,6 +2270,21 @@ class Channel(object):
               buffer=None,
               remaining_bytes=0,
               flags=0):
+        return self.write_async(file,
+                                offset,
+                                buffer,
+                                remaining_bytes,
+                                flags).result()
+
+    def write_async(self,
+                    file,
+                    offset,
+                    buffer=None,
+                    remaining_bytes=0,
+                    flags=0):
+        """
+        Like L{write}, but returns a L{Future} for the count written.
+        """
         smb_req = self.request(obj=file)
         write_req = smb2.WriteRequest(smb_req)
 
@@ -1081,9 +2294,90 @@ class Channel(object):
         write_req.remaining_bytes = remaining_bytes
         write_req.flags = flags
 
-        smb_res = self.connection.transceive(smb_req.parent)
+        return self._submit(smb_req, lambda smb_res: smb_res[0].count)
+
+    def _chunk_size(self, limit):
+        # Largest payload a single request may carry: the negotiated
+        # limit, or one credit's worth without multi-credit support
+        if not self.connection._large_mtu:
+            limit = min(limit, 65536)
+        return limit
 
-        return smb_res[0][0].count
+    def read_range(self, file, offset, length):
+        """
+        Read a range of a file of any length.
+
+        The range is split into the largest reads the connection
+        allows, which are issued concurrently as credits permit.
+
+        @param file: The open file to read from
+        @param offset: The offset of the range
+        @param length: The length of the range
+        @return: A L{core.ByteView} of the data read, which is shorter
+        than length if the end of the file falls within the range
+        """
+        return self.read_range_async(file, offset, length).result()
+
+    @coroutine
+    def read_range_async(self, file, offset, length):
+        """
+        Like L{read_range}, but returns a L{Future} for the data read.
+        """
+        chunk = self._chunk_size(self.connection.negotiate_response.max_read_size)
+        end = offset + length
+        ranges = [(pos, min(chunk, end - pos)) for pos in xrange(offset, end, chunk)]
+
+        def empty_at_eof(future):
+            # Chunks are issued together, so those wholly past the end
+            # of the file fail rather than coming back short
+            try:
+                return future.result()
+            except ResponseError as e:
+                if e.response.status == ntstatus.STATUS_END_OF_FILE:
+                    return ''
+                raise
+
+        futures = [self.read_async(file, size, pos) for (pos, size) in ranges]
+        results = yield futures[:1] + [f.then(empty_at_eof) for f in futures[1:]]
+
+        data = bytearray(length)
+        count = 0
+        for ((pos, size), result) in zip(ranges, results):
+            if isinstance(result, core.ByteView):
+                data[count:count+len(result)] = buffer(result.buffer, result.start, len(result))
+            else:
+                data[count:count+len(result)] = buffer(result)
+            count += len(result)
+            if len(result) < size:
+                # Reached end of file
+                break
+        raise Return(core.ByteView(data, 0, count))
+
+    def write_range(self, file, offset, buffer):
+        """
+        Write a buffer of any length to a file.
+
+        The buffer is split into the largest writes the connection
+        allows, which are issued concurrently as credits permit.
+
+        @param file: The open file to write to
+        @param offset: The offset to write at
+        @param buffer: The data to write; a string, array, bytearray,
+        memoryview or L{core.ByteView}
+        @return: The total count of bytes written
+        """
+        return self.write_range_async(file, offset, buffer).result()
+
+    @coroutine
+    def write_range_async(self, file, offset, buffer):
+        """
+        Like L{write_range}, but returns a L{Future} for the count
+        written.
+        """
+        chunk = self._chunk_size(self.connection.negotiate_response.max_write_size)
+        counts = yield [self.write_async(file, offset + pos, buffer[pos:pos+chunk])
+                        for pos in xrange(0, len(buffer), chunk)]
+        raise Return(sum(counts))
 
     def lock(self, handle, locks, sequence=0):
         """
@@ -1098,7 +2392,16 @@ class Channel(object):
 
         return self.connection.submit(smb_req.parent)[0]
 
-    def validate_negotiate_info(self, tree):
+    def validate_negotiate_info_async(self, tree):
+        """
+        Like L{validate_negotiate_info}, but returns a L{Future} for
+        the response.
+        """
+        if self.connection.negotiate_response.dialect_revision == smb2.DIALECT_SMB3_1_1:
+            # Preauth integrity protects the 3.1.1 negotiate instead,
+            # and servers drop the connection on this request
+            raise StateError("Validate negotiate is not used with SMB 3.1.1")
+
         smb_req = self.request(obj=tree)
         ioctl_req = smb2.IoctlRequest(smb_req)
         vni_req = smb2.ValidateNegotiateInfoRequest(ioctl_req)
@@ -1112,9 +2415,10 @@ class Channel(object):
         vni_req.security_mode = client.security_mode
         vni_req.dialects = client.dialects
 
-        res = self.connection.transceive(smb_req.parent)[0]
+        return self._submit(smb_req, lambda smb_res: smb_res)
 
-        return res
+    def validate_negotiate_info(self, tree):
+        return self.validate_negotiate_info_async(tree).result()
 
     def frame(self):
         return self.connection.frame()
@@ -1128,9 +2432,23 @@ class Channel(object):
             smb_req.flags |= smb2.SMB2_FLAGS_SIGNED
 
         if isinstance(obj, Tree):
-            smb_req.tree_id = obj.tree_id
+            tree = obj
         elif isinstance(obj, Open):
-            smb_req.tree_id = obj.tree.tree_id
+            tree = obj.tree
+        else:
+            tree = None
+        if tree is not None:
+            smb_req.tree_id = tree.tree_id
+
+        if self.session.encrypt_data or (tree is not None and tree.encrypt_data):
+            if self.session.encryptor is None:
+                raise StateError("Encryption required but not available "
+                                 "on this session")
+            # Encrypted requests are not signed
+            smb_req.flags &= ~smb2.SMB2_FLAGS_SIGNED
+            if smb_req.parent.transform is None:
+                transform = smb2.TransformHeader(smb_req.parent)
+                transform.session_id = self.session.session_id
 
         return smb_req
 
@@ -1144,6 +2462,8 @@ class Tree(object):
         self.path = path
         self.tree_id = smb_res.tree_id
         self.tree_connect_response = smb_res[0]
+        self.encrypt_data = bool(smb_res[0].share_flags &
+                                 smb2.SMB2_SHAREFLAG_ENCRYPT_DATA)
 
 class Open(object):
     def __init__(self, tree, smb_res, create_guid=None, prev=None):
@@ -37,31 +37,47 @@
 import core
 import smb2
 
+# ProtocolId of the SMB3 transform header, as a little-endian uint32
+_transform_protocol_id = 0x424d53fd
+# ProtocolId of the SMB 3.1.1 compression transform header
+_compression_protocol_id = 0x424d53fc
+
 class Netbios(core.Frame):
     def __init__(self, context=None):
         core.Frame.__init__(self, None, context)
         self.len = 0
         self._smb2_frames = []
+        # smb2.TransformHeader, if the smb2 frames are encrypted, or
+        # smb2.CompressionTransformHeader, if they may be compressed
+        self.transform = None
 
     def _children(self):
         return self._smb2_frames
 
     def _encode(self, cur):
         # Frame length (0 for now)
-        len_hole = cur.hole.encode_uint32be(0)
+        len_hole = cur.reserve_uint32be()
         base = cur.copy()
 
-        for child in self.children:
-            child.encode(cur)
+        if self.transform is not None:
+            self.transform.encode(cur)
+        else:
+            for child in self.children:
+                child.encode(cur)
 
         self.len = cur - base
-        len_hole(self.len)
+        cur.patch_uint32be(len_hole, self.len)
 
     def _decode(self, cur):
         self.len = cur.decode_uint32be()
         end = cur + self.len
 
         with cur.bounded(cur, end):
+            protocol_id = (cur+0).decode_uint32le() if cur < end else None
+            if protocol_id == _transform_protocol_id:
+                smb2.TransformHeader(self).decode(cur)
+            elif protocol_id == _compression_protocol_id:
+                smb2.CompressionTransformHeader(self).decode(cur)
             while (cur < end):
                 smb2_frame = smb2.Smb2(self)
                 smb2_frame.decode(cur)
@@ -47,6 +47,7 @@ maintaining a clear visual distinction between values and types.
 """
 
 import array
+import os
 import core
 import nttime
 import re
@@ -58,6 +59,8 @@ class Dialect(core.ValueEnum):
     DIALECT_SMB2_002      = 0x0202
     DIALECT_SMB2_1        = 0x0210
     DIALECT_SMB3_0        = 0x0300
+    DIALECT_SMB3_0_2      = 0x0302
+    DIALECT_SMB3_1_1      = 0x0311
 
 Dialect.import_items(globals())
 
@@ -105,10 +108,48 @@ class ShareCaps(core.FlagEnum):
 
 ShareCaps.import_items(globals())
 
+# Share Flags
+class ShareFlags(core.FlagEnum):
+    SMB2_SHAREFLAG_DFS                         = 0x00000001
+    SMB2_SHAREFLAG_DFS_ROOT                    = 0x00000002
+    SMB2_SHAREFLAG_RESTRICT_EXCLUSIVE_OPENS    = 0x00000100
+    SMB2_SHAREFLAG_FORCE_SHARED_DELETE         = 0x00000200
+    SMB2_SHAREFLAG_ALLOW_NAMESPACE_CACHING     = 0x00000400
+    SMB2_SHAREFLAG_ACCESS_BASED_DIRECTORY_ENUM = 0x00000800
+    SMB2_SHAREFLAG_FORCE_LEVELII_OPLOCK        = 0x00001000
+    SMB2_SHAREFLAG_ENABLE_HASH_V1              = 0x00002000
+    SMB2_SHAREFLAG_ENABLE_HASH_V2              = 0x00004000
+    SMB2_SHAREFLAG_ENCRYPT_DATA                = 0x00008000
+
+ShareFlags.import_items(globals())
+
 # Misc
 RELATED_FID = (2**64-1,2**64-1)
 UNSOLICITED_MESSAGE_ID = (2**64-1)
 
+# Fixed layout of the 64-byte SMB2 header, with and without Signature
+_smb2_header = core.compile_struct('<4sHHLHHLLQQQ16s')
+_smb2_header_prefix = core.compile_struct('<4sHHLHHLLQQQ')
+_next_command_offset = 20
+_signature_offset = 48
+_zero_signature = '\0' * 16
+
+# Fixed layout of the 52-byte transform header, and the offset of the
+# part of it authenticated as additional data (Nonce onwards)
+_transform_header = core.compile_struct('<4s16s16sLHHQ')
+_transform_aad_offset = 20
+
+# Compression transform headers, unchained and chained, and the
+# payload headers of a chained message (the original size follows
+# for payloads which are neither uncompressed nor a pattern)
+_compression_header = core.compile_struct('<4sLHHL')
+_chained_compression_header = core.compile_struct('<4sL')
+_compression_payload_header = core.compile_struct('<HHL')
+_compression_payload_size = core.compile_struct('<L')
+_compression_pattern = core.compile_struct('<BBHL')
+# Shortest run of a byte sent as a Pattern_V1 payload
+_compression_pattern_min_size = 32
+
 class Smb2(core.Frame):
     _request_table = {}
     _response_table = {}
@@ -140,35 +181,37 @@ class Smb2(core.Frame):
         return [self._command] if self._command is not None else []
 
     def _encode(self, cur):
-        cur.encode_bytes('\xfeSMB')
-        cur.encode_uint16le(64)
-        cur.encode_uint16le(self.credit_charge)
         if self.flags & SMB2_FLAGS_SERVER_TO_REDIR:
-            cur.encode_uint32le(self.status)
+            status = self.status
+            credit = self.credit_response
         else:
-            cur.encode_uint16le(self.channel_sequence)
-            cur.encode_uint16le(0)
+            # ChannelSequence followed by 16 bits of Reserved
+            status = self.channel_sequence
+            credit = self.credit_request
 
         if self.command is None:
             self.command = self._command.command_id
-        cur.encode_uint16le(self.command)
 
-        if self.flags & SMB2_FLAGS_SERVER_TO_REDIR:
-            cur.encode_uint16le(self.credit_response)
-        else:
-            cur.encode_uint16le(self.credit_request)
-        cur.encode_uint32le(self.flags)
-        # Set NextCommand to 0 for now
-        next_command_hole = cur.hole.encode_uint32le(0)
-        cur.encode_uint64le(self.message_id)
         if self.flags & SMB2_FLAGS_ASYNC_COMMAND:
-            cur.encode_uint64le(self.async_id)
+            async_id = self.async_id
         else:
-            cur.encode_uint32le(0)
-            cur.encode_uint32le(self.tree_id)
-        cur.encode_uint64le(self.session_id)
-        # Set Signature to 0 for now
-        signature_hole = cur.hole.encode_bytes([0]*16)
+            # Reserved followed by TreeId
+            async_id = self.tree_id << 32
+
+        # NextCommand and Signature are 0 for now
+        cur.encode_struct(_smb2_header,
+                          '\xfeSMB',
+                          64,
+                          self.credit_charge,
+                          status,
+                          self.command,
+                          credit,
+                          self.flags,
+                          0,
+                          self.message_id,
+                          async_id,
+                          self.session_id,
+                          '\0' * 16)
 
         # Encode command body
         self._command.encode(cur)
@@ -184,54 +227,84 @@ class Smb2(core.Frame):
         else:
             self.next_command = 0
 
-        next_command_hole(self.next_command)
+        (self.start + _next_command_offset).encode_uint32le(self.next_command)
         
-        # Calculate and backpatch signature
+        # Calculate and backpatch signature, unless the context signs
+        # frames itself once they are encoded (see L{sign})
         if self.flags & SMB2_FLAGS_SIGNED:
-            digest = self.context.signing_digest()
-            key = self.context.signing_key(self.session_id)
-            self.signature = digest(key, self.start[:cur])[:16]
+            if not getattr(self.context, 'deferred_signing', False):
+                self.sign(self.context.signing_digest(),
+                          self.context.signing_key(self.session_id),
+                          end=cur)
         else:
             self.signature = array.array('B',[0]*16)
-            
-        signature_hole(self.signature)
+            (self.start + _signature_offset).encode_bytes(self.signature)
+
+    def signed_parts(self, end=None):
+        """
+        Return the parts of the encoded or decoded frame covered by
+        its signature: views of the frame either side of the signature
+        field, which is signed as zero.
+
+        @param end: The end of the frame, if it is still being encoded
+        """
+        signature_start = self.start + _signature_offset
+        signature_end = signature_start + 16
+        return (self.start.view(signature_start),
+                _zero_signature,
+                signature_end.view(self.end if end is None else end))
+
+    def sign(self, digest, key, signature=None, end=None):
+        """
+        Backpatch the signature of an encoded frame.
+
+        @param digest: The signing digest function
+        @param key: The signing key
+        @param signature: A signature already computed from
+        L{signed_parts}, or None to compute it
+        @param end: The end of the frame, if it is still being encoded
+        """
+        if signature is None:
+            signature = digest(key, *self.signed_parts(end))[:16]
+        self.signature = signature
+        (self.start + _signature_offset).encode_bytes(signature)
 
     def _decode(self, cur):
-        if (cur.decode_bytes(4).tostring() != '\xfeSMB'):
+        (protocol_id,
+         structure_size,
+         self.credit_charge,
+         status,
+         command,
+         credit,
+         flags,
+         self.next_command,
+         self.message_id,
+         async_id,
+         self.session_id) = cur.decode_struct(_smb2_header_prefix)
+
+        if protocol_id != '\xfeSMB' or structure_size != 64:
             raise core.BadPacket()
-        if (cur.decode_uint16le() != 64):
-            raise core.BadPacket()
-        self.credit_charge = cur.decode_uint16le()
-        # Look ahead and decode flags first
-        self.flags = Flags((cur + 8).decode_uint32le())
+
+        self.flags = Flags(flags)
         if self.flags & SMB2_FLAGS_SERVER_TO_REDIR:
-            self.status = ntstatus.Status(cur.decode_uint32le())
+            self.status = ntstatus.Status(status)
             self.channel_sequence = None
+            self.credit_response = credit
+            self.credit_request = None
         else:
-            self.channel_sequence = cur.decode_uint16le()
             # Ignore reserved
-            cur.decode_uint16le()
+            self.channel_sequence = status & 0xffff
             self.status = None
-        self.command = CommandId(cur.decode_uint16le())
-        if self.flags & SMB2_FLAGS_SERVER_TO_REDIR:
-            self.credit_response = cur.decode_uint16le()
-            self.credit_request = None
-        else:
-            self.credit_request = cur.decode_uint16le()
+            self.credit_request = credit
             self.credit_response = None
-        # Skip over flags
-        cur += 4
-        self.next_command = cur.decode_uint32le()
-        self.message_id = cur.decode_uint64le()
+        self.command = CommandId(command)
         if self.flags & SMB2_FLAGS_ASYNC_COMMAND:
-            self.async_id = cur.decode_uint64le()
+            self.async_id = async_id
             self.tree_id = None
         else:
             # Ignore reserved
-            cur.decode_uint32le()
-            self.tree_id = cur.decode_uint32le()
+            self.tree_id = async_id >> 32
             self.async_id = None
-        self.session_id = cur.decode_uint64le()
         self.signature = cur.decode_bytes(16)
 
         # Peek ahead at structure_size
@@ -263,22 +336,331 @@ class Smb2(core.Frame):
 
         self._command = cls(self)
         with cur.bounded(cur, end):
-            self._command.decode(cur)
+            if getattr(self.context, 'lazy_decode', False):
+                self._command.defer(cur)
+            else:
+                self._command.decode(cur)
 
         # Advance to next frame or end of data
         cur.advanceto(end)
 
     def verify(self, digest, key):
         if self.flags & SMB2_FLAGS_SIGNED:
-            message = self.start[:self.end]
-            # Zero out signature in message
-            message[12*4:12*4+16] = array.array('B',[0]*16)
-            # Calculate signature
-            signature = digest(key, message)[:16]
+            # Calculate signature over views of the message, without
+            # copying it
+            signature = digest(key, *self.signed_parts())[:16]
             # Check that signatures match
             if signature != self.signature:
                 raise core.BadPacket()
 
+class TransformHeader(core.Frame):
+    """
+    SMB3 transform header.
+
+    Encrypts the L{Smb2} frames of its parent netbios frame as they are
+    encoded, and decrypts them as they are decoded.  The ciphers are
+    obtained from the context by session id (see
+    L{pike.model.Connection.encryption_cipher}).
+
+    SMB 3.1.1 servers compress a message before encrypting it, so a
+    decrypted message may itself start with a compression transform
+    header, which is decoded in turn.
+
+    @ivar compression: The L{CompressionTransformHeader} found inside
+    a decrypted message, or None
+    """
+    def __init__(self, parent, context=None):
+        core.Frame.__init__(self, parent, context)
+        self.compression = None
+        self.signature = None
+        self.nonce = None
+        self.original_message_size = None
+        self.flags = SMB2_TRANSFORM_FLAG_ENCRYPTED
+        self.session_id = 0
+        if parent is not None:
+            parent.transform = self
+
+    def _encode(self, cur):
+        cipher = self.context.encryption_cipher(self.session_id)
+        self.nonce = array.array('B', os.urandom(cipher.nonce_size))
+
+        # Signature and OriginalMessageSize are backpatched
+        cur.encode_struct(_transform_header,
+                          '\xfdSMB',
+                          _zero_signature,
+                          self.nonce.tostring() + '\0' * (16 - len(self.nonce)),
+                          0,
+                          0,
+                          self.flags,
+                          self.session_id)
+
+        # Encode the smb2 frames in place, then overwrite them with
+        # their encryption
+        message = cur.copy()
+        for child in self.parent.children:
+            child.encode(cur)
+        self.original_message_size = cur - message
+        (self.start + 36).encode_uint32le(self.original_message_size)
+        (ciphertext, tag) = cipher.encrypt(
+            self.nonce,
+            (self.start + _transform_aad_offset).view(message),
+            message.view(cur))
+        message.copy().encode_bytes(ciphertext)
+        self.signature = array.array('B', tag)
+        (self.start + 4).encode_bytes(tag)
+
+    def _decode(self, cur):
+        (protocol_id,
+         signature,
+         nonce,
+         self.original_message_size,
+         _,
+         self.flags,
+         self.session_id) = cur.decode_struct(_transform_header)
+
+        if protocol_id != '\xfdSMB':
+            raise core.BadPacket()
+
+        cipher = self.context.decryption_cipher(self.session_id)
+        if cipher is None:
+            raise core.BadPacket()
+        self.signature = array.array('B', signature)
+        self.nonce = array.array('B', nonce[:cipher.nonce_size])
+
+        end = cur.upperbound
+        message = cipher.decrypt(self.nonce,
+                                 (self.start + _transform_aad_offset).view(cur),
+                                 cur.view(end),
+                                 signature)
+        if message is None or len(message) != self.original_message_size:
+            raise core.BadPacket()
+        cur.advanceto(end)
+
+        # Decode the smb2 frames from the decrypted message
+        message = bytearray(message)
+        inner = core.Cursor(message, 0)
+        end = inner + len(message)
+        with inner.bounded(inner, end):
+            if message[:4] == '\xfcSMB':
+                self.compression = CompressionTransformHeader(self.parent)
+                # The parent's transform remains the outer one
+                self.parent.transform = self
+                self.compression.decode(inner)
+            while inner < end:
+                smb2_frame = Smb2(self.parent)
+                smb2_frame.decode(inner)
+
+class CompressionTransformHeader(core.Frame):
+    """
+    SMB 3.1.1 compression transform header.
+
+    Compresses the L{Smb2} frames of its parent netbios frame once they
+    are encoded (and signed), if they are at least min_size bytes and
+    compression makes them smaller; otherwise they are sent as is.
+    Received messages are decompressed, chained or not, and their
+    frames decoded.  The codecs are obtained from the context by
+    algorithm (see L{pike.model.Connection.compression_codec}).
+
+    Requests are never both compressed and encrypted.  A response
+    compressed and then encrypted is decoded by the enclosing
+    L{TransformHeader}.
+
+    @ivar algorithm: The L{CompressionAlgorithm} to compress with
+    @ivar chained: Whether to send a chained message, which falls back
+    to uncompressed payloads rather than to an uncompressed message
+    @ivar pattern: Whether runs of a byte at either end of a chained
+    message are sent as Pattern_V1 payloads
+    @ivar min_size: The smallest message to compress
+    @ivar original_size: The size of the uncompressed message
+    @ivar payloads: The L{CompressionAlgorithm}s of the payloads, or
+    empty if the message is not compressed
+    """
+    def __init__(self, parent, context=None):
+        core.Frame.__init__(self, parent, context)
+        self.algorithm = SMB2_COMPRESSION_LZ77
+        self.chained = False
+        self.pattern = False
+        self.min_size = 0
+        self.original_size = None
+        self.payloads = []
+        if parent is not None:
+            parent.transform = self
+
+    def _encode(self, cur):
+        # Encode the smb2 frames in place, signing any left for the
+        # context to sign since they are about to be overwritten
+        message = cur.copy()
+        for child in self.parent.children:
+            child.encode(cur)
+            if child.flags & SMB2_FLAGS_SIGNED and \
+               getattr(self.context, 'deferred_signing', False):
+                child.sign(self.context.signing_digest(),
+                           self.context.signing_key(child.session_id))
+        self.original_size = cur - message
+        self.payloads = []
+        if self.original_size < self.min_size:
+            return
+
+        data = message.view(cur).tostring()
+        if self.chained:
+            parts = self._compress_chained(data)
+        else:
+            parts = self._compress(data)
+        if parts is None:
+            self.payloads = []
+            return
+
+        # Replace the frames with their compression
+        cur.reverseto(message)
+        for part in parts:
+            cur.encode_bytes(part)
+        cur.trunc()
+
+    def _compress(self, data):
+        codec = self.context.compression_codec(self.algorithm)
+        compressed = codec.compress(data)
+        if _compression_header.size + len(compressed) >= len(data):
+            return None
+        self.payloads.append(self.algorithm)
+        return [_compression_header.pack('\xfcSMB',
+                                         len(data),
+                                         self.algorithm,
+                                         SMB2_COMPRESSION_FLAG_NONE,
+                                         0),
+                compressed]
+
+    def _compress_chained(self, data):
+        size = len(data)
+        start = 0
+        end = size
+        if self.pattern:
+            start = size - len(data.lstrip(data[0]))
+            if start < _compression_pattern_min_size:
+                start = 0
+            end = len(data.rstrip(data[-1]))
+            if end < start or size - end < _compression_pattern_min_size:
+                end = size
+
+        parts = [_chained_compression_header.pack('\xfcSMB', size)]
+        if start:
+            self._pattern_payload(parts, data[0], start)
+        if start < end:
+            compressed = None
+            if self.algorithm != SMB2_COMPRESSION_NONE:
+                codec = self.context.compression_codec(self.algorithm)
+                compressed = codec.compress(data, start, end)
+                if len(compressed) + _compression_payload_size.size >= \
+                   end - start:
+                    compressed = None
+            if compressed is not None:
+                self.payloads.append(self.algorithm)
+                parts.append(_compression_payload_header.pack(
+                    self.algorithm,
+                    SMB2_COMPRESSION_FLAG_CHAINED,
+                    _compression_payload_size.size + len(compressed)))
+                parts.append(_compression_payload_size.pack(end - start))
+                parts.append(compressed)
+            else:
+                self.payloads.append(SMB2_COMPRESSION_NONE)
+                parts.append(_compression_payload_header.pack(
+                    SMB2_COMPRESSION_NONE,
+                    SMB2_COMPRESSION_FLAG_CHAINED,
+                    end - start))
+                parts.append(data[start:end])
+        if end < size:
+            self._pattern_payload(parts, data[-1], size - end)
+
+        if sum(len(part) for part in parts) >= size:
+            return None
+        return parts
+
+    def _pattern_payload(self, parts, byte, repetitions):
+        self.payloads.append(SMB2_COMPRESSION_PATTERN_V1)
+        parts.append(_compression_payload_header.pack(
+            SMB2_COMPRESSION_PATTERN_V1,
+            SMB2_COMPRESSION_FLAG_CHAINED,
+            _compression_pattern.size))
+        parts.append(_compression_pattern.pack(ord(byte), 0, 0, repetitions))
+
+    def _decode(self, cur):
+        end = cur.upperbound
+        (protocol_id, original_size) = \
+            cur.decode_struct(_chained_compression_header)
+        if protocol_id != '\xfcSMB':
+            raise core.BadPacket()
+        # Flags are in the same place in both forms
+        self.chained = bool((cur + 2).decode_uint16le() &
+                            SMB2_COMPRESSION_FLAG_CHAINED)
+        self.payloads = []
+
+        if self.chained:
+            message = bytearray(original_size)
+            position = 0
+            while cur < end:
+                (algorithm, _, length) = \
+                    cur.decode_struct(_compression_payload_header)
+                payload_end = cur + length
+                if payload_end > end:
+                    raise core.BadPacket()
+                algorithm = self._algorithm(algorithm)
+                if algorithm == SMB2_COMPRESSION_NONE:
+                    size = length
+                    if position + size > original_size:
+                        raise core.BadPacket()
+                    message[position:position + size] = \
+                        cur.view(payload_end).tostring()
+                elif algorithm == SMB2_COMPRESSION_PATTERN_V1:
+                    (pattern, _, _, size) = \
+                        cur.decode_struct(_compression_pattern)
+                    if position + size > original_size:
+                        raise core.BadPacket()
+                    message[position:position + size] = chr(pattern) * size
+                else:
+                    (size,) = cur.decode_struct(_compression_payload_size)
+                    if position + size > original_size:
+                        raise core.BadPacket()
+                    self._decompress(algorithm, cur.view(payload_end),
+                                     message, position, size)
+                position += size
+                cur.advanceto(payload_end)
+            if position != original_size:
+                raise core.BadPacket()
+        else:
+            # The rest of the header is laid out as a payload header,
+            # with Offset in place of Length
+            (algorithm, _, offset) = \
+                cur.decode_struct(_compression_payload_header)
+            algorithm = self._algorithm(algorithm)
+            message = bytearray(offset + original_size)
+            # Offset bytes are sent uncompressed
+            message[:offset] = cur.decode_bytes(offset).tostring()
+            self._decompress(algorithm, cur.view(end),
+                             message, offset, original_size)
+            cur.advanceto(end)
+        self.original_size = len(message)
+
+        # Decode the smb2 frames from the decompressed message
+        inner = core.Cursor(message, 0)
+        end = inner + len(message)
+        with inner.bounded(inner, end):
+            while inner < end:
+                smb2_frame = Smb2(self.parent)
+                smb2_frame.decode(inner)
+
+    def _algorithm(self, algorithm):
+        try:
+            algorithm = CompressionAlgorithm(algorithm)
+        except ValueError:
+            raise core.BadPacket()
+        self.payloads.append(algorithm)
+        return algorithm
+
+    def _decompress(self, algorithm, data, message, position, size):
+        codec = self.context.compression_codec(algorithm)
+        if codec is None:
+            raise core.BadPacket()
+        codec.decompress(data, message, position, size)
+
 class Command(core.Frame):
     def __init__(self, parent):
         core.Frame.__init__(self, parent)
@@ -353,6 +735,61 @@ class GlobalCaps(core.FlagEnum):
 
 GlobalCaps.import_items(globals())
 
+# Encryption constants
+class Cipher(core.ValueEnum):
+    SMB2_ENCRYPTION_AES128_CCM = 0x0001
+    SMB2_ENCRYPTION_AES128_GCM = 0x0002
+
+Cipher.import_items(globals())
+
+class TransformFlags(core.FlagEnum):
+    SMB2_TRANSFORM_FLAG_ENCRYPTED = 0x0001
+
+TransformFlags.import_items(globals())
+
+# Compression constants
+class CompressionAlgorithm(core.ValueEnum):
+    SMB2_COMPRESSION_NONE         = 0x0000
+    SMB2_COMPRESSION_LZNT1        = 0x0001
+    SMB2_COMPRESSION_LZ77         = 0x0002
+    SMB2_COMPRESSION_LZ77_HUFFMAN = 0x0003
+    SMB2_COMPRESSION_PATTERN_V1   = 0x0004
+
+CompressionAlgorithm.import_items(globals())
+
+class CompressionCapabilitiesFlags(core.FlagEnum):
+    SMB2_COMPRESSION_CAPABILITIES_FLAG_NONE    = 0x00000000
+    SMB2_COMPRESSION_CAPABILITIES_FLAG_CHAINED = 0x00000001
+
+CompressionCapabilitiesFlags.import_items(globals())
+
+class CompressionFlags(core.FlagEnum):
+    SMB2_COMPRESSION_FLAG_NONE    = 0x0000
+    SMB2_COMPRESSION_FLAG_CHAINED = 0x0001
+
+CompressionFlags.import_items(globals())
+
+# Negotiate context constants
+class NegotiateContextType(core.ValueEnum):
+    SMB2_PREAUTH_INTEGRITY_CAPABILITIES = 0x0001
+    SMB2_ENCRYPTION_CAPABILITIES        = 0x0002
+    SMB2_COMPRESSION_CAPABILITIES       = 0x0003
+    SMB2_SIGNING_CAPABILITIES           = 0x0008
+
+NegotiateContextType.import_items(globals())
+
+class HashAlgorithm(core.ValueEnum):
+    SMB2_PREAUTH_INTEGRITY_SHA512 = 0x0001
+
+HashAlgorithm.import_items(globals())
+
+class SigningAlgorithm(core.ValueEnum):
+    SMB2_SIGNING_HMAC_SHA256 = 0x0000
+    SMB2_SIGNING_AES_CMAC    = 0x0001
+    SMB2_SIGNING_AES_GMAC    = 0x0002
+
+SigningAlgorithm.import_items(globals())
+
 class NegotiateRequest(Request):
     command_id = SMB2_NEGOTIATE
     structure_size = 36
@@ -363,6 +800,10 @@ class NegotiateRequest(Request):
         self.capabilities = 0
         self.client_guid = [0]*16
         self.dialects = []
+        self._negotiate_contexts = []
+
+    def _children(self):
+        return self._negotiate_contexts
 
     def _encode(self, cur):
         cur.encode_uint16le(len(self.dialects))
@@ -370,14 +811,41 @@ class NegotiateRequest(Request):
         cur.encode_uint16le(0)
         cur.encode_uint32le(self.capabilities)
         cur.encode_bytes(self.client_guid)
-        cur.encode_uint64le(0)
+        if self._negotiate_contexts:
+            negotiate_context_offset_hole = cur.reserve_uint32le()
+            cur.encode_uint16le(len(self._negotiate_contexts))
+            # Reserved2
+            cur.encode_uint16le(0)
+        else:
+            # ClientStartTime
+            cur.encode_uint64le(0)
         for dialect in self.dialects:
             cur.encode_uint16le(dialect)
 
+        if self._negotiate_contexts:
+            cur.align(self.parent.start, 8)
+            cur.patch_uint32le(negotiate_context_offset_hole,
+                               cur - self.parent.start)
+            for con in self._negotiate_contexts:
+                cur.align(self.parent.start, 8)
+                cur.encode_uint16le(con.context_type)
+                data_length_hole = cur.reserve_uint16le()
+                # Reserved
+                cur.encode_uint32le(0)
+                data_start = cur.copy()
+                con.encode(cur)
+                cur.patch_uint16le(data_length_hole, cur - data_start)
+
+    def append(self, e):
+        self._negotiate_contexts.append(e)
+
 class NegotiateResponse(Response):
     command_id = SMB2_NEGOTIATE
     structure_size = 65
 
+    _context_table = {}
+    negotiate_context = core.Register(_context_table, 'context_type')
+
     def __init__(self, parent):
         Response.__init__(self, parent)
         self.security_mode = 0
@@ -390,12 +858,16 @@ class NegotiateResponse(Response):
         self.system_time = 0
         self.server_start_time = 0
         self.security_buffer = None
+        self._negotiate_contexts = []
+
+    def _children(self):
+        return self._negotiate_contexts
 
     def _decode(self, cur):
         self.security_mode = SecurityMode(cur.decode_uint16le())
         self.dialect_revision = Dialect(cur.decode_uint16le())
-        # Reserved (ignore)
-        cur.decode_uint16le()
+        # NegotiateContextCount (3.1.1), otherwise reserved
+        negotiate_context_count = cur.decode_uint16le()
         self.server_guid = cur.decode_bytes(16)
         self.capabilities = GlobalCaps(cur.decode_uint32le())
         self.max_transact_size = cur.decode_uint32le()
@@ -407,18 +879,166 @@ class NegotiateResponse(Response):
         offset = cur.decode_uint16le()
         length = cur.decode_uint16le()
 
-        # Reserved2 (ignore)
-        cur.decode_uint32le()
+        # NegotiateContextOffset (3.1.1), otherwise reserved
+        negotiate_context_offset = cur.decode_uint32le()
 
         # Advance to security buffer
         cur.advanceto(self.parent.start + offset)
 
         self.security_buffer = cur.decode_bytes(length)
 
+        if self.dialect_revision == DIALECT_SMB3_1_1 and \
+           negotiate_context_count:
+            cur.advanceto(self.parent.start + negotiate_context_offset)
+            for i in xrange(negotiate_context_count):
+                cur.align(self.parent.start, 8)
+                context_type = cur.decode_uint16le()
+                data_length = cur.decode_uint16le()
+                # Reserved
+                cur.decode_uint32le()
+                end = cur + data_length
+                if context_type in self._context_table:
+                    with cur.bounded(cur, end):
+                        self._context_table[context_type](self).decode(cur)
+                # Skip unknown contexts, and any trailing data
+                cur.advanceto(end)
+
+    def append(self, e):
+        self._negotiate_contexts.append(e)
+
+class NegotiateRequestContext(core.Frame):
+    def __init__(self, parent):
+        core.Frame.__init__(self, parent)
+        if parent is not None:
+            parent.append(self)
+
+@NegotiateResponse.negotiate_context
+class NegotiateResponseContext(core.Frame):
+    def __init__(self, parent):
+        core.Frame.__init__(self, parent)
+        if parent is not None:
+            parent.append(self)
+
+class PreauthIntegrityCapabilitiesRequest(NegotiateRequestContext):
+    context_type = SMB2_PREAUTH_INTEGRITY_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateRequestContext.__init__(self, parent)
+        self.hash_algorithms = [SMB2_PREAUTH_INTEGRITY_SHA512]
+        self.salt = array.array('B', os.urandom(32))
+
+    def _encode(self, cur):
+        cur.encode_uint16le(len(self.hash_algorithms))
+        cur.encode_uint16le(len(self.salt))
+        for algorithm in self.hash_algorithms:
+            cur.encode_uint16le(algorithm)
+        cur.encode_bytes(self.salt)
+
+class PreauthIntegrityCapabilitiesResponse(NegotiateResponseContext):
+    context_type = SMB2_PREAUTH_INTEGRITY_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateResponseContext.__init__(self, parent)
+        self.hash_algorithms = []
+        self.salt = None
+
+    def _decode(self, cur):
+        algorithm_count = cur.decode_uint16le()
+        salt_length = cur.decode_uint16le()
+        self.hash_algorithms = [HashAlgorithm(cur.decode_uint16le())
+                                for i in xrange(algorithm_count)]
+        self.salt = cur.decode_bytes(salt_length)
+
+class EncryptionCapabilitiesRequest(NegotiateRequestContext):
+    context_type = SMB2_ENCRYPTION_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateRequestContext.__init__(self, parent)
+        self.ciphers = [SMB2_ENCRYPTION_AES128_GCM,
+                        SMB2_ENCRYPTION_AES128_CCM]
+
+    def _encode(self, cur):
+        cur.encode_uint16le(len(self.ciphers))
+        for cipher in self.ciphers:
+            cur.encode_uint16le(cipher)
+
+class EncryptionCapabilitiesResponse(NegotiateResponseContext):
+    context_type = SMB2_ENCRYPTION_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateResponseContext.__init__(self, parent)
+        self.ciphers = []
+
+    def _decode(self, cur):
+        cipher_count = cur.decode_uint16le()
+        self.ciphers = [Cipher(cur.decode_uint16le())
+                        for i in xrange(cipher_count)]
+
+class CompressionCapabilitiesRequest(NegotiateRequestContext):
+    context_type = SMB2_COMPRESSION_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateRequestContext.__init__(self, parent)
+        self.compression_algorithms = [SMB2_COMPRESSION_LZ77,
+                                       SMB2_COMPRESSION_LZNT1,
+                                       SMB2_COMPRESSION_PATTERN_V1]
+        self.flags = SMB2_COMPRESSION_CAPABILITIES_FLAG_CHAINED
+
+    def _encode(self, cur):
+        cur.encode_uint16le(len(self.compression_algorithms))
+        # Padding
+        cur.encode_uint16le(0)
+        cur.encode_uint32le(self.flags)
+        for algorithm in self.compression_algorithms:
+            cur.encode_uint16le(algorithm)
+
+class CompressionCapabilitiesResponse(NegotiateResponseContext):
+    context_type = SMB2_COMPRESSION_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateResponseContext.__init__(self, parent)
+        self.compression_algorithms = []
+        self.flags = SMB2_COMPRESSION_CAPABILITIES_FLAG_NONE
+
+    def _decode(self, cur):
+        algorithm_count = cur.decode_uint16le()
+        # Padding
+        cur.decode_uint16le()
+        self.flags = CompressionCapabilitiesFlags(cur.decode_uint32le())
+        self.compression_algorithms = [
+            CompressionAlgorithm(cur.decode_uint16le())
+            for i in xrange(algorithm_count)]
+
+class SigningCapabilitiesRequest(NegotiateRequestContext):
+    context_type = SMB2_SIGNING_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateRequestContext.__init__(self, parent)
+        self.signing_algorithms = [SMB2_SIGNING_AES_GMAC,
+                                   SMB2_SIGNING_AES_CMAC]
+
+    def _encode(self, cur):
+        cur.encode_uint16le(len(self.signing_algorithms))
+        for algorithm in self.signing_algorithms:
+            cur.encode_uint16le(algorithm)
+
+class SigningCapabilitiesResponse(NegotiateResponseContext):
+    context_type = SMB2_SIGNING_CAPABILITIES
+
+    def __init__(self, parent):
+        NegotiateResponseContext.__init__(self, parent)
+        self.signing_algorithms = []
+
+    def _decode(self, cur):
+        algorithm_count = cur.decode_uint16le()
+        self.signing_algorithms = [SigningAlgorithm(cur.decode_uint16le())
+                                   for i in xrange(algorithm_count)]
+
 # Session setup constants
 class SessionFlags(core.FlagEnum):
     SMB2_SESSION_FLAG_NONE    = 0x00
     SMB2_SESSION_FLAG_BINDING = 0x01
+    SMB2_SESSION_FLAG_ENCRYPT_DATA = 0x04
 
 SessionFlags.import_items(globals())
 
@@ -499,11 +1119,11 @@ class SessionSetupRequest(Request):
         # Channel, must not be used
         cur.encode_uint32le(0)
         # Encode 0 for security buffer offset for now
-        sec_buf_ofs = cur.hole.encode_uint16le(0)
+        sec_buf_ofs = cur.reserve_uint16le()
         cur.encode_uint16le(len(self.security_buffer))
         cur.encode_uint64le(self.previous_session_id)
         # Go back and set security buffer offset
-        sec_buf_ofs(cur - self.parent.start)
+        cur.patch_uint16le(sec_buf_ofs, cur - self.parent.start)
         cur.encode_bytes(self.security_buffer)
 
 class SessionSetupResponse(Response):
@@ -540,13 +1160,13 @@ class TreeConnectRequest(Request):
         # Reserved
         cur.encode_uint16le(self.reserved)
         # Path Offset
-        path_offset_hole = cur.hole.encode_uint16le(0)
+        path_offset_hole = cur.reserve_uint16le()
         # Path Length
-        path_lenght_hole = cur.hole.encode_uint16le(0)
+        path_lenght_hole = cur.reserve_uint16le()
 
         if self.path_offset is None:
             self.path_offset = cur - self.parent.start
-        path_offset_hole(self.path_offset)
+        cur.patch_uint16le(path_offset_hole, self.path_offset)
 
         path_start = cur.copy()
         # Path
@@ -554,7 +1174,7 @@ class TreeConnectRequest(Request):
 
         if self.path_length is None:
             self.path_length = cur - path_start
-        path_lenght_hole(self.path_length)
+        cur.patch_uint16le(path_lenght_hole, self.path_length)
 
 
 class TreeConnectResponse(Response):
@@ -761,11 +1381,11 @@ class CreateRequest(Request):
         cur.encode_uint32le(self.create_disposition)
         cur.encode_uint32le(self.create_options)
         
-        name_offset_hole = cur.hole.encode_uint16le(0)
-        name_length_hole = cur.hole.encode_uint16le(0)
+        name_offset_hole = cur.reserve_uint16le()
+        name_length_hole = cur.reserve_uint16le()
 
-        create_contexts_offset_hole = cur.hole.encode_uint32le(0)
-        create_contexts_length_hole = cur.hole.encode_uint32le(0)
+        create_contexts_offset_hole = cur.reserve_uint32le()
+        create_contexts_length_hole = cur.reserve_uint32le()
         
         cur.align(self.parent.start, 2)
         
@@ -774,14 +1394,14 @@ class CreateRequest(Request):
 
         if  self.name_offset is None:
             self.name_offset = cur - self.parent.start
-        name_offset_hole(self.name_offset)
+        cur.patch_uint16le(name_offset_hole, self.name_offset)
 
         name_start = cur.copy()
         cur.encode_utf16le(self.name)
 
         if  self.name_length is None:
             self.name_length = cur - name_start
-        name_length_hole(self.name_length)
+        cur.patch_uint16le(name_length_hole, self.name_length)
 
         if len(self._create_contexts) != 0:
             # Next field of previous context to fill in
@@ -790,25 +1410,25 @@ class CreateRequest(Request):
             con_start = None
             cur.align(self.parent.start, 8)
             create_contexts_start = cur.copy()
-            create_contexts_offset_hole(cur - self.parent.start)
+            cur.patch_uint32le(create_contexts_offset_hole, cur - self.parent.start)
 
             for con in self._create_contexts:
                 cur.align(self.parent.start, 8)
-                if next_hole:
-                    next_hole(cur - con_start)
+                if next_hole is not None:
+                    cur.patch_uint32le(next_hole, cur - con_start)
                 con_start = cur.copy()
-                next_hole = cur.hole.encode_uint32le(0)
+                next_hole = cur.reserve_uint32le()
 
-                name_offset_hole = cur.hole.encode_uint16le(0)
+                name_offset_hole = cur.reserve_uint16le()
                 cur.encode_uint16le(len(con.name))
                 # Reserved
                 cur.encode_uint16le(0)
-                data_offset_hole = cur.hole.encode_uint16le(0)
-                data_length_hole = cur.hole.encode_uint32le(0)
+                data_offset_hole = cur.reserve_uint16le()
+                data_length_hole = cur.reserve_uint32le()
 
                 # Name
                 cur.align(self.parent.start, 8)
-                name_offset_hole(cur - con_start)
+                cur.patch_uint16le(name_offset_hole, cur - con_start)
                 cur.encode_bytes(con.name)
                 name_end = cur.copy()
 
@@ -818,13 +1438,13 @@ class CreateRequest(Request):
                 con.encode(cur)
                 data_length = cur - data_start
                 if data_length:
-                    data_offset_hole(data_start - con_start)
-                    data_length_hole(cur - data_start)
+                    cur.patch_uint16le(data_offset_hole, data_start - con_start)
+                    cur.patch_uint32le(data_length_hole, cur - data_start)
                 else:
                     # Undo align
                     cur.reverseto(name_end)
 
-            create_contexts_length_hole(cur - create_contexts_start)
+            cur.patch_uint32le(create_contexts_length_hole, cur - create_contexts_start)
 
         if cur == buffer_start:
             # Buffer must be at least 1 byte
@@ -840,6 +1460,23 @@ class CreateResponse(Response):
     _context_table = {}
     create_context = core.Register(_context_table, 'name')
 
+    field_spec = [
+        ('oplock_level', 'B', OplockLevel),
+        ('flags', 'B'),
+        ('create_action', 'L'),
+        ('creation_time', 'Q', nttime.NtTime),
+        ('last_access_time', 'Q', nttime.NtTime),
+        ('last_write_time', 'Q', nttime.NtTime),
+        ('change_time', 'Q', nttime.NtTime),
+        ('allocation_size', 'Q'),
+        ('end_of_file', 'Q'),
+        ('file_attributes', 'L', FileAttributes),
+        # Reserved2
+        (None, 'L'),
+        ('file_id', 'QQ'),
+        ('_create_contexts_offset', 'L'),
+        ('_create_contexts_length', 'L')]
+
     def __init__(self, parent):
         Response.__init__(self, parent)
         self.oplock_level = 0
@@ -859,21 +1496,9 @@ class CreateResponse(Response):
         return self._create_contexts
 
     def _decode(self, cur):
-        self.oplock_level = OplockLevel(cur.decode_uint8le())
-        self.flags = cur.decode_uint8le()
-        self.create_action = cur.decode_uint32le()
-        self.creation_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_access_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_write_time = nttime.NtTime(cur.decode_uint64le())
-        self.change_time = nttime.NtTime(cur.decode_uint64le())
-        self.allocation_size = cur.decode_uint64le()
-        self.end_of_file = cur.decode_uint64le()
-        self.file_attributes = FileAttributes(cur.decode_uint32le())
-        # Ignore Reserved2
-        cur.decode_uint32le()
-        self.file_id = (cur.decode_uint64le(),cur.decode_uint64le())
-        create_contexts_offset = cur.decode_uint32le()
-        create_contexts_length = cur.decode_uint32le()
+        self._decode_fields(cur)
+        create_contexts_offset = self._create_contexts_offset
+        create_contexts_length = self._create_contexts_length
 
         if create_contexts_length:
             create_contexts_start = self.parent.start + create_contexts_offset
@@ -1365,17 +1990,19 @@ class CloseRequest(Request):
     command_id = SMB2_CLOSE
     structure_size = 24
 
+    field_spec = [
+        ('flags', 'H'),
+        # Reserved
+        (None, 'L'),
+        ('file_id', 'QQ')]
+
     def __init__(self, parent):
         Request.__init__(self, parent)
         self.flags = 0
         self.file_id = None
 
     def _encode(self, cur):
-        cur.encode_uint16le(self.flags)
-        # Reserved
-        cur.encode_uint32le(0)
-        cur.encode_uint64le(self.file_id[0])
-        cur.encode_uint64le(self.file_id[1])
+        self._encode_fields(cur)
 
 class CloseFlags(core.FlagEnum):
     SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB = 0x0001
@@ -1385,6 +2012,18 @@ CloseFlags.import_items(globals())
 class CloseResponse(Response):
     command_id = SMB2_CLOSE
     structure_size = 60
+
+    field_spec = [
+        ('flags', 'H', CloseFlags),
+        # Reserved
+        (None, 'L'),
+        ('creation_time', 'Q', nttime.NtTime),
+        ('last_access_time', 'Q', nttime.NtTime),
+        ('last_write_time', 'Q', nttime.NtTime),
+        ('change_time', 'Q', nttime.NtTime),
+        ('allocation_size', 'Q'),
+        ('end_of_file', 'Q'),
+        ('file_attributes', 'L', FileAttributes)]
     
     def __init__(self, parent):
         Response.__init__(self, parent)
@@ -1398,16 +2037,7 @@ class CloseResponse(Response):
         self.file_attributes = 0
 
     def _decode(self, cur):
-        self.flags = CloseFlags(cur.decode_uint16le())
-        # Ignore Reserved
-        cur.decode_uint32le()
-        self.creation_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_access_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_write_time = nttime.NtTime(cur.decode_uint64le())
-        self.change_time = nttime.NtTime(cur.decode_uint64le())
-        self.allocation_size = cur.decode_uint64le()
-        self.end_of_file = cur.decode_uint64le()
-        self.file_attributes = FileAttributes(cur.decode_uint32le())
+        self._decode_fields(cur)
 
 class FileInformationClass(core.ValueEnum):
     FILE_DIRECTORY_INFORMATION = 1
@@ -1469,15 +2099,15 @@ class QueryDirectoryRequest(Request):
         cur.encode_uint64le(self.file_id[0])
         cur.encode_uint64le(self.file_id[1])
         
-        file_name_offset_hole = cur.hole.encode_uint16le(0)
-        file_name_length_hole = cur.hole.encode_uint16le(0)
+        file_name_offset_hole = cur.reserve_uint16le()
+        file_name_length_hole = cur.reserve_uint16le()
         
         cur.encode_uint32le(self.output_buffer_length)
         
         file_name_start = cur.copy()
-        file_name_offset_hole(file_name_start - self.parent.start)
+        cur.patch_uint16le(file_name_offset_hole, file_name_start - self.parent.start)
         cur.encode_utf16le(self.file_name)
-        file_name_length_hole(cur - file_name_start)
+        cur.patch_uint16le(file_name_length_hole, cur - file_name_start)
 
 class QueryDirectoryResponse(Response):
     command_id = SMB2_QUERY_DIRECTORY
@@ -1492,6 +2122,7 @@ class QueryDirectoryResponse(Response):
         # Try to figure out file information class by looking up
         # associated request in context
         context = self.context
+        request = None
 
         if context:
             request = context.get_request(parent.message_id)
@@ -1596,6 +2227,7 @@ class QueryInfoResponse(Response):
         self._file_information_class = 0
         
         context = self.context
+        request = None
         if context:
             request = context.get_request(parent.message_id)
         
@@ -1669,8 +2301,8 @@ class SetInfoRequest(Request):
         cur.encode_uint8le(self.info_type)
         cur.encode_uint8le(self.file_information_class)
         
-        buffer_length_hole = cur.hole.encode_uint32le(0)
-        buffer_offset_hole = cur.hole.encode_uint16le(0)
+        buffer_length_hole = cur.reserve_uint32le()
+        buffer_offset_hole = cur.reserve_uint16le()
         cur.encode_uint16le(0)  # Reserved
         
         cur.encode_uint32le(self.security_info)
@@ -1678,12 +2310,12 @@ class SetInfoRequest(Request):
         cur.encode_uint64le(self.file_id[1])
 
         buffer_start = cur.copy()
-        buffer_offset_hole(buffer_start - self.parent.start)
+        cur.patch_uint16le(buffer_offset_hole, buffer_start - self.parent.start)
 
         for info in self._entries:
             info.encode(cur)
 
-        buffer_length_hole(cur - buffer_start)
+        cur.patch_uint32le(buffer_length_hole, cur - buffer_start)
 
 
 class SetInfoResponse(Response):
@@ -1771,6 +2403,18 @@ class FileAllInformation(FileInformation):
 class FileDirectoryInformation(FileInformation):
     file_information_class = FILE_DIRECTORY_INFORMATION
 
+    field_spec = [
+        ('_next_offset', 'L'),
+        ('file_index', 'L'),
+        ('creation_time', 'Q', nttime.NtTime),
+        ('last_access_time', 'Q', nttime.NtTime),
+        ('last_write_time', 'Q', nttime.NtTime),
+        ('change_time', 'Q', nttime.NtTime),
+        ('end_of_file', 'Q'),
+        ('allocation_size', 'Q'),
+        ('file_attributes', 'L', FileAttributes),
+        ('_file_name_length', 'L')]
+
     def __init__(self, parent = None):
         FileInformation.__init__(self, parent)
         self.file_index = 0
@@ -1786,21 +2430,11 @@ class FileDirectoryInformation(FileInformation):
             parent.append(self)
 
     def _decode(self, cur):
-        next_offset = cur.decode_uint32le()
-        self.file_index = cur.decode_uint32le()
-        self.creation_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_access_time = nttime.NtTime(cur.decode_uint64le())
-        self.last_write_time = nttime.NtTime(cur.decode_uint64le())
-        self.change_time = nttime.NtTime(cur.decode_uint64le())
-        self.end_of_file = cur.decode_uint64le()
-        self.allocation_size = cur.decode_uint64le()
-        self.file_attributes = FileAttributes(cur.decode_uint32le())
-
-        file_name_length = cur.decode_uint32le()
-        self.file_name = cur.decode_utf16le(file_name_length)
+        self._decode_fields(cur)
+        self.file_name = cur.decode_utf16le(self._file_name_length)
 
-        if next_offset:
-            cur.advanceto(self.start + next_offset)
+        if self._next_offset:
+            cur.advanceto(self.start + self._next_offset)
         else:
             cur.advanceto(cur.upperbound)
             
@@ -2531,6 +3165,19 @@ class ReadRequest(Request):
     command_id = SMB2_READ
     structure_size = 49
 
+    field_spec = [
+        ('padding', 'B'),
+        ('reserved', 'B'),
+        ('length', 'L'),
+        ('offset', 'Q'),
+        ('file_id', 'QQ'),
+        ('minimum_count', 'L'),
+        ('channel', 'L'),
+        ('remaining_bytes', 'L'),
+        ('read_channel_info_offset', 'H'),
+        ('read_channel_info_length', 'H'),
+        ('buffer', 'B')]
+
     def __init__(self, parent):
         Request.__init__(self, parent)
         self.length = 0
@@ -2547,56 +3194,39 @@ class ReadRequest(Request):
         self.buffer = 0
 
     def _encode(self, cur):
-        # Padding
-        cur.encode_uint8le(self.padding)
-        # Reserved
-        cur.encode_uint8le(self.reserved)
-        cur.encode_uint32le(self.length)
-        cur.encode_uint64le(self.offset)
-        cur.encode_uint64le(self.file_id[0])
-        cur.encode_uint64le(self.file_id[1])
-        cur.encode_uint32le(self.minimum_count)
-        # Channel
-        cur.encode_uint32le(self.channel)
-
-        cur.encode_uint32le(self.remaining_bytes)
-
-        # ReadChannelInfoLength
         if self.read_channel_info_offset is None:
             self.read_channel_info_offset = 0
-        cur.encode_uint16le(self.read_channel_info_offset)
-
-        # ReadChannelInfoLength
         if self.read_channel_info_length is None:
             self.read_channel_info_length = 0
-        cur.encode_uint16le(self.read_channel_info_length)
 
-        # Buffer
-        cur.encode_uint8le(self.buffer)
+        self._encode_fields(cur)
 
 
 class ReadResponse(Response):
     command_id = SMB2_READ
     structure_size = 17
 
+    field_spec = [
+        ('_data_offset', 'B'),
+        # Reserved
+        (None, 'B'),
+        ('_data_length', 'L'),
+        # DataRemaining
+        (None, 'L'),
+        # Reserved2
+        (None, 'L')]
+
     def __init__(self, parent):
         Response.__init__(self, parent)
         self.data = None
 
     def _decode(self, cur):
-        offset = cur.decode_uint8le()
-        # Ignore reserved
-        cur.decode_uint8le()
-        length = cur.decode_uint32le()
-        # Ignore DataRemaining
-        cur.decode_uint32le()
-        # Ignore reserved
-        cur.decode_uint32le()
+        self._decode_fields(cur)
 
         # Advance to data
-        cur.advanceto(self.parent.start + offset)
+        cur.advanceto(self.parent.start + self._data_offset)
 
-        self.data = cur.decode_bytes(length)
+        self.data = cur.decode_bytes(self._data_length)
 
 # Flag constants
 class WriteFlags(core.FlagEnum):
@@ -2608,6 +3238,17 @@ class WriteRequest(Request):
     command_id = SMB2_WRITE
     structure_size = 49
 
+    field_spec = [
+        ('data_offset', 'H'),
+        ('length', 'L'),
+        ('offset', 'Q'),
+        ('file_id', 'QQ'),
+        ('channel', 'L'),
+        ('remaining_bytes', 'L'),
+        ('write_channel_info_offset', 'H'),
+        ('write_channel_info_length', 'H'),
+        ('flags', 'L')]
+
     def __init__(self, parent):
         Request.__init__(self, parent)
         self.offset = 0
@@ -2622,32 +3263,19 @@ class WriteRequest(Request):
         self.write_channel_info_length = 0
 
     def _encode(self, cur):
-        # Encode 0 for buffer offset for now
-        buf_ofs = cur.hole.encode_uint16le(0)
         if self.length == None and self.buffer != None:
-            cur.encode_uint32le(len(self.buffer))
+            length = len(self.buffer)
         elif self.buffer == None:
-            cur.encode_uint32le(0)
+            length = 0
         else:
-            cur.encode_uint32le(self.length)
-        cur.encode_uint64le(self.offset)
-        cur.encode_uint64le(self.file_id[0])
-        cur.encode_uint64le(self.file_id[1])
-        # Channel
-        cur.encode_uint32le(self.channel)
-        # RemainingBytes
-        cur.encode_uint32le(self.remaining_bytes)
-        # WriteChannelInfoOffset
-        cur.encode_uint16le(self.write_channel_info_offset)
-        # WriteChannelInfoLength:
-        cur.encode_uint16le(self.write_channel_info_length)
-        # Flags
-        cur.encode_uint32le(self.flags)
-        # Go back and set buffer offset
+            length = self.length
 
+        # Buffer follows the fixed fields directly
         if self.data_offset is None:
-            self.data_offset = cur - self.parent.start
-        buf_ofs(self.data_offset)
+            self.data_offset = \
+                cur - self.parent.start + self._field_codec.size
+
+        self._encode_fields(cur, length=length)
 
         if self.buffer:
             cur.encode_bytes(self.buffer)
@@ -2656,20 +3284,23 @@ class WriteResponse(Response):
     command_id = SMB2_WRITE
     structure_size = 17
 
+    field_spec = [
+        # Reserved
+        (None, 'H'),
+        ('count', 'L'),
+        # Remaining
+        (None, 'L'),
+        # WriteChannelInfoOffset
+        (None, 'H'),
+        # WriteChannelInfoLength
+        (None, 'H')]
+
     def __init__(self, parent):
         Response.__init__(self, parent)
         self.count = 0
 
     def _decode(self, cur):
-        # Ignore reserved
-        cur.decode_uint16le()
-        self.count = cur.decode_uint32le()
-        # Ignore Remaining
-        cur.decode_uint32le()
-        # Ignore WriteChannelInfoOffset
-        cur.decode_uint16le()
-        # Ignore WriteChannelInfoLength
-        cur.decode_uint16le()
+        self._decode_fields(cur)
 
 class LockFlags(core.FlagEnum):
     SMB2_LOCKFLAG_SHARED_LOCK      = 0x00000001
@@ -2781,8 +3412,8 @@ class IoctlRequest(Request):
         cur.encode_uint64le(self.file_id[0])
         cur.encode_uint64le(self.file_id[1])
         # Create holes where we will fill in offset and count later
-        input_offset_hole = cur.hole.encode_uint32le(0)
-        input_count_hole = cur.hole.encode_uint32le(0)
+        input_offset_hole = cur.reserve_uint32le()
+        input_count_hole = cur.reserve_uint32le()
         cur.encode_uint32le(self.max_input_response)
         #For requests, output offset and count should be 0
         cur.encode_uint32le(self.output_offset)
@@ -2793,12 +3424,12 @@ class IoctlRequest(Request):
         cur.encode_uint32le(0)
 
         buffer_start = cur.copy()
-        input_offset_hole(buffer_start - self.parent.start)
+        cur.patch_uint32le(input_offset_hole, buffer_start - self.parent.start)
         
         # Encode the ioctl
         self.ioctl_input.encode(cur)
         # Set the ioctl count, which is the length in bytes
-        input_count_hole(cur - buffer_start)
+        cur.patch_uint32le(input_count_hole, cur - buffer_start)
 
 class IoctlResponse(Response):
     command_id = SMB2_IOCTL
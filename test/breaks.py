@@ -0,0 +1,70 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        breaks.py
+#
+# Abstract:
+#
+#        Break notification queue tests (no server required)
+#
+
+import pike.model
+import unittest
+
+class BreakQueueTest(unittest.TestCase):
+    def queue(self):
+        # Notifications stand in as (key, sequence) pairs
+        return pike.model._BreakQueue(lambda smb_res: smb_res[0])
+
+    def test_order(self):
+        queue = self.queue()
+        for notification in [('a', 0), ('b', 1), ('a', 2), ('c', 3)]:
+            queue.append(notification)
+        self.assertEqual(queue.pop_key('a'), ('a', 0))
+        self.assertEqual(queue.pop(), ('c', 3))
+        self.assertEqual(queue.pop_key('c'), None)
+        self.assertEqual(queue.pop(), ('a', 2))
+        self.assertEqual(queue.pop_key('a'), None)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.pop(), ('b', 1))
+        self.assertEqual(len(queue), 0)
+
+    def test_claimed_behind_unclaimed(self):
+        # An old notification that is never claimed must not keep
+        # those claimed after it
+        queue = self.queue()
+        queue.append(('old', 0))
+        queue.append(('new', 1))
+        for i in xrange(2, 10000):
+            # Each claim leaves a newer unclaimed notification behind it
+            queue.append(('new', i))
+            self.assertEqual(queue.pop_key('new'), ('new', i - 1))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(len(queue._entries), 2)
+        self.assertEqual(queue.pop(), ('new', 9999))
+        self.assertEqual(queue.pop(), ('old', 0))
+        self.assertEqual(queue._by_key, {})
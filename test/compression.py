@@ -0,0 +1,282 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        compression.py
+#
+# Abstract:
+#
+#        Compression codec and transform tests (no server required)
+#
+
+import pike.cipher
+import pike.compression
+import pike.core
+import pike.netbios
+import pike.smb2
+import array
+import os
+import random
+import struct
+import unittest
+
+def unhex(s):
+    return s.replace(' ', '').decode('hex')
+
+# MS-XCA section 3.1 (plain LZ77)
+lz77_vectors = [
+    ('abcdefghijklmnopqrstuvwxyz',
+     '3f000000 6162636465666768696a6b6c6d6e6f707172737475767778797a'),
+    ('abc' * 100,
+     'ffffff1f 616263 1700 0f ff 2601')]
+
+# Three literals and a copy of length 6 at distance 3, in one chunk
+lznt1_vector = ('abcabcabc', '05b0 08 616263 0320')
+
+def sample_inputs():
+    rand = random.Random(1)
+    return ['', 'a', 'abc', 'abcd' * 3,
+            '\0' * 100000,
+            os.urandom(10000),
+            ''.join(rand.choice('ab ') for i in xrange(20000)),
+            # Matches long enough for each length encoding
+            'x' * 5 + 'y' * 12 + 'z' * 30 + 'w' * 300 + 'v' * 70000]
+
+class CodecContext(object):
+    # Stands in for a connection which negotiated compression
+    def __init__(self):
+        self.codecs = {
+            pike.smb2.SMB2_COMPRESSION_LZNT1: pike.compression.LZNT1(),
+            pike.smb2.SMB2_COMPRESSION_LZ77: pike.compression.LZ77()}
+
+    def compression_codec(self, algorithm):
+        return self.codecs.get(algorithm)
+
+class EncryptedCodecContext(CodecContext):
+    # Stands in for a connection with an encrypted session which also
+    # negotiated compression
+    def __init__(self, cipher):
+        CodecContext.__init__(self)
+        self.cipher = cipher
+
+    def decryption_cipher(self, session_id):
+        return self.cipher
+
+def read_response(data):
+    return struct.pack('<4sHHLHHLLQQQ16sHBBLLL',
+                       '\xfeSMB', 64, 1, 0, pike.smb2.SMB2_READ, 1,
+                       pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR, 0, 5,
+                       0, 7, '\0' * 16, 17, 80, 0, len(data), 0, 0) + data
+
+class CompressionTest(unittest.TestCase):
+    def decompress(self, codec, compressed, size):
+        out = bytearray(size)
+        codec.decompress(compressed, out, 0, size)
+        return str(out)
+
+    def test_lz77_vectors(self):
+        codec = pike.compression.LZ77()
+        for (data, compressed) in lz77_vectors:
+            self.assertEqual(codec.compress(data).tostring(), unhex(compressed))
+            self.assertEqual(self.decompress(codec, unhex(compressed), len(data)),
+                             data)
+
+    def test_lznt1_vector(self):
+        codec = pike.compression.LZNT1()
+        (data, compressed) = lznt1_vector
+        self.assertEqual(codec.compress(data).tostring(), unhex(compressed))
+        self.assertEqual(self.decompress(codec, unhex(compressed), len(data)),
+                         data)
+        # Incompressible chunks are stored as is
+        self.assertEqual(codec.compress('abcd').tostring(), unhex('0330') + 'abcd')
+
+    def test_round_trip(self):
+        for codec in (pike.compression.LZ77(), pike.compression.LZNT1()):
+            for data in sample_inputs():
+                compressed = codec.compress(data).tostring()
+                self.assertEqual(self.decompress(codec, compressed, len(data)),
+                                 data)
+                # Part of the input, into the middle of the output
+                if len(data) > 4:
+                    compressed = codec.compress(data, 2, len(data) - 2).tostring()
+                    out = bytearray('-' * (len(data) + 2))
+                    codec.decompress(compressed, out, 3, len(data) - 4)
+                    self.assertEqual(str(out), '---' + data[2:-2] + '---')
+
+    def test_malformed(self):
+        for codec in (pike.compression.LZ77(), pike.compression.LZNT1()):
+            data = 'abc' * 1000
+            compressed = codec.compress(data).tostring()
+            # Truncated, and decompressing to the wrong size
+            self.assertRaises(pike.core.BadPacket, self.decompress,
+                              codec, compressed[:-2], len(data))
+            self.assertRaises(pike.core.BadPacket, self.decompress,
+                              codec, compressed, len(data) + 1)
+        # A copy from before the start
+        self.assertRaises(pike.core.BadPacket, self.decompress,
+                          pike.compression.LZ77(), unhex('7fffffff 61 0800'), 5)
+
+    def test_encode_negotiate_context(self):
+        nb = pike.netbios.Netbios()
+        smb_req = pike.smb2.Smb2(nb)
+        smb_req.credit_charge = 0
+        smb_req.message_id = 0
+        neg_req = pike.smb2.NegotiateRequest(smb_req)
+        neg_req.dialects = [pike.smb2.DIALECT_SMB3_1_1]
+        neg_req.security_mode = 0
+        neg_req.client_guid = array.array('B', [0] * 16)
+        pike.smb2.CompressionCapabilitiesRequest(neg_req)
+        self.assertEqual(nb.serialize()[-22:].tostring(),
+                         struct.pack('<HHLHHLHHH',
+                                     pike.smb2.SMB2_COMPRESSION_CAPABILITIES,
+                                     14, 0, 3, 0,
+                                     pike.smb2.SMB2_COMPRESSION_CAPABILITIES_FLAG_CHAINED,
+                                     pike.smb2.SMB2_COMPRESSION_LZ77,
+                                     pike.smb2.SMB2_COMPRESSION_LZNT1,
+                                     pike.smb2.SMB2_COMPRESSION_PATTERN_V1))
+
+    def write_request(self, data, context=None, chained=False, min_size=0):
+        nb = pike.netbios.Netbios(context=context)
+        smb_req = pike.smb2.Smb2(nb)
+        write = pike.smb2.WriteRequest(smb_req)
+        write.file_id = (0, 0)
+        write.buffer = array.array('B', data)
+        smb_req.credit_charge = 1
+        smb_req.message_id = 1
+        smb_req.session_id = 1
+        if context is not None:
+            transform = pike.smb2.CompressionTransformHeader(nb)
+            transform.chained = chained
+            transform.pattern = chained
+            transform.min_size = min_size
+        return nb
+
+    def test_compress_unchained(self):
+        data = 'abcd' * 4096
+        plain = self.write_request(data).serialize()[4:].tostring()
+        context = CodecContext()
+        nb = self.write_request(data, context)
+        frame = nb.serialize().tostring()
+        self.assertEqual(nb.transform.payloads, [pike.smb2.SMB2_COMPRESSION_LZ77])
+        self.assertEqual(struct.unpack_from('>L', frame)[0], len(frame) - 4)
+        (protocol_id, size, algorithm, flags, offset) = \
+            struct.unpack_from('<4sLHHL', frame, 4)
+        self.assertEqual((protocol_id, size, algorithm, flags, offset),
+                         ('\xfcSMB', len(plain), pike.smb2.SMB2_COMPRESSION_LZ77,
+                          0, 0))
+        self.assertLess(len(frame), len(plain) / 10)
+        self.assertEqual(self.decompress(pike.compression.LZ77(), frame[20:],
+                                         len(plain)),
+                         plain)
+
+    def test_compress_chained(self):
+        # The zeros are sent as a pattern, and the rest compressed
+        data = '\0' * 65536
+        plain = self.write_request(data).serialize()[4:].tostring()
+        nb = self.write_request(data, CodecContext(), chained=True)
+        frame = nb.serialize().tostring()[4:]
+        self.assertEqual(nb.transform.payloads,
+                         [pike.smb2.SMB2_COMPRESSION_LZ77,
+                          pike.smb2.SMB2_COMPRESSION_PATTERN_V1])
+        # The run starts within the header
+        header = len(plain.rstrip('\0'))
+        (protocol_id, size, algorithm, flags, length, payload_size) = \
+            struct.unpack_from('<4sLHHLL', frame)
+        self.assertEqual((protocol_id, size, algorithm, flags, payload_size),
+                         ('\xfcSMB', len(plain), pike.smb2.SMB2_COMPRESSION_LZ77,
+                          pike.smb2.SMB2_COMPRESSION_FLAG_CHAINED, header))
+        self.assertEqual(self.decompress(pike.compression.LZ77(),
+                                         frame[20:16 + length], header),
+                         plain[:header])
+        self.assertEqual(frame[16 + length:],
+                         struct.pack('<HHLBBHL',
+                                     pike.smb2.SMB2_COMPRESSION_PATTERN_V1,
+                                     pike.smb2.SMB2_COMPRESSION_FLAG_CHAINED,
+                                     8, 0, 0, 0, len(plain) - header))
+
+    def test_not_compressed(self):
+        # Too small, or incompressible
+        for (data, min_size) in (('abcd' * 4096, 1 << 20),
+                                 (os.urandom(8192), 0)):
+            plain = self.write_request(data).serialize()
+            nb = self.write_request(data, CodecContext(), min_size=min_size)
+            self.assertEqual(nb.serialize(), plain)
+            self.assertEqual(nb.transform.payloads, [])
+
+    def test_decompress_response(self):
+        data = 'abcd' * 4096
+        message = read_response(data)
+        lz77 = pike.compression.LZ77().compress(message).tostring()
+        lznt1 = pike.compression.LZNT1().compress(message[100:]).tostring()
+        frames = [
+            struct.pack('<4sLHHL', '\xfcSMB', len(message),
+                        pike.smb2.SMB2_COMPRESSION_LZ77, 0, 0) + lz77,
+            # The first 100 bytes uncompressed
+            struct.pack('<4sLHHL', '\xfcSMB', len(message) - 100,
+                        pike.smb2.SMB2_COMPRESSION_LZNT1, 0, 100) +
+            message[:100] + lznt1,
+            struct.pack('<4sL', '\xfcSMB', len(message) + 10) +
+            struct.pack('<HHL', pike.smb2.SMB2_COMPRESSION_NONE, 1, 100) +
+            message[:100] +
+            struct.pack('<HHLL', pike.smb2.SMB2_COMPRESSION_LZNT1, 1,
+                        len(lznt1) + 4, len(message) - 100) + lznt1 +
+            struct.pack('<HHLBBHL', pike.smb2.SMB2_COMPRESSION_PATTERN_V1, 1,
+                        8, ord('x'), 0, 0, 10)]
+        for frame in frames:
+            nb = pike.netbios.Netbios(context=CodecContext())
+            nb.parse(array.array('B', struct.pack('>L', len(frame)) + frame))
+            self.assertEqual(len(nb), 1)
+            self.assertEqual(nb[0].message_id, 5)
+            self.assertEqual(nb[0][0].data.tostring(), data)
+        self.assertEqual(nb.transform.payloads,
+                         [pike.smb2.SMB2_COMPRESSION_NONE,
+                          pike.smb2.SMB2_COMPRESSION_LZNT1,
+                          pike.smb2.SMB2_COMPRESSION_PATTERN_V1])
+
+        # Compressed, then encrypted
+        cipher = pike.cipher.AES128GCM('k' * 16)
+        nonce = '\2' * cipher.nonce_size
+        for compressed in frames:
+            aad = struct.pack('<16sLHHQ', nonce.ljust(16, '\0'),
+                              len(compressed), 0, 1, 7)
+            (ciphertext, tag) = cipher.encrypt(nonce, aad, compressed)
+            frame = '\xfdSMB' + tag + aad + ciphertext
+            nb = pike.netbios.Netbios(context=EncryptedCodecContext(cipher))
+            nb.parse(array.array('B', struct.pack('>L', len(frame)) + frame))
+            self.assertIsInstance(nb.transform, pike.smb2.TransformHeader)
+            self.assertIsInstance(nb.transform.compression,
+                                  pike.smb2.CompressionTransformHeader)
+            self.assertEqual(len(nb), 1)
+            self.assertEqual(nb[0].message_id, 5)
+            self.assertEqual(nb[0][0].data.tostring(), data)
+
+        # Decompressing to more or less than the original size
+        for size in (len(message) - 1, len(message) + 1):
+            frame = struct.pack('<4sLHHL', '\xfcSMB', size,
+                                pike.smb2.SMB2_COMPRESSION_LZ77, 0, 0) + lz77
+            nb = pike.netbios.Netbios(context=CodecContext())
+            self.assertRaises(pike.core.BadPacket, nb.parse,
+                              array.array('B', struct.pack('>L', len(frame)) + frame))
@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        cursor.py
+#
+# Abstract:
+#
+#        Cursor encode/decode tests (no server required)
+#
+
+import pike.core
+import pike.netbios
+import pike.ntstatus
+import pike.nttime
+import pike.smb2
+import array
+import struct
+import unittest
+
+class CursorTest(unittest.TestCase):
+    def test_struct_cache(self):
+        codec = pike.core.compile_struct('<HHL')
+        self.assertIs(codec, pike.core.compile_struct('<HHL'))
+        self.assertIs(codec, pike.core.compile_struct(codec))
+
+    def test_multi_field_roundtrip(self):
+        arr = array.array('B')
+        cur = pike.core.Cursor(arr, 0)
+        codec = pike.core.compile_struct('<HHL')
+        cur.encode_struct(codec, 1, 2, 3)
+        cur.encode_uint64be(4)
+        self.assertEqual(len(arr), 16)
+
+        cur = pike.core.Cursor(arr, 0)
+        self.assertEqual(cur.decode_struct(codec), (1, 2, 3))
+        self.assertEqual(cur.decode_uint64be(), 4)
+
+    def test_decode_overrun(self):
+        arr = array.array('B', [0]*6)
+        cur = pike.core.Cursor(arr, 0)
+        with self.assertRaises(pike.core.BufferOverrun):
+            cur.decode_struct('<HHL')
+        self.assertEqual(cur.offset, 0)
+
+    def test_smb2_header_encode(self):
+        nb = pike.netbios.Netbios()
+        smb_req = pike.smb2.Smb2(nb)
+        pike.smb2.EchoRequest(smb_req)
+        smb_req.credit_charge = 1
+        smb_req.credit_request = 10
+        smb_req.channel_sequence = 3
+        smb_req.message_id = 42
+        smb_req.session_id = 0x1234
+        smb_req.tree_id = 7
+
+        expected = struct.pack('<4sHHHHHHLLQLLQ16sHH',
+                               '\xfeSMB', 64, 1, 3, 0,
+                               pike.smb2.SMB2_ECHO, 10, 0, 0, 42,
+                               0, 7, 0x1234, '\0' * 16, 4, 0)
+        self.assertEqual(nb.serialize()[4:].tostring(), expected)
+
+    def test_smb2_header_decode(self):
+        packet = struct.pack('<4sHHLHHLLQQQ16sHH',
+                             '\xfeSMB', 64, 1, pike.ntstatus.STATUS_SUCCESS,
+                             pike.smb2.SMB2_ECHO, 10,
+                             pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR |
+                             pike.smb2.SMB2_FLAGS_ASYNC_COMMAND,
+                             0, 42, 0x5678, 0x1234, '\x01' * 16, 4, 0)
+        nb = pike.netbios.Netbios()
+        nb.parse(array.array('B', struct.pack('>L', len(packet)) + packet))
+        smb_res = nb[0]
+
+        self.assertIsInstance(smb_res[0], pike.smb2.EchoResponse)
+        self.assertEqual(smb_res.status, pike.ntstatus.STATUS_SUCCESS)
+        self.assertEqual(smb_res.credit_charge, 1)
+        self.assertEqual(smb_res.credit_response, 10)
+        self.assertEqual(smb_res.message_id, 42)
+        self.assertEqual(smb_res.async_id, 0x5678)
+        self.assertEqual(smb_res.tree_id, None)
+        self.assertEqual(smb_res.session_id, 0x1234)
+        self.assertEqual(smb_res.signature.tostring(), '\x01' * 16)
+
+    def test_reserve_patch(self):
+        arr = array.array('B', [0xff]*4)
+        cur = pike.core.Cursor(arr, 2)
+        length = cur.reserve_uint32le()
+        cur.encode_uint16le(0xabcd)
+        self.assertEqual(length, 2)
+        self.assertEqual(arr.tostring(), '\xff\xff\0\0\0\0\xcd\xab')
+        cur.patch_uint32le(length, 0x01020304)
+        self.assertEqual(cur.offset, 8)
+        self.assertEqual(arr.tostring(), '\xff\xff\x04\x03\x02\x01\xcd\xab')
+
+    def test_hole(self):
+        arr = array.array('B')
+        cur = pike.core.Cursor(arr, 0)
+        hole = cur.hole.encode_uint16be(0)
+        cur.encode_uint8le(7)
+        hole(0x0102)
+        self.assertEqual(cur.offset, 3)
+        self.assertEqual(arr.tostring(), '\x01\x02\x07')
+
+    def test_decode_bytes_array_copies(self):
+        arr = array.array('B', range(8))
+        result = pike.core.Cursor(arr, 2).decode_bytes(4)
+        self.assertIsInstance(result, array.array)
+        arr[2] = 0xff
+        self.assertEqual(result[0], 2)
+
+    def test_decode_bytes_view(self):
+        buf = bytearray(range(8))
+        cur = pike.core.Cursor(buf, 2)
+        view = cur.decode_bytes(4)
+        self.assertIsInstance(view, pike.core.ByteView)
+        self.assertEqual(cur.offset, 6)
+        self.assertEqual(len(view), 4)
+        self.assertEqual(view, array.array('B', [2, 3, 4, 5]))
+        self.assertEqual(array.array('B', [2, 3, 4, 5]), view)
+        self.assertEqual(list(view), [2, 3, 4, 5])
+        self.assertEqual(view[-1], 5)
+        self.assertEqual(view[1:3].tostring(), '\x03\x04')
+
+        copy = view.copy()
+        buf[2] = 0xff
+        self.assertEqual(view[0], 0xff)
+        self.assertEqual(copy[0], 2)
+
+    def test_decode_bytes_memoryview(self):
+        buf = bytearray('\xfeSMB')
+        view = pike.core.Cursor(memoryview(buf), 0).decode_bytes(4)
+        self.assertEqual(view.tostring(), '\xfeSMB')
+        self.assertEqual(view[0], 0xfe)
+
+    def test_encode_bytes_view(self):
+        view = pike.core.Cursor(bytearray('abcd'), 1).decode_bytes(2)
+        arr = array.array('B')
+        pike.core.Cursor(arr, 0).encode_bytes(view)
+        self.assertEqual(arr.tostring(), 'bc')
+
+    def test_encode_bytes_overwrite(self):
+        arr = array.array('B', 'abcdef')
+        cur = pike.core.Cursor(arr, 4)
+        cur.encode_bytes(bytearray('XYZ'))
+        self.assertEqual(arr.tostring(), 'abcdXYZ')
+        cur = pike.core.Cursor(arr, 1)
+        cur.encode_bytes(array.array('B', '12'))
+        cur.encode_bytes([0x33])
+        self.assertEqual(arr.tostring(), 'a123XYZ')
+        self.assertEqual(cur.offset, 4)
+
+    def test_view(self):
+        arr = array.array('B', 'abcdef')
+        cur = pike.core.Cursor(arr, 1)
+        view = cur.view(cur + 3)
+        self.assertIsInstance(view, pike.core.ByteView)
+        self.assertEqual(view, cur[:3])
+        arr[1] = ord('B')
+        self.assertEqual(view.tostring(), 'Bcd')
+        self.assertEqual(cur.view(2).tostring(), 'Bc')
+
+class FieldSpecTest(unittest.TestCase):
+    def test_compiled_codec(self):
+        self.assertEqual(pike.smb2.CloseResponse._field_codec.format,
+                         '<HLQQQQQQL')
+        self.assertEqual(pike.smb2.CloseResponse._field_codec.size, 58)
+
+    def test_close_request_encode(self):
+        nb = pike.netbios.Netbios()
+        smb_req = pike.smb2.Smb2(nb)
+        req = pike.smb2.CloseRequest(smb_req)
+        req.flags = pike.smb2.SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB
+        req.file_id = (1, 2)
+        smb_req.credit_charge = 1
+        smb_req.message_id = 1
+        body = nb.serialize().tostring()[4+64:]
+        self.assertEqual(body, struct.pack('<HHLQQ', 24, 1, 0, 1, 2))
+
+    def test_create_response_decode(self):
+        body = struct.pack('<HBBLQQQQQQLLQQLL', 89, 1, 0, 2,
+                           10, 11, 12, 13, 4096, 100,
+                           pike.smb2.FILE_ATTRIBUTE_NORMAL, 0,
+                           5, 6, 0, 0)
+        header = struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 1, 0,
+                             pike.smb2.SMB2_CREATE, 1,
+                             pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR,
+                             0, 1, 0, 1, '\0' * 16)
+        packet = header + body + '\0' * 8
+        nb = pike.netbios.Netbios()
+        nb.parse(bytearray(struct.pack('>L', len(packet)) + packet))
+        res = nb[0][0]
+        self.assertEqual(res.oplock_level, pike.smb2.SMB2_OPLOCK_LEVEL_II)
+        self.assertIsInstance(res.creation_time, pike.nttime.NtTime)
+        self.assertEqual(res.change_time, 13)
+        self.assertEqual(res.file_attributes,
+                         pike.smb2.FILE_ATTRIBUTE_NORMAL)
+        self.assertEqual(res.file_id, (5, 6))
+        self.assertNotIn('_create_contexts_offset', res.fields)
+        self.assertEqual(res.fields.count('file_id'), 1)
+
+class LazyDecodeTest(unittest.TestCase):
+    class Context(object):
+        lazy_decode = True
+
+    def create_response(self):
+        body = struct.pack('<HBBLQQQQQQLLQQLL', 89, 0, 0, 2,
+                           10, 11, 12, 13, 4096, 100,
+                           pike.smb2.FILE_ATTRIBUTE_NORMAL, 0,
+                           5, 6, 0, 0)
+        header = struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 1, 0,
+                             pike.smb2.SMB2_CREATE, 1,
+                             pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR,
+                             0, 1, 0, 1, '\0' * 16)
+        packet = header + body + '\0' * 8
+        return bytearray(struct.pack('>L', len(packet)) + packet)
+
+    def test_deferred(self):
+        nb = pike.netbios.Netbios(self.Context())
+        nb.parse(self.create_response())
+        res = nb[0][0]
+        self.assertEqual(nb[0].status, pike.ntstatus.STATUS_SUCCESS)
+        self.assertIn('_deferred', res.__dict__)
+        self.assertNotIn('file_id', res.__dict__)
+        self.assertEqual(res.end - res.start, 96)
+
+        self.assertEqual(res.file_id, (5, 6))
+        self.assertNotIn('_deferred', res.__dict__)
+        self.assertEqual(res.create_action, 2)
+
+    def test_same_as_eager(self):
+        eager = pike.netbios.Netbios()
+        eager.parse(self.create_response())
+        lazy = pike.netbios.Netbios(self.Context())
+        lazy.parse(self.create_response())
+        self.assertEqual(str(lazy), str(eager))
+        self.assertEqual(lazy[0][0].fields, eager[0][0].fields)
@@ -0,0 +1,188 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        encryption.py
+#
+# Abstract:
+#
+#        Transform cipher tests (no server required)
+#
+
+import pike.cipher
+import pike.model
+import pike.netbios
+import pike.smb2
+import array
+import struct
+import unittest
+
+def unhex(s):
+    return s.replace(' ', '').decode('hex')
+
+# RFC 3610 packet vector 1 (13-byte nonce, 8-byte tag)
+ccm_key = unhex('c0c1c2c3c4c5c6c7c8c9cacbcccdcecf')
+ccm_nonce = unhex('00000003020100a0a1a2a3a4a5')
+ccm_packet = unhex('000102030405060708090a0b0c0d0e0f'
+                   '101112131415161718191a1b1c1d1e')
+ccm_result = unhex('588c979a61c663d2f066d0c2c0f98980'
+                   '6d5f6b61dac38417e8d12cfdf926e0')
+
+# NIST GCM specification test cases 1, 2 and 4 (AES-128)
+gcm_vectors = [
+    ('00000000000000000000000000000000',
+     '000000000000000000000000',
+     '',
+     '',
+     '',
+     '58e2fccefa7e3061367f1d57a4e7455a'),
+    ('00000000000000000000000000000000',
+     '000000000000000000000000',
+     '',
+     '00000000000000000000000000000000',
+     '0388dace60b6a392f328c2b971b2fe78',
+     'ab6e47d42cec13bdf53a67b21257bddf'),
+    ('feffe9928665731c6d6a8f9467308308',
+     'cafebabefacedbaddecaf888',
+     'feedfacedeadbeeffeedfacedeadbeefabaddad2',
+     'd9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72'
+     '1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b39',
+     '42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e'
+     '21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091',
+     '5bc94fbc3221a5db94fae95ae7121a47')]
+
+class TransformContext(object):
+    # Stands in for a connection with an encrypted session, using
+    # one cipher in both directions
+    def __init__(self, cipher):
+        self.cipher = cipher
+
+    def encryption_cipher(self, session_id):
+        return self.cipher
+
+    def decryption_cipher(self, session_id):
+        return self.cipher
+
+class StandInConnection(object):
+    # Stands in for a connection which negotiated no cipher
+    def __init__(self):
+        self.client = pike.model.Client()
+        self.negotiate_response = pike.smb2.NegotiateResponse(
+            pike.smb2.Smb2(pike.netbios.Netbios()))
+        self.negotiate_response.security_mode = 0
+
+    def request(self, nb=None):
+        return pike.smb2.Smb2(pike.netbios.Netbios())
+
+class EncryptionTest(unittest.TestCase):
+    def test_ccm_vector(self):
+        ccm = pike.cipher.AES128CCM(ccm_key, tag_size=8)
+        (ciphertext, tag) = ccm.encrypt(ccm_nonce, ccm_packet[:8], ccm_packet[8:])
+        self.assertEqual(ciphertext + tag, ccm_result)
+        self.assertEqual(ccm.decrypt(ccm_nonce, ccm_packet[:8], ciphertext, tag),
+                         ccm_packet[8:])
+
+    def test_gcm_vectors(self):
+        for (key, nonce, aad, plaintext, ciphertext, tag) in gcm_vectors:
+            gcm = pike.cipher.AES128GCM(unhex(key))
+            self.assertEqual(gcm.encrypt(unhex(nonce), unhex(aad), unhex(plaintext)),
+                             (unhex(ciphertext), unhex(tag)))
+            self.assertEqual(gcm.decrypt(unhex(nonce), unhex(aad),
+                                         unhex(ciphertext), unhex(tag)),
+                             unhex(plaintext))
+
+    def test_tampered(self):
+        for cipher in (pike.cipher.AES128CCM(ccm_key),
+                       pike.cipher.AES128GCM(ccm_key)):
+            nonce = '\1' * cipher.nonce_size
+            (ciphertext, tag) = cipher.encrypt(nonce, 'header', 'x' * 100)
+            ciphertext = 'y' + ciphertext[1:]
+            self.assertIsNone(cipher.decrypt(nonce, 'header', ciphertext, tag))
+
+    def echo_request(self, context):
+        nb = pike.netbios.Netbios(context=context)
+        smb_req = pike.smb2.Smb2(nb)
+        pike.smb2.EchoRequest(smb_req)
+        smb_req.credit_charge = 1
+        smb_req.message_id = 5
+        smb_req.session_id = 7
+        if context is not None:
+            transform = pike.smb2.TransformHeader(nb)
+            transform.session_id = 7
+        return nb
+
+    def test_encrypt_request(self):
+        for cipher in (pike.cipher.AES128CCM(ccm_key),
+                       pike.cipher.AES128GCM(ccm_key)):
+            plaintext = self.echo_request(None).serialize()[4:].tostring()
+            frame = self.echo_request(TransformContext(cipher)).serialize().tostring()
+            (protocol_id, tag, nonce, size, _, flags, session_id) = \
+                struct.unpack_from('<4s16s16sLHHQ', frame, 4)
+            self.assertEqual(protocol_id, '\xfdSMB')
+            self.assertEqual(size, len(plaintext))
+            self.assertEqual(flags, pike.smb2.SMB2_TRANSFORM_FLAG_ENCRYPTED)
+            self.assertEqual(session_id, 7)
+            self.assertEqual(nonce[cipher.nonce_size:],
+                             '\0' * (16 - cipher.nonce_size))
+            self.assertEqual(cipher.decrypt(nonce[:cipher.nonce_size],
+                                            frame[24:56], frame[56:], tag),
+                             plaintext)
+
+    def test_decrypt_response(self):
+        for cipher in (pike.cipher.AES128CCM(ccm_key),
+                       pike.cipher.AES128GCM(ccm_key)):
+            message = struct.pack('<4sHHLHHLLQQQ16sHH',
+                                  '\xfeSMB', 64, 1, 0, pike.smb2.SMB2_ECHO, 1,
+                                  pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR, 0, 5,
+                                  0, 7, '\0' * 16, 4, 0)
+            nonce = '\2' * cipher.nonce_size
+            aad = struct.pack('<16sLHHQ', nonce.ljust(16, '\0'), len(message),
+                              0, 1, 7)
+            (ciphertext, tag) = cipher.encrypt(nonce, aad, message)
+            frame = '\xfdSMB' + tag + aad + ciphertext
+            frame = struct.pack('>L', len(frame)) + frame
+
+            nb = pike.netbios.Netbios(context=TransformContext(cipher))
+            nb.parse(array.array('B', frame))
+            self.assertEqual(nb.transform.session_id, 7)
+            self.assertEqual(len(nb), 1)
+            self.assertEqual(nb[0].message_id, 5)
+            self.assertIsInstance(nb[0][0], pike.smb2.EchoResponse)
+
+            corrupt = frame[:-1] + chr(ord(frame[-1]) ^ 1)
+            nb = pike.netbios.Netbios(context=TransformContext(cipher))
+            self.assertRaises(pike.core.BadPacket, nb.parse,
+                              array.array('B', corrupt))
+
+    def test_encrypted_share_without_cipher(self):
+        session = pike.model.Session(None, 1, None)
+        chan = pike.model.Channel(StandInConnection(), session, None)
+        smb_res = pike.smb2.Smb2(pike.netbios.Netbios())
+        smb_res.tree_id = 1
+        tree_res = pike.smb2.TreeConnectResponse(smb_res)
+        tree_res.share_flags = pike.smb2.SMB2_SHAREFLAG_ENCRYPT_DATA
+        tree = pike.model.Tree(session, 'share', smb_res)
+        self.assertRaises(pike.model.StateError, chan.request, obj=tree)
@@ -0,0 +1,61 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        enums.py
+#
+# Abstract:
+#
+#        Enum tests (no server required)
+#
+
+import pike.smb2
+import unittest
+
+class EnumTest(unittest.TestCase):
+    def test_interned(self):
+        self.assertIs(pike.smb2.CommandId(pike.smb2.SMB2_READ.real),
+                      pike.smb2.SMB2_READ)
+        self.assertIs(pike.smb2.CommandId.SMB2_READ, pike.smb2.SMB2_READ)
+        self.assertIsInstance(pike.smb2.CommandId.SMB2_READ,
+                              pike.smb2.CommandId)
+
+    def test_value_invalid(self):
+        self.assertRaises(ValueError, pike.smb2.CommandId, 0xffff)
+
+    def test_flags_valid(self):
+        value = pike.smb2.Flags(pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR.real |
+                                pike.smb2.SMB2_FLAGS_SIGNED.real)
+        self.assertEqual(str(value),
+                         str(pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR |
+                             pike.smb2.SMB2_FLAGS_SIGNED))
+        self.assertIs(pike.smb2.Flags(value.real), value)
+
+    def test_flags_invalid(self):
+        self.assertRaises(ValueError, pike.smb2.CloseFlags, 0x2)
+        # Invalid values are not interned
+        self.assertRaises(ValueError, pike.smb2.CloseFlags, 0x2)
+
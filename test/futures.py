@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        futures.py
+#
+# Abstract:
+#
+#        Future, gather and wait_any tests (no server required)
+#
+
+import pike.model
+import unittest
+
+class FutureTest(unittest.TestCase):
+    def test_none_result(self):
+        future = pike.model.Future()
+        self.assertFalse(future.done)
+        future.complete(None)
+        self.assertTrue(future.done)
+        self.assertIs(future.wait(timeout=0.1), future)
+        self.assertIs(future.wait_interim(timeout=0.1), future)
+        self.assertIsNone(future.result(timeout=0.1))
+
+    def test_then_none(self):
+        future = pike.model.Future()
+        derived = future.then(lambda f: None)
+        self.assertFalse(derived.done)
+        future.complete(1)
+        self.assertTrue(derived.done)
+        self.assertIsNone(derived.result(timeout=0.1))
+
+    def test_then_completed_none(self):
+        future = pike.model.Future()
+        future.complete(None)
+        calls = []
+        future.then(calls.append)
+        self.assertEqual(calls, [future])
+
+    def test_gather_none(self):
+        future = pike.model.Future()
+        derived = future.then(lambda f: None)
+        future.complete(1)
+        self.assertEqual(pike.model.gather([future, derived], timeout=0.1),
+                         [1, None])
+
+    def test_wait_any_none(self):
+        first = pike.model.Future()
+        second = pike.model.Future()
+        second.complete(None)
+        self.assertIs(pike.model.wait_any([first, second], timeout=0.1), second)
+
+    def test_wait_any_repeated(self):
+        # The usual loop over pending futures must not leave callbacks
+        # on those still pending
+        futures = [pike.model.Future() for i in xrange(10)]
+        pending = list(futures)
+        for future in futures:
+            self.assertRaises(pike.model.TimeoutError,
+                              pike.model.wait_any, pending, 0.001)
+            future.complete(None)
+            self.assertIs(pike.model.wait_any(pending, timeout=0.1), future)
+            pending.remove(future)
+            for other in pending:
+                self.assertEqual(other.notify, [])
+
+    def test_wait_pending(self):
+        future = pike.model.Future()
+        self.assertRaises(pike.model.TimeoutError, future.wait, 0.01)
+
+class TaskTest(unittest.TestCase):
+    def test_yield_none_task(self):
+        @pike.model.coroutine
+        def inner(future):
+            yield future
+
+        @pike.model.coroutine
+        def outer(future):
+            first = yield inner(future)
+            second = yield [inner(future), future]
+            raise pike.model.Return((first, second))
+
+        future = pike.model.Future()
+        task = outer(future)
+        self.assertFalse(task.done)
+        future.complete(None)
+        self.assertTrue(task.done)
+        self.assertEqual(task.result(timeout=0.1), (None, [None, None]))
+
+    def test_yield_completed_none_task(self):
+        @pike.model.coroutine
+        def inner():
+            raise pike.model.Return()
+            yield
+
+        @pike.model.coroutine
+        def outer():
+            value = yield inner()
+            raise pike.model.Return([value])
+
+        self.assertEqual(outer().result(timeout=0.1), [None])
+
+class PipelineTest(unittest.TestCase):
+    def test_none_results_free_slots(self):
+        pipeline = pike.model.Pipeline(1)
+        future = pike.model.Future()
+        pipeline.submit(lambda: future.then(lambda f: None))
+        self.assertEqual(len(pipeline), 1)
+        future.complete(1)
+        self.assertEqual(len(pipeline), 0)
+
+        @pike.model.coroutine
+        def finish():
+            raise pike.model.Return()
+            yield
+
+        for i in xrange(3):
+            pipeline.submit(finish)
+        self.assertEqual(len(pipeline), 0)
+        pipeline.wait(timeout=0.1)
@@ -0,0 +1,95 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        mid.py
+#
+# Abstract:
+#
+#        Message id allocator tests (no server required)
+#
+
+import pike.model
+import random
+import unittest
+
+class MessageIdTest(unittest.TestCase):
+    def test_sequential(self):
+        mids = pike.model.MessageIdAllocator()
+        self.assertEqual([mids.allocate() for i in xrange(4)], [0, 1, 2, 3])
+
+    def test_reserve(self):
+        mids = pike.model.MessageIdAllocator()
+        mids.reserve(1)
+        mids.reserve(3, 2)
+        self.assertEqual([mids.allocate() for i in xrange(4)], [0, 2, 5, 6])
+
+    def test_multi_credit(self):
+        mids = pike.model.MessageIdAllocator()
+        mids.reserve(5)
+        # A range of 4 does not fit before the reserved id
+        self.assertEqual(mids.allocate(2), 0)
+        self.assertEqual(mids.allocate(4), 6)
+        self.assertEqual(mids.allocate(), 10)
+
+    def test_reserve_passed(self):
+        mids = pike.model.MessageIdAllocator()
+        mids.allocate(10)
+        mids.reserve(3)
+        mids.reserve(8, 4)
+        self.assertEqual(mids.allocate(), 12)
+
+    def test_stress(self):
+        # Millions of ids with sparse reserved ids and ranges, which
+        # must never be allocated and never overlap
+        rand = random.Random(0)
+        mids = pike.model.MessageIdAllocator()
+        count = 2000000
+        reserved = []
+        for i in xrange(2000):
+            start = rand.randrange(count)
+            length = rand.choice((1, 1, 1, 16))
+            mids.reserve(start, length)
+            reserved.append((start, start + length))
+        reserved.sort()
+
+        allocated = []
+        total = 0
+        while total < count:
+            length = rand.choice((1, 1, 1, 1, 2, 16))
+            start = mids.allocate(length)
+            allocated.append((start, start + length))
+            total += length
+
+        index = 0
+        previous_end = 0
+        for (start, end) in allocated:
+            self.assertGreaterEqual(start, previous_end)
+            previous_end = end
+            while index < len(reserved) and reserved[index][1] <= start:
+                index += 1
+            if index < len(reserved):
+                self.assertGreaterEqual(reserved[index][0], end)
@@ -101,3 +101,14 @@ class CapMulticredit(CapTest):
     # multicredit cap is not advertised to downlevel client
     def test_downlevel(self):
         self.downlevel_cap(smb2.SMB2_GLOBAL_CAP_LARGE_MTU)
+
+class Negotiate311(CapTest):
+    # 3.1.1 negotiate selects SHA-512 and starts the preauth hash
+    def test_preauth_integrity(self):
+        conn = self.negotiate(smb2.DIALECT_SMB3_1_1, 0)
+        contexts = [con for con in conn.negotiate_response
+                    if isinstance(con, smb2.PreauthIntegrityCapabilitiesResponse)]
+        self.assertEqual(len(contexts), 1)
+        self.assertEqual(contexts[0].hash_algorithms,
+                         [smb2.SMB2_PREAUTH_INTEGRITY_SHA512])
+        self.assertEqual(len(conn.preauth_integrity_hash.value), 64)
@@ -0,0 +1,189 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        preauth.py
+#
+# Abstract:
+#
+#        SMB 3.1.1 negotiate context and preauth integrity tests
+#        (no server required)
+#
+
+import pike.core
+import pike.digest
+import pike.model
+import pike.netbios
+import pike.smb2
+import array
+import hashlib
+import hmac
+import struct
+import unittest
+
+client_guid = array.array('B', range(16))
+salt = array.array('B', range(32, 64))
+
+# The negotiate request below, laid out by hand from MS-SMB2 2.2.3
+negotiate_request = (
+    struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                '\0' * 16) +
+    struct.pack('<HHHHL16sLHH', 36, 2, 1, 0, 0, client_guid.tostring(),
+                104, 2, 0) +
+    struct.pack('<HH', 0x0300, 0x0311) +
+    struct.pack('<HHLHHH', 1, 38, 0, 1, 32, 1) + salt.tostring() +
+    '\0' * 2 +
+    struct.pack('<HHLHHH', 2, 6, 0, 2, 2, 1))
+
+# Negotiate response with a 3-byte security buffer and both contexts
+negotiate_response = (
+    struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 0, 0, 0, 1, 1, 0, 0, 0, 0,
+                '\0' * 16) +
+    struct.pack('<HHHH16sLLLLQQHHL', 65, 1, 0x0311, 2, '\0' * 16, 0,
+                65536, 65536, 65536, 0, 0, 128, 3, 136) +
+    'abc' + '\0' * 5 +
+    struct.pack('<HHLHHH', 1, 38, 0, 1, 32, 1) + salt.tostring() +
+    '\0' * 2 +
+    struct.pack('<HHLHH', 2, 4, 0, 1, 2))
+
+# Negotiate response choosing AES-GMAC signing
+signing_response = (
+    struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 0, 0, 0, 1, 1, 0, 0, 0, 0,
+                '\0' * 16) +
+    struct.pack('<HHHH16sLLLLQQHHL', 65, 1, 0x0311, 1, '\0' * 16, 0,
+                65536, 65536, 65536, 0, 0, 128, 3, 136) +
+    'abc' + '\0' * 5 +
+    struct.pack('<HHLHH', 8, 4, 0, 1, 2))
+
+# Hash values after each message of a negotiate request, negotiate
+# response, session setup request and session setup response
+# consisting of 'a', 'bb', 'ccc' and 'dddd' repeated 100 times,
+# recorded from the definition in MS-SMB2 3.2.5.2
+preauth_vectors = [
+    ('a' * 100,
+     '8254c6514b4fa7f56d76bd81d8645232e677bd066aa7f9ce8135c3f5efb5a348'
+     '8db6aed3ad70a03efacdd22941188194b468cadcb9b15ea451f8fd4a7bd22d88'),
+    ('bb' * 100,
+     'f7c64b987fa25be2985667e6ea37070f44ab26554a441081e7b8da029ae38549'
+     '90e2802b7225c3df205155dae6f62c7b29f08f0589f1da60bb34228095c7723d'),
+    ('ccc' * 100,
+     '35553cf746d2890d725f5eeeff264195c94a5cbfa4b58899c4a116a280ec0303'
+     'e91cfe55b70ac7f7f1ea131bb76c510154f9a7c85f8feafd2625da3e4a1649d2'),
+    ('dddd' * 100,
+     'cdbd290764ab6f93ff2e884ceed53dc04eb3dff63673a7121277451014a8f527'
+     '17abd0995dafb22b81f55d1d42ca38b8c17cc212317e46bd165ed765b9de1dd9')]
+
+def chain(messages):
+    # Straightforward restatement of the hash chain
+    value = '\0' * 64
+    values = []
+    for message in messages:
+        value = hashlib.sha512(value + message).digest()
+        values.append(value)
+    return values
+
+class PreauthTest(unittest.TestCase):
+    def test_encode_negotiate_contexts(self):
+        nb = pike.netbios.Netbios()
+        smb_req = pike.smb2.Smb2(nb)
+        smb_req.credit_charge = 0
+        smb_req.message_id = 0
+        neg_req = pike.smb2.NegotiateRequest(smb_req)
+        neg_req.dialects = [pike.smb2.DIALECT_SMB3_0, pike.smb2.DIALECT_SMB3_1_1]
+        neg_req.security_mode = pike.smb2.SMB2_NEGOTIATE_SIGNING_ENABLED
+        neg_req.client_guid = client_guid
+        preauth = pike.smb2.PreauthIntegrityCapabilitiesRequest(neg_req)
+        preauth.salt = salt
+        pike.smb2.EncryptionCapabilitiesRequest(neg_req)
+        self.assertEqual(nb.serialize()[4:].tostring(), negotiate_request)
+
+    def test_decode_negotiate_contexts(self):
+        nb = pike.netbios.Netbios()
+        nb.parse(array.array('B', struct.pack('>L', len(negotiate_response)) +
+                             negotiate_response))
+        neg_res = nb[0][0]
+        self.assertEqual(neg_res.dialect_revision, pike.smb2.DIALECT_SMB3_1_1)
+        self.assertEqual(neg_res.security_buffer.tostring(), 'abc')
+        (preauth, encryption) = neg_res.children
+        self.assertEqual(preauth.hash_algorithms,
+                         [pike.smb2.SMB2_PREAUTH_INTEGRITY_SHA512])
+        self.assertEqual(preauth.salt, salt)
+        self.assertEqual(encryption.ciphers,
+                         [pike.smb2.SMB2_ENCRYPTION_AES128_GCM])
+
+    def test_decode_signing_context(self):
+        nb = pike.netbios.Netbios()
+        nb.parse(array.array('B', struct.pack('>L', len(signing_response)) +
+                             signing_response))
+        (signing,) = nb[0][0].children
+        self.assertEqual(signing.signing_algorithms,
+                         [pike.smb2.SMB2_SIGNING_AES_GMAC])
+
+    def test_hash_chain(self):
+        preauth = pike.digest.PreauthIntegrityHash()
+        for (message, value) in preauth_vectors:
+            # Fold in views of a larger buffer, as frames are
+            buf = bytearray('xx' + message + 'yy')
+            preauth.update(pike.core.ByteView(buf, 2, 2 + len(message)))
+            self.assertEqual(preauth.value.encode('hex'), value)
+
+    def test_hash_copy(self):
+        preauth = pike.digest.PreauthIntegrityHash()
+        preauth.update('negotiate')
+        session = preauth.copy()
+        session.update('session setup')
+        self.assertNotEqual(preauth.value, session.value)
+        self.assertEqual(session.value,
+                         chain(['negotiate', 'session setup'])[1])
+
+    def test_derive_key_311(self):
+        key = 'k' * 16
+        preauth = '\1' * 64
+        message = struct.pack('>L', 1) + 'SMBSigningKey\0' + '\0' + preauth + \
+                  struct.pack('>L', 128)
+        self.assertEqual(
+            pike.digest.derive_key(key, 'SMBSigningKey', preauth,
+                                   terminate_context=False).tostring(),
+            hmac.new(key, message, hashlib.sha256).digest())
+
+class DialectTest(unittest.TestCase):
+    def test_default_dialects(self):
+        # 3.1.1 changes the negotiate and key derivation, so it is
+        # only offered when asked for
+        self.assertEqual(pike.model.Client().dialects,
+                         [pike.smb2.DIALECT_SMB2_002,
+                          pike.smb2.DIALECT_SMB2_1,
+                          pike.smb2.DIALECT_SMB3_0])
+
+    def test_validate_negotiate_311(self):
+        class StandInConnection(object):
+            negotiate_response = pike.smb2.NegotiateResponse(
+                pike.smb2.Smb2(pike.netbios.Netbios()))
+        StandInConnection.negotiate_response.dialect_revision = \
+            pike.smb2.DIALECT_SMB3_1_1
+        chan = pike.model.Channel(StandInConnection(), None, None)
+        self.assertRaises(pike.model.StateError,
+                          chan.validate_negotiate_info, None)
@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        readrange.py
+#
+# Abstract:
+#
+#        Channel.read_range reassembly tests (no server required)
+#
+
+import pike.model
+import pike.netbios
+import pike.ntstatus
+import pike.smb2
+import unittest
+
+class StandInConnection(object):
+    def __init__(self, max_read_size):
+        self._large_mtu = True
+        self.negotiate_response = pike.smb2.NegotiateResponse(
+            pike.smb2.Smb2(pike.netbios.Netbios()))
+        self.negotiate_response.max_read_size = max_read_size
+
+class StandInChannel(pike.model.Channel):
+    """
+    Channel whose reads complete at once from an in-memory file,
+    failing with STATUS_END_OF_FILE at or past its end as a server does
+    """
+    def __init__(self, contents, max_read_size):
+        pike.model.Channel.__init__(self,
+                                    StandInConnection(max_read_size),
+                                    None,
+                                    None)
+        self.contents = contents
+        self.reads = []
+
+    def read_async(self, file, length, offset):
+        self.reads.append((offset, length))
+        future = pike.model.Future()
+        if offset >= len(self.contents):
+            smb_res = pike.smb2.Smb2(pike.netbios.Netbios())
+            smb_res.command = pike.smb2.SMB2_READ
+            smb_res.status = pike.ntstatus.STATUS_END_OF_FILE
+            future.complete(pike.model.ResponseError(smb_res))
+        else:
+            future.complete(self.contents[offset:offset+length])
+        return future
+
+class ReadRangeTest(unittest.TestCase):
+    contents = ''.join(chr(i % 251) for i in xrange(1000))
+
+    def test_whole_chunks(self):
+        chan = StandInChannel(self.contents, 100)
+        data = chan.read_range(None, 0, 1000)
+        self.assertEqual(data.tostring(), self.contents)
+        self.assertEqual(len(chan.reads), 10)
+
+    def test_end_inside_range(self):
+        # The chunk holding the end comes back short and the chunks
+        # after it fail with STATUS_END_OF_FILE
+        chan = StandInChannel(self.contents, 128)
+        data = chan.read_range(None, 50, 4000)
+        self.assertEqual(data.tostring(), self.contents[50:])
+
+    def test_end_on_chunk_boundary(self):
+        chan = StandInChannel(self.contents, 100)
+        data = chan.read_range(None, 0, 2000)
+        self.assertEqual(data.tostring(), self.contents)
+
+    def test_start_at_end(self):
+        chan = StandInChannel(self.contents, 100)
+        self.assertRaises(pike.model.ResponseError,
+                          chan.read_range, None, 1000, 300)
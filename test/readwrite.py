@@ -196,3 +196,30 @@ class ReadWriteTest(pike.test.PikeTest):
 
         chan.close(file)
         chan.close(file2)
+
+    # Test that a range larger than the negotiated limits is split
+    # into several requests and reassembled
+    def test_write_read_range(self):
+        chan, tree = self.tree_connect()
+        negotiate_response = chan.connection.negotiate_response
+        size = 3 * max(negotiate_response.max_read_size,
+                       negotiate_response.max_write_size) + 123
+        buffer = ''.join(chr(i % 251) for i in xrange(size))
+
+        share_all = pike.smb2.FILE_SHARE_READ | pike.smb2.FILE_SHARE_WRITE | pike.smb2.FILE_SHARE_DELETE
+
+        file = chan.create(tree,
+                           'write.txt',
+                           access=pike.smb2.FILE_READ_DATA | pike.smb2.FILE_WRITE_DATA | pike.smb2.DELETE,
+                           share=share_all,
+                           disposition=pike.smb2.FILE_SUPERSEDE,
+                           options=pike.smb2.FILE_DELETE_ON_CLOSE,
+                           oplock_level=pike.smb2.SMB2_OPLOCK_LEVEL_EXCLUSIVE).result()
+
+        bytes_written = chan.write_range(file, 0, buffer)
+        self.assertEqual(bytes_written, size)
+
+        data = chan.read_range(file, 0, size)
+        self.assertEqual(data.tostring(), buffer)
+
+        chan.close(file)
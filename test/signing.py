@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        signing.py
+#
+# Abstract:
+#
+#        Signing digest tests (no server required)
+#
+
+import pike.cipher
+import pike.core
+import pike.digest
+import pike.netbios
+import pike.smb2
+import array
+import struct
+import unittest
+
+# RFC 4493 section 4
+cmac_key = '2b7e151628aed2a6abf7158809cf4f3c'.decode('hex')
+cmac_message = ('6bc1bee22e409f96e93d7e117393172a'
+                'ae2d8a571e03ac9c9eb76fac45af8e51'
+                '30c81c46a35ce411e5fbc1191a0a52ef'
+                'f69f2445df4f9b17ad2b417be66c3710').decode('hex')
+cmac_vectors = [
+    (0, 'bb1d6929e95937287fa37d129b756746'),
+    (16, '070a16b46b4d4144f79bdd9dd04a287c'),
+    (40, 'dfa66747de9ae63030ca32611497c827'),
+    (64, '51f0bebf7e3b9d92fc49741779363cfe')]
+
+# NIST GCM test vectors, 128-bit key with additional data only
+gmac_key = '77be63708971c4e240d1cb79e8d77feb'.decode('hex')
+gmac_nonce = 'e0e00f19fed7ba0136a797f3'.decode('hex')
+gmac_message = '7a43ec1d9c0a5a78a0b16533a6213cab'.decode('hex')
+gmac_tag = '209fcc8d3675ed938e9c7166709dd946'.decode('hex')
+
+class SigningContext(object):
+    # Stands in for a connection with a signed session
+    def __init__(self, digest, key):
+        self.digest = digest
+        self.key = key
+
+    def signing_digest(self):
+        return self.digest
+
+    def signing_key(self, session_id):
+        return self.key
+
+class SigningTest(unittest.TestCase):
+    def test_cmac_vectors(self):
+        for (length, mac) in cmac_vectors:
+            self.assertEqual(
+                pike.digest.aes128_cmac(cmac_key, cmac_message[:length]).tostring(),
+                mac.decode('hex'))
+
+    def test_cmac_buffer_types(self):
+        key = array.array('B', cmac_key)
+        mac = cmac_vectors[2][1].decode('hex')
+        message = cmac_message[:40]
+        for buf in (array.array('B', message),
+                    bytearray(message),
+                    memoryview(bytearray(message)),
+                    pike.core.ByteView(bytearray('xx' + message), 2, 42)):
+            self.assertEqual(pike.digest.aes128_cmac(key, buf).tostring(), mac)
+
+    def test_hmac_vector(self):
+        # RFC 4231 test case 2
+        mac = pike.digest.sha256_hmac('Jefe', 'what do ya want for nothing?')
+        self.assertEqual(mac.tostring().encode('hex'),
+                         '5bdcc146bf60754e6a042426089575c7'
+                         '5a003f089d2739839dec58b964ec3843')
+
+    def test_hmac_long_key(self):
+        # RFC 4231 test case 6, where the key is hashed first
+        mac = pike.digest.sha256_hmac(
+            '\xaa' * 131,
+            'Test Using Larger Than Block-Size Key - Hash Key First')
+        self.assertEqual(mac.tostring().encode('hex'),
+                         '60e431591ee0b67f0d8a26aacbf5b77f'
+                         '8e0bc6213728c5140546040f0ee37f54')
+
+    def test_derive_key_cached(self):
+        key = array.array('B', range(16))
+        first = pike.digest.derive_key(key, 'SMB2AESCMAC', 'SmbSign')
+        first[0] ^= 0xff
+        second = pike.digest.derive_key(key.tostring(), 'SMB2AESCMAC', 'SmbSign')
+        self.assertEqual(len(second), 32)
+        self.assertNotEqual(first, second)
+        first[0] ^= 0xff
+        self.assertEqual(first, second)
+
+    def test_gmac_vector(self):
+        gmac = pike.cipher.AES128GCM(gmac_key)
+        self.assertEqual(gmac.mac(gmac_nonce, gmac_message), gmac_tag)
+        # Parts need not be whole blocks
+        self.assertEqual(gmac.mac(gmac_nonce, gmac_message[:5],
+                                  gmac_message[5:7], gmac_message[7:]),
+                         gmac_tag)
+
+    def signed_echo(self, context):
+        nb = pike.netbios.Netbios(context=context)
+        smb_req = pike.smb2.Smb2(nb, context=context)
+        pike.smb2.EchoRequest(smb_req)
+        smb_req.credit_charge = 1
+        smb_req.credit_request = 1
+        smb_req.message_id = 0x123456789a
+        smb_req.session_id = 1
+        smb_req.flags |= pike.smb2.SMB2_FLAGS_SIGNED
+        return nb.serialize()
+
+    def test_gmac_nonce(self):
+        # Message id, then bit 0 for responses and bit 1 for cancel
+        key = array.array('B', range(16))
+        gmac = pike.cipher.AES128GCM(key)
+        for (command, flags, role) in (
+                (pike.smb2.SMB2_ECHO, 0, 0),
+                (pike.smb2.SMB2_ECHO, pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR, 1),
+                (pike.smb2.SMB2_CANCEL, pike.smb2.SMB2_FLAGS_ASYNC_COMMAND, 2)):
+            header = struct.pack('<4sHHLHHLLQQQ16s', '\xfeSMB', 64, 0, 0,
+                                 command, 1, flags, 0, 0x123456789a, 0, 1,
+                                 '\0' * 16)
+            nonce = struct.pack('<QL', 0x123456789a, role)
+            self.assertEqual(pike.cipher.aes128_gmac(key, header).tostring(),
+                             gmac.mac(nonce, header))
+
+    def test_gmac_verify(self):
+        key = array.array('B', range(16))
+        context = SigningContext(pike.cipher.aes128_gmac, key)
+        frame = self.signed_echo(context)
+        # Signed as a request, so the response nonce does not verify
+        frame[4 + 16] |= pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR
+        nb = pike.netbios.Netbios()
+        nb.parse(frame)
+        self.assertRaises(pike.core.BadPacket,
+                          nb[0].verify, pike.cipher.aes128_gmac, key)
+        nb[0].sign(pike.cipher.aes128_gmac, key)
+        nb[0].verify(pike.cipher.aes128_gmac, key)
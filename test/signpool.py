@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2013, EMC Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Module Name:
+#
+#        signpool.py
+#
+# Abstract:
+#
+#        Signing pool tests against a loopback stand-in server
+#        (no server required)
+#
+
+import pike.digest
+import pike.model
+import pike.smb2
+import array
+import socket
+import struct
+import threading
+import unittest
+
+key = array.array('B', range(16))
+
+def _recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+class SignedReadServer(threading.Thread):
+    """ Answers read requests with signed responses granting one credit """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def response(self, message_id):
+        header = struct.pack('<4sHHLHHLLQQQ16s',
+                             '\xfeSMB', 64, 1, 0, pike.smb2.SMB2_READ, 1,
+                             pike.smb2.SMB2_FLAGS_SERVER_TO_REDIR |
+                             pike.smb2.SMB2_FLAGS_SIGNED,
+                             0, message_id, 0, 1, '\0' * 16)
+        frame = bytearray(header + struct.pack('<HBBLLL', 17, 80, 0, 4, 0, 0) +
+                          'data')
+        frame[48:64] = pike.digest.sha256_hmac(key, frame)[:16].tostring()
+        return struct.pack('>L', len(frame)) + str(frame)
+
+    def run(self):
+        (sock, _) = self.listener.accept()
+        while True:
+            length = _recv_exactly(sock, 4)
+            if length is None:
+                break
+            frame = _recv_exactly(sock, struct.unpack('>L', length)[0])
+            if frame is None:
+                break
+            sock.sendall(self.response(struct.unpack_from('<Q', frame, 24)[0]))
+        sock.close()
+
+class SigningPoolTest(unittest.TestCase):
+    def read(self, pool):
+        server = SignedReadServer()
+        server.start()
+        conn = pike.model.Client(signing_pool=pool).connect('127.0.0.1',
+                                                             server.port)
+        # Stand in for a negotiated, signed session
+        conn.signing_key = lambda session_id: key
+        conn.signing_digest = lambda: pike.digest.sha256_hmac
+        try:
+            futures = []
+            for i in xrange(4):
+                smb_req = conn.request()
+                smb_req.session_id = 1
+                smb_req.flags |= pike.smb2.SMB2_FLAGS_SIGNED
+                read_req = pike.smb2.ReadRequest(smb_req)
+                read_req.length = 4
+                read_req.file_id = (0, 0)
+                futures.extend(conn.submit(smb_req.parent))
+            results = pike.model.gather(futures, timeout=5)
+            self.assertEqual([smb_res[0].data.tostring() for smb_res in results],
+                             ['data'] * 4)
+        finally:
+            conn.close()
+
+    def test_inline(self):
+        self.read(None)
+
+    def test_pool_limited_credits(self):
+        # Each response grants the one credit the next read needs
+        pool = pike.model.SigningPool(2)
+        try:
+            self.read(pool)
+        finally:
+            pool.close()